@@ -0,0 +1,72 @@
+"""Memory benchmark for parsed messages.
+
+Every FinTS3PinTanClient keeps the parsed BPD and UPD of its bank. This
+benchmark restores a number of clients from a data blob with a BPD of
+typical segments (see messages.BPD_SEGMENTS) and reports the memory held per
+client, as measured by tracemalloc, right after restoring and after using the
+client: looking up every parameter segment and serializing the client again
+(which reads every field of every segment).
+
+Run from the repository root::
+
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --clients 100 --segments 1000
+"""
+import argparse
+import gc
+import os.path
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fints.client import FinTS3PinTanClient  # noqa: E402
+from fints.formals import SegmentSequence  # noqa: E402
+
+from messages import synthetic_bpd  # noqa: E402
+
+
+def client_blob(segment_count):
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', 'https://127.0.0.1/', product_id='DEADBEEF')
+    bpd = SegmentSequence(synthetic_bpd(segment_count))
+    client.bpa = bpd.find_segment_first('HIBPA')
+    client.bpd_version = client.bpa.bpd_version
+    client.bpd = SegmentSequence(bpd.find_segments(callback=lambda s: s.header.type not in ('HIBPA', 'HIUPD')))
+    client.upd = SegmentSequence(bpd.find_segments('HIUPD'))
+    return client.deconstruct()
+
+
+def measure(blob, count, touch):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    clients = []
+    for _ in range(count):
+        client = FinTS3PinTanClient('12345678', 'test1', '1234', 'https://127.0.0.1/', product_id='DEADBEEF',
+                                    from_data=blob)
+        if touch:
+            for segment in client.bpd.segments:
+                client.bpd.find_segment_first(segment.header.type)
+            client.deconstruct()
+        clients.append(client)
+    gc.collect()
+    retval = (tracemalloc.get_traced_memory()[0] - start) / count
+    tracemalloc.stop()
+    return retval
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=20, help="number of clients to keep (default: 20)")
+    parser.add_argument('--segments', type=int, default=300, help="number of BPD segments (default: 300)")
+    args = parser.parse_args()
+
+    blob = client_blob(args.segments)
+    print("{} BPD/UPD segments, {} clients".format(args.segments, args.clients))
+    print("{:>24} {:>14}".format("", "KiB per client"))
+    print("{:>24} {:>14.1f}".format("restored", measure(blob, args.clients, False) / 1024))
+    print("{:>24} {:>14.1f}".format("restored and used", measure(blob, args.clients, True) / 1024))
+
+
+if __name__ == '__main__':
+    main()
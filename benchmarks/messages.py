@@ -0,0 +1,111 @@
+"""Test messages for the benchmarks: the bundled tests/messages/*.bin plus synthetic messages of configurable size."""
+import glob
+import os.path
+
+MESSAGE_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'messages')
+
+#: Typical BPD segments (taken from the mock bank in tests/conftest.py), segment numbers are replaced
+BPD_SEGMENTS = [
+    b"HIBPA:{}:3:4+78+280:12345678+Test Bank+1+1+300+500",
+    b"HIKOM:{}:4:4+280:12345678+1+3:http?://127.0.0.1?:8000/",
+    b"HISHV:{}:3:4+J+RDH:3+PIN:1+RDH:9+RDH:10+RDH:7",
+    b"HIEKAS:{}:5:4+1+1+1+J:J:N:3",
+    b"HIKAZS:{}:6:4+1+1+1+365:J:N",
+    b"HIKAZS:{}:7:4+1+1+1+365:J:N",
+    b"HISALS:{}:7:4+1+1+1",
+    b"HISPAS:{}:1:4+1+1+1+J:J:N:sepade?:xsd?:pain.001.001.02.xsd:sepade?:xsd?:pain.001.002.02.xsd"
+    b":sepade?:xsd?:pain.001.002.03.xsd:sepade?:xsd?:pain.001.003.03.xsd:sepade?:xsd?:pain.008.002.02.xsd"
+    b":sepade?:xsd?:pain.008.003.02.xsd",
+    b"HICCMS:{}:1:4+1+1+1+500:N:N",
+    b"HIDMCS:{}:1:4+1+1+1+500:N:N:2:45:2:45::sepade?:xsd?:pain.008.003.02.xsd",
+    b"HITANS:{}:5:4+1+1+1+J:N:0:942:2:MTAN2:mobileTAN::mobile TAN:6:1:SMS:3:1:J:1:0:N:0:2:N:J:00:1:1:962:2:HHD1.4:HHD"
+    b":1.4:Smart-TAN plus manuell:6:1:Challenge:3:1:J:1:0:N:0:2:N:J:00:1:1:972:2:HHD1.4OPT:HHDOPT1:1.4"
+    b":Smart-TAN plus optisch:6:1:Challenge:3:1:J:1:0:N:0:2:N:J:00:1:1",
+    b"HIPINS:{}:1:4+1+1+1+5:20:6:Benutzer ID::HKSPA:N:HKKAZ:N:HKSAL:N:HKSLA:J:HKSUB:J:HKTUA:J:HKTUB:N:HKTUE:J"
+    b":HKTUL:J:HKUEB:J:HKUMB:J:HKPRO:N:HKEKA:N:HKPPD:J:HKPAE:J:HKPSP:N:HKQTG:N:HKCSB:N:HKCSL:J:HKCSE:J:HKCCS:J"
+    b":HKCCM:J:HKDSE:J:HKBSE:J:HKDME:J:HKBME:J:HKCDB:N:HKCDL:J:HKCDN:J:HKDSB:N:HKCUB:N:HKCUM:J:HKCDE:J:HKDSW:J"
+    b":HKDMC:J:HKDSC:J:HKECA:N:HKTAN:N",
+    b"HIUPD:{}:6:4+1::280:12345678+DE111234567800000001+test1++EUR+Fullname++Girokonto++HKSAK:1+HKISA:1+HKSSP:1"
+    b"+HKSAL:1+HKKAZ:1+HKEKA:1+HKCDB:1+HKPSP:1+HKCSL:1+HKCDL:1+HKPAE:1+HKPPD:1+HKCDN:1+HKCSB:1+HKCUB:1+HKQTG:1"
+    b"+HKSPA:1+HKDSB:1+HKCCM:1+HKCUM:1+HKCCS:1+HKCDE:1+HKCSE:1+HKDSW:1+HKPRO:1+HKTUL:1+HKTUB:1",
+]
+
+#: A MT940 booking, as contained in HIKAZ
+MT940_BOOKING = (
+    b":61:150101C182,34NMSCNONREF\r\n"
+    b":86:051?00UEBERWEISG?10931?20Ihre Kontonummer 0000001234\r\n"
+    b"?21/Test Ueberweisung 1?22n WS EREF: 1100011011 IBAN:\r\n"
+    b"?23 DE1100000100000001234 BIC?24: GENODE11 ?1011010100\r\n"
+)
+
+#: A HIRMS and a HIKAZ segment with a short statement, repeated for the tokenizer benchmarks
+TOKENIZER_STATEMENT = (
+    b":20:STARTUMS\r\n:25:12345678/0000000001\r\n:28C:0\r\n"
+    b":61:150101C182,34NMSCNONREF\r\n:86:051?00UEBERWEISG?10931\r\n"
+)
+TOKENIZER_SEGMENTS = (
+    b"HIRMS:3:2:4+0010::Nachricht entgegengenommen.+3040::Es liegen weitere Informationen vor?: 1'"
+    b"HIKAZ:5:7:4+@" + str(len(TOKENIZER_STATEMENT)).encode('us-ascii') + b"@" + TOKENIZER_STATEMENT + b"'"
+)
+
+
+#: Envelope of a bank response, the segments of the actual message go into HNVSD
+ENVELOPE_HEAD = (
+    b"HNHBK:1:3+000000000428+300+430711670077=043999659571CN9D=+2+430711670077=043999659571CN9D=:2'"
+    b"HNVSK:998:3+PIN:1+998+1+2::oIm3BlHv6mQBAADYgbPpp?+kWrAQA+1+2:2:13:@8@00000000:5:1"
+    b"+280:15050500:hermes:S:0:0+0'"
+)
+ENVELOPE_TAIL = b"HNHBS:5:1+2'"
+
+
+def bundled_messages():
+    """Return the messages in tests/messages as a dict of name -> bytes."""
+    retval = {}
+    for path in sorted(glob.glob(os.path.join(MESSAGE_DIR, '*.bin'))):
+        with open(path, 'rb') as f:
+            retval[os.path.basename(path).rsplit('.', 1)[0]] = f.read()
+    return retval
+
+
+def synthetic_bpd(segment_count):
+    """A message with segment_count BPD/UPD segments. Segment numbers wrap around after 999."""
+    segments = []
+    for i in range(segment_count):
+        template = BPD_SEGMENTS[i % len(BPD_SEGMENTS)]
+        segments.append(template.replace(b"{}", str(i % 999 + 1).encode('us-ascii')) + b"'")
+    return b"".join(segments)
+
+
+def envelope(inner):
+    """Wrap a message into HNHBK/HNVSK/HNVSD/HNHBS, as the bank does"""
+    return ENVELOPE_HEAD + b"HNVSD:999:1+@" + str(len(inner)).encode('us-ascii') + b"@" + inner + b"'" + ENVELOPE_TAIL
+
+
+def synthetic_init_response(segment_count):
+    """A bank response to a dialog initialization, with segment_count BPD/UPD segments"""
+    inner = (
+        b"HIRMG:3:2+0010::Nachricht entgegengenommen.'"
+        b"HIRMS:4:2:4+0020::Auftrag ausgefuehrt.'"
+        + synthetic_bpd(segment_count)
+        + b"HIUPA:998:4:4+test1+3+0'"
+    )
+    return envelope(inner)
+
+
+def synthetic_statement(segment_count, payload_size):
+    """A bank response with segment_count HIKAZ segments, that carry payload_size bytes of MT940 data in total.
+
+    Segment numbers only have three digits, so they wrap around in larger messages."""
+    per_segment = max(payload_size // segment_count, len(MT940_BOOKING))
+    statement = MT940_BOOKING * (per_segment // len(MT940_BOOKING))
+    segments = []
+    for i in range(segment_count):
+        segments.append(
+            "HIKAZ:{}:7:3+@{}@".format(i % 990 + 3, len(statement)).encode('us-ascii') + statement + b"'"
+        )
+    return envelope(b"HIRMG:2:2+0010::Nachricht entgegengenommen.'" + b"".join(segments))
+
+
+def synthetic_tokenizer_message(size):
+    """At least size bytes of HIRMS and HIKAZ segments"""
+    return TOKENIZER_SEGMENTS * (size // len(TOKENIZER_SEGMENTS) + 1)
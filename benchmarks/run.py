@@ -0,0 +1,325 @@
+"""Benchmark suite for python-fints.
+
+Measures parsing and serializing of the bundled test messages and of synthetic
+messages (a BPD with 10000 segments, a statement response with 10000 HIKAZ
+segments and 50 MB of MT940 data), with every parser engine and mode,
+tokenizing messages from 10 KB to 50 MB (the MB/s should stay about the same),
+repeated fields with 10000 values, SegmentSequence.find_segments,
+FinTS3Client.process_response_message, decoding of base64 encoded responses,
+FinTSDialog.finish_message and FinTSDialog.send (over InProcessConnection).
+Reports operations and bytes per second. Needs no network access.
+
+Run from the repository root::
+
+    python benchmarks/run.py             # everything
+    python benchmarks/run.py -k parse    # only benchmarks with "parse" in their name
+    python benchmarks/run.py -k /generic # the generic parser engine, to compare with parse/<message>
+    python benchmarks/run.py --quick     # synthetic messages scaled down by 100
+"""
+import argparse
+import base64
+import functools
+import os.path
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fints.client import FinTS3PinTanClient  # noqa: E402
+from fints.connection import RESPONSE_CHUNK_SIZE, InProcessConnection, ResponseDecoder  # noqa: E402
+from fints.dialog import FinTSDialog  # noqa: E402
+from fints.formals import (  # noqa: E402
+    KTI1, DataElementGroupField, NumericField, SegmentSequence, TransactionTanRequired,
+)
+from fints.parser import FinTS3Parser, FinTS3Serializer, ParserState, Token  # noqa: E402
+from fints.security import (  # noqa: E402
+    PinTanDummyEncryptionMechanism, PinTanOneStepAuthenticationMechanism,
+)
+from fints.segments.base import FinTS3Segment  # noqa: E402
+from fints.segments.dialog import HIRMS2, HKEND1  # noqa: E402
+from fints.segments.statement import HIKAZ7  # noqa: E402
+from fints.segments.transfer import HKCCS1  # noqa: E402
+
+from messages import (  # noqa: E402
+    bundled_messages, synthetic_bpd, synthetic_init_response, synthetic_statement, synthetic_tokenizer_message,
+)
+
+BENCHMARKS = []
+
+#: Arguments of FinTS3Parser for the parse/<message>/<variant> benchmarks, next to parse/<message> with the defaults
+PARSER_VARIANTS = {
+    'generic': dict(engine='generic'),
+    'codegen': dict(engine='codegen'),
+    'trusted': dict(trusted=True),
+    'codegen_trusted': dict(engine='codegen', trusted=True),
+    'skim': dict(skim={'HIRMG', 'HIRMS'}),
+}
+
+
+def benchmark(name):
+    """Register a benchmark. The decorated function is called with the scale factor of the
+    synthetic messages and returns (setup, func, size): setup() is called before every run of
+    func(setup_result) and is not measured, size is the number of bytes processed by one run."""
+    def decorator(f):
+        BENCHMARKS.append((name, f))
+        return f
+    return decorator
+
+
+def messages(scale):
+    retval = bundled_messages()
+    retval['bpd_10k'] = synthetic_bpd(int(10000 * scale))
+    retval['statement_10k_50mb'] = synthetic_statement(int(10000 * scale), int(50 * 1024 * 1024 * scale))
+    return retval
+
+
+def decode_response(body):
+    decoder = ResponseDecoder()
+    for i in range(0, len(body), RESPONSE_CHUNK_SIZE):
+        decoder.feed(body[i:i + RESPONSE_CHUNK_SIZE])
+    return decoder.close()
+
+
+def dialog():
+    response = bundled_messages()['basic_simple']
+    # Answers every message with the same response
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', InProcessConnection(lambda data: response), product_id='BENCHMARK')
+    return FinTSDialog(
+        client,
+        enc_mechanism=PinTanDummyEncryptionMechanism(1),
+        auth_mechanisms=[PinTanOneStepAuthenticationMechanism(client.pin)],
+    )
+
+
+def register_message_benchmarks(scale):
+    retval = []
+    for name, data in messages(scale).items():
+        def parse(scale, data=data, kwargs={}):
+            parser = FinTS3Parser(**kwargs)
+            return None, lambda _: parser.parse_message(data), len(data)
+
+        def serialize(scale, data=data):
+            message = FinTS3Parser().parse_message(data)
+            serializer = FinTS3Serializer()
+            return None, lambda _: serializer.serialize_message(message), len(data)
+
+        retval.append(('parse/{}'.format(name), parse))
+        for variant, kwargs in PARSER_VARIANTS.items():
+            retval.append(('parse/{}/{}'.format(name, variant), functools.partial(parse, data=data, kwargs=kwargs)))
+        retval.append(('serialize/{}'.format(name), serialize))
+    BENCHMARKS[:0] = retval
+
+
+def tokenize(data):
+    parser = ParserState(data)
+    while parser.peek() != Token.EOF:
+        parser.consume()
+
+
+def tokenize_benchmark(size):
+    def f(scale):
+        data = synthetic_tokenizer_message(int(size * scale))
+        return None, lambda _: tokenize(data), len(data)
+    return f
+
+
+for size, label in ((10 * 1024, '10kb'), (100 * 1024, '100kb'), (1024 * 1024, '1mb'), (10 * 1024 * 1024, '10mb'),
+                    (50 * 1024 * 1024, '50mb')):
+    benchmark('tokenize/{}'.format(label))(tokenize_benchmark(size))
+
+
+@benchmark('find_segments/bpd_10k/type')
+def find_segments_type(scale):
+    data = synthetic_bpd(int(10000 * scale))
+    message = FinTS3Parser().parse_message(data)
+    return None, lambda _: list(message.find_segments('HIPINS')), len(data)
+
+
+@benchmark('find_segments/statement_10k_50mb/class_nested')
+def find_segments_nested(scale):
+    data = synthetic_statement(int(10000 * scale), int(50 * 1024 * 1024 * scale))
+    message = FinTS3Parser().parse_message(data)
+    return None, lambda _: list(message.find_segments(HIKAZ7)), len(data)
+
+
+@benchmark('find_segments/basic_complicated/first')
+def find_segments_first(scale):
+    data = bundled_messages()['basic_complicated']
+    message = FinTS3Parser().parse_message(data)
+    return None, lambda _: message.find_segment_first(HIRMS2), len(data)
+
+
+class BENCHL1(FinTS3Segment):
+    """Segment with long repeated fields, for the value list benchmarks"""
+    numbers = NumericField(max_count=10000, required=False)
+    transactions = DataElementGroupField(type=TransactionTanRequired, max_count=10000, required=False)
+
+
+def long_list_segment(size):
+    return BENCHL1(
+        numbers=range(size),
+        transactions=[TransactionTanRequired('HK{:03d}'.format(i % 1000), bool(i % 2)) for i in range(size)],
+    )
+
+
+@benchmark('valuelist/10k/assign')
+def valuelist_assign(scale):
+    segment = BENCHL1()
+    numbers = list(range(10000))
+
+    def assign(_):
+        segment.numbers = numbers
+    return None, assign, 0
+
+
+@benchmark('valuelist/10k/iterate')
+def valuelist_iterate(scale):
+    segment = long_list_segment(10000)
+    return None, lambda _: (list(segment.numbers), list(segment.transactions)), 0
+
+
+@benchmark('valuelist/10k/index')
+def valuelist_index(scale):
+    segment = long_list_segment(10000)
+
+    def index(_):
+        transactions = segment.transactions
+        for i in range(len(transactions)):
+            transactions[i].tan_required
+    return None, index, 0
+
+
+@benchmark('valuelist/10k/parse')
+def valuelist_parse(scale):
+    data = FinTS3Serializer().serialize_message(long_list_segment(10000))
+    parser = FinTS3Parser()
+    return None, lambda _: parser.parse_message(data), len(data)
+
+
+@benchmark('valuelist/10k/serialize')
+def valuelist_serialize(scale):
+    data = FinTS3Serializer().serialize_message(long_list_segment(10000))
+    message = FinTS3Parser().parse_message(data)
+    serializer = FinTS3Serializer(cache=False)
+    return None, lambda _: serializer.serialize_message(message), len(data)
+
+
+def process_response_benchmark(data):
+    d = dialog()
+    parser = FinTS3Parser()
+    # A new message for every run, so that no index of find_segments() is reused
+    return lambda: parser.parse_message(data), lambda m: d.client.process_response_message(d, m), len(data)
+
+
+@benchmark('process_response/init_100')
+def process_response_small(scale):
+    return process_response_benchmark(synthetic_init_response(100))
+
+
+@benchmark('process_response/init_1k')
+def process_response_large(scale):
+    return process_response_benchmark(synthetic_init_response(1000))
+
+
+@benchmark('decode_response/statement_10k_50mb')
+def decode_response_large(scale):
+    data = synthetic_statement(int(10000 * scale), int(50 * 1024 * 1024 * scale))
+    body = base64.b64encode(data)
+    return None, lambda _: decode_response(body), len(data)
+
+
+def finish_message_benchmark(*make_segments):
+    d = dialog()
+
+    def setup():
+        message = d.new_customer_message()
+        for make_segment in make_segments:
+            message += make_segment()
+        return message
+
+    sample = setup()
+    d.finish_message(sample)
+    return setup, d.finish_message, len(sample.render_bytes())
+
+
+@benchmark('finish_message/hkend')
+def finish_message_small(scale):
+    return finish_message_benchmark(lambda: HKEND1('0'))
+
+
+@benchmark('finish_message/hkccs_1mb')
+def finish_message_large(scale):
+    pain = b'<Document>' + b'x' * int(1024 * 1024 * max(scale, 0.01)) + b'</Document>'
+    account = KTI1('DE111234567800000001', 'GENODE23X42', '1234567800000001', None, None)
+    return finish_message_benchmark(lambda: HKCCS1(account, 'urn:iso:std:iso:20022:tech:xsd:pain.001.001.03', pain))
+
+
+@benchmark('finish_message/100_segments')
+def finish_message_many(scale):
+    return finish_message_benchmark(*[lambda: HKEND1('0')] * 100)
+
+
+def send_benchmark(make_segment):
+    d = dialog()
+    d.open = True
+    d.need_init = False
+
+    def send(_):
+        d.send(make_segment())
+
+    sample = d.new_customer_message()
+    sample += make_segment()
+    d.finish_message(sample)
+    return None, send, len(sample.render_bytes())
+
+
+@benchmark('dialog_send/hkend')
+def dialog_send_small(scale):
+    return send_benchmark(lambda: HKEND1('0'))
+
+
+@benchmark('dialog_send/hkccs_1mb')
+def dialog_send_large(scale):
+    pain = b'<Document>' + b'x' * int(1024 * 1024 * max(scale, 0.01)) + b'</Document>'
+    account = KTI1('DE111234567800000001', 'GENODE23X42', '1234567800000001', None, None)
+    return send_benchmark(lambda: HKCCS1(account, 'urn:iso:std:iso:20022:tech:xsd:pain.001.001.03', pain))
+
+
+def measure(setup, func, min_time):
+    """Run func until min_time seconds have been spent in it, return (runs, seconds)."""
+    runs = 0
+    total = 0.0
+    while total < min_time or runs < 3:
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg)
+        total += time.perf_counter() - start
+        runs += 1
+    return runs, total
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument('-k', dest='filter', default='', help="Only run benchmarks whose name contains this string")
+    argparser.add_argument('--quick', action='store_true', help="Scale the synthetic messages down by 100")
+    argparser.add_argument('--min-time', type=float, default=1.0, help="Minimum time to spend per benchmark, in seconds")
+    args = argparser.parse_args()
+
+    scale = 0.01 if args.quick else 1
+    register_message_benchmarks(scale)
+
+    warnings.simplefilter('ignore')
+    print("{:<50} {:>8} {:>12} {:>12} {:>10}".format("benchmark", "runs", "ops/s", "MB/s", "size"))
+    for name, f in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        setup, func, size = f(scale)
+        runs, seconds = measure(setup, func, args.min_time)
+        print("{:<50} {:>8} {:>12.1f} {:>12.2f} {:>10}".format(
+            name, runs, runs / seconds, size * runs / seconds / 1e6, size
+        ), flush=True)
+
+
+if __name__ == '__main__':
+    main()
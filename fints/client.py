@@ -1,9 +1,10 @@
 import datetime
+import inspect
 import logging
 from abc import ABCMeta, abstractmethod
 from base64 import b64decode
 from collections import OrderedDict
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from decimal import Decimal
 from enum import Enum
 
@@ -12,15 +13,15 @@ from sepaxml import SepaTransfer
 
 from . import version
 from .camt_parser import camt053_to_dict
-from .connection import FinTSHTTPSConnection
-from .dialog import FinTSDialog
+from .connection import AsyncFinTSHTTPSConnection, FinTSConnection, FinTSHTTPSConnection
+from .dialog import AsyncFinTSDialog, FinTSDialog
 from .exceptions import *
 from .formals import (
     CUSTOMER_ID_ANONYMOUS, KTI1, BankIdentifier, DescriptionRequired,
     SynchronizationMode, TANMediaClass4, TANMediaType2,
     SupportedMessageTypes, StatementFormat, TANUsageOption
 )
-from .message import FinTSInstituteMessage
+from .message import FinTSInstituteMessage, ResponseDispatcher
 from .models import SEPAAccount, Transaction
 from .parser import FinTS3Serializer
 from .security import (
@@ -131,6 +132,11 @@ _RESPONSE_STATUS_MAPPING = {
 }
 
 
+def _is_bpd_segment_type(type_):
+    # Bank parameter segments are named like HIxxxS, HIBPA is the header of the bank parameter data
+    return (len(type_) == 6 and type_[1] == 'I' and type_[5] == 'S') or type_ == 'HIBPA'
+
+
 class TransactionResponse:
     """Result of a FinTS operation.
 
@@ -164,6 +170,8 @@ class FinTSClientMode(Enum):
 
 
 class FinTS3Client:
+    dialog_class = FinTSDialog
+
     def __init__(self,
                  bank_identifier, user_id, customer_id=None,
                  from_data: bytes=None, system_id=None,
@@ -192,6 +200,8 @@ class FinTS3Client:
         self.product_name = product_id
         self.product_version = product_version
         self.response_callbacks = []
+        self.response_dispatcher = ResponseDispatcher()
+        self._register_response_handlers(self.response_dispatcher)
         self.mode = mode
         self.init_tan_response = None
         self._standing_dialog = None
@@ -208,35 +218,31 @@ class FinTS3Client:
     def _process_response(self, dialog, segment, response):
         pass
 
-    def process_response_message(self, dialog, message: FinTSInstituteMessage, internal_send=True):
-        bpa = message.find_segment_first(HIBPA3)
+    def _register_response_handlers(self, dispatcher):
+        """Register the handlers for the segments of response messages, see process_response_message().
+
+        Handlers are called in the order of registration. Subclasses can register additional handlers."""
+        dispatcher.register(self._handle_bpd, type_filter=_is_bpd_segment_type)
+        dispatcher.register(self._handle_upd, (HIUPA4, 'HIUPD'))
+        dispatcher.register(self._handle_responses, HIRMG2)
+        dispatcher.register(self._handle_responses, HIRMS2)
+
+    def _handle_bpd(self, segments, dialog, internal_send):
+        bpa = next((s for s in segments if isinstance(s, HIBPA3)), None)
         if bpa:
             self.bpa = bpa
             self.bpd_version = bpa.bpd_version
-            self.bpd = SegmentSequence(
-                message.find_segments(
-                    callback=lambda m: len(m.header.type) == 6 and m.header.type[1] == 'I' and m.header.type[5] == 'S'
-                )
-            )
+            self.bpd = SegmentSequence([s for s in segments if s.header.type != 'HIBPA'])
 
-        upa = message.find_segment_first(HIUPA4)
+    def _handle_upd(self, segments, dialog, internal_send):
+        upa = next((s for s in segments if isinstance(s, HIUPA4)), None)
         if upa:
             self.upa = upa
             self.upd_version = upa.upd_version
-            self.upd = SegmentSequence(
-                message.find_segments('HIUPD')
-            )
-
-        for seg in message.find_segments(HIRMG2):
-            for response in seg.responses:
-                if not internal_send:
-                    self._log_response(None, response)
+            self.upd = SegmentSequence([s for s in segments if s.header.type == 'HIUPD'])
 
-                    self._call_callbacks(None, response)
-
-                self._process_response(dialog, None, response)
-
-        for seg in message.find_segments(HIRMS2):
+    def _handle_responses(self, segments, dialog, internal_send):
+        for seg in segments:
             for response in seg.responses:
                 segment = None  # FIXME: Provide segment
 
@@ -247,6 +253,9 @@ class FinTS3Client:
 
                 self._process_response(dialog, segment, response)
 
+    def process_response_message(self, dialog, message: FinTSInstituteMessage, internal_send=True):
+        self.response_dispatcher.dispatch(message, dialog, internal_send)
+
     def _send_with_possible_retry(self, dialog, command_seg, resume_func):
         response = dialog._send(command_seg)
         return resume_func(command_seg, response)
@@ -462,11 +471,21 @@ class FinTS3Client:
             return self._send_with_possible_retry(dialog, seg, self._get_sepa_accounts)
 
     def _continue_fetch_with_touchdowns(self, command_seg, response):
-        for resp in response.response_segments(command_seg, *self._touchdown_args, **self._touchdown_kwargs):
+        touchdown = self._collect_touchdown_responses(command_seg, response)
+        if touchdown:
+            seg = self._touchdown_segment_factory(touchdown)
+            return self._send_with_possible_retry(self._touchdown_dialog, seg, self._continue_fetch_with_touchdowns)
+        else:
+            return self._touchdown_response_processor(self._touchdown_responses)
+
+    def _collect_touchdown_responses(self, command_seg, response):
+        """Collect the responses to a fetch command, return the touchdown point of the next command or None"""
+        command_responses = response.command_responses(command_seg)
+        for resp in command_responses.segments(*self._touchdown_args, **self._touchdown_kwargs):
             self._touchdown_responses.append(resp)
 
         touchdown = None
-        for response in response.responses(command_seg, '3040'):
+        for response in command_responses.responses('3040'):
             touchdown = response.parameters[0]
             break
 
@@ -474,11 +493,7 @@ class FinTS3Client:
             logger.info('Fetching more results ({})...'.format(self._touchdown_counter))
 
         self._touchdown_counter += 1
-        if touchdown:
-            seg = self._touchdown_segment_factory(touchdown)
-            return self._send_with_possible_retry(self._touchdown_dialog, seg, self._continue_fetch_with_touchdowns)
-        else:
-            return self._touchdown_response_processor(self._touchdown_responses)
+        return touchdown
 
     def _fetch_with_touchdowns(self, dialog, segment_factory, response_processor, *args, **kwargs):
         """Execute a sequence of fetch commands on dialog.
@@ -541,25 +556,35 @@ class FinTS3Client:
             except FinTSUnsupportedOperation:
                 hkcaz = self._find_highest_supported_command(HKCAZ1)
                 response = self._get_transactions_xml(dialog, hkcaz, account, start_date, end_date)
+                return self._transactions_from_xml(response, include_pending)
 
-                # If a TAN is required, exit early
-                if isinstance(response, NeedTANResponse):
-                    return response
-
-                booked_streams, pending_streams = response
-                transactions = []
-                for s in booked_streams:
-                    transactions += [Transaction(t) for t in camt053_to_dict(s)]
-                if include_pending:
-                    for s in pending_streams:
-                        transactions += [Transaction(t) for t in camt053_to_dict(s)]
-                return transactions
+    @staticmethod
+    def _transactions_from_xml(response, include_pending):
+        # If a TAN is required, exit early
+        if isinstance(response, NeedTANResponse):
+            return response
 
+        booked_streams, pending_streams = response
+        transactions = []
+        for s in booked_streams:
+            transactions += [Transaction(t) for t in camt053_to_dict(s)]
+        if include_pending:
+            for s in pending_streams:
+                transactions += [Transaction(t) for t in camt053_to_dict(s)]
+        return transactions
 
     def _get_transactions_mt940(self, dialog, hkkaz, account: SEPAAccount, start_date, end_date, include_pending):
         logger.info('Start fetching from {} to {}'.format(start_date, end_date))
         response = self._fetch_with_touchdowns(
-            dialog,
+            dialog, *self._transactions_mt940_fetch(hkkaz, account, start_date, end_date, include_pending)
+        )
+        logger.info('Fetching done.')
+        return response
+
+    @staticmethod
+    def _transactions_mt940_fetch(hkkaz, account, start_date, end_date, include_pending):
+        """Return the arguments of _fetch_with_touchdowns() to fetch MT940 transactions"""
+        return (
             lambda touchdown: hkkaz(
                 account=hkkaz._fields['account'].type.from_sepa_account(account),
                 all_accounts=False,
@@ -578,8 +603,6 @@ class FinTS3Client:
             # which is a subset of ISO 8859. There are no character in it that
             # differ between ISO 8859 variants, so we'll arbitrarily chose 8859-1.
         )
-        logger.info('Fetching done.')
-        return response
 
     @staticmethod
     def _response_handler_get_transactions_xml(responses):
@@ -591,6 +614,15 @@ class FinTS3Client:
         return booked_streams, pending_streams
 
     def _get_transactions_xml(self, dialog, hkcaz, account, start_date, end_date, supported_camt_messages=None):
+        logger.info('Start fetching from {} to {}'.format(start_date, end_date))
+        responses = self._fetch_with_touchdowns(
+            dialog, *self._transactions_xml_fetch(hkcaz, account, start_date, end_date, supported_camt_messages)
+        )
+        logger.info('Fetching done.')
+        return responses
+
+    def _transactions_xml_fetch(self, hkcaz, account, start_date, end_date, supported_camt_messages):
+        """Return the arguments of _fetch_with_touchdowns() to fetch camt transactions"""
         hicazs = self.bpd.find_segment_first('HICAZS')
         if hicazs:
             bank_supported_camt_messages = list(hicazs.parameter.supported_camt_formats)
@@ -600,9 +632,7 @@ class FinTS3Client:
             supported_camt_messages = bank_supported_camt_messages
         else:
             supported_camt_messages = [m for m in supported_camt_messages if m in bank_supported_camt_messages]
-        logger.info('Start fetching from {} to {}'.format(start_date, end_date))
-        responses = self._fetch_with_touchdowns(
-            dialog,
+        return (
             lambda touchdown: hkcaz(
                 account=hkcaz._fields['account'].type.from_sepa_account(account),
                 all_accounts=False,
@@ -614,8 +644,6 @@ class FinTS3Client:
             FinTS3Client._response_handler_get_transactions_xml,
             'HICAZ'
         )
-        logger.info('Fetching done.')
-        return responses
 
     def get_transactions_xml(self, account: SEPAAccount, start_date: datetime.date = None,
                              end_date: datetime.date = None, supported_camt_messages = None) -> list:
@@ -637,23 +665,28 @@ class FinTS3Client:
     def get_credit_card_transactions(self, account: SEPAAccount, credit_card_number: str, start_date: datetime.date = None, end_date: datetime.date = None):
         # FIXME Reverse engineered, probably wrong
         with self._get_dialog() as dialog:
-            dkkku = self._find_highest_supported_command(DKKKU2)
-
             responses = self._fetch_with_touchdowns(
-                dialog,
-                lambda touchdown: dkkku(
-                    account=dkkku._fields['account'].type.from_sepa_account(account) if account else None,
-                    credit_card_number=credit_card_number,
-                    date_start=start_date,
-                    date_end=end_date,
-                    touchdown_point=touchdown,
-                ),
-                lambda responses: responses,
-                'DIKKU'
+                dialog, *self._credit_card_transactions_fetch(account, credit_card_number, start_date, end_date)
             )
 
         return responses
 
+    def _credit_card_transactions_fetch(self, account, credit_card_number, start_date, end_date):
+        """Return the arguments of _fetch_with_touchdowns() to fetch credit card transactions"""
+        dkkku = self._find_highest_supported_command(DKKKU2)
+
+        return (
+            lambda touchdown: dkkku(
+                account=dkkku._fields['account'].type.from_sepa_account(account) if account else None,
+                credit_card_number=credit_card_number,
+                date_start=start_date,
+                date_end=end_date,
+                touchdown_point=touchdown,
+            ),
+            lambda responses: responses,
+            'DIKKU'
+        )
+
     def _get_balance(self, command_seg, response):
         for resp in response.response_segments(command_seg, 'HISAL'):
             return resp.balance_booked.as_mt940_Balance()
@@ -667,16 +700,19 @@ class FinTS3Client:
         """
 
         with self._get_dialog() as dialog:
-            hksal = self._find_highest_supported_command(HKSAL5, HKSAL6, HKSAL7)
-
-            seg = hksal(
-                account=hksal._fields['account'].type.from_sepa_account(account),
-                all_accounts=False,
-            )
+            seg = self._balance_segment(account)
 
             response = self._send_with_possible_retry(dialog, seg, self._get_balance)
             return response
 
+    def _balance_segment(self, account):
+        hksal = self._find_highest_supported_command(HKSAL5, HKSAL6, HKSAL7)
+
+        return hksal(
+            account=hksal._fields['account'].type.from_sepa_account(account),
+            all_accounts=False,
+        )
+
     def get_holdings(self, account: SEPAAccount):
         """
         Retrieve holdings of an account.
@@ -686,18 +722,25 @@ class FinTS3Client:
         """
         # init dialog
         with self._get_dialog() as dialog:
-            hkwpd = self._find_highest_supported_command(HKWPD5, HKWPD6)
+            responses = self._fetch_with_touchdowns(dialog, *self._holdings_fetch(account))
 
-            responses = self._fetch_with_touchdowns(
-                dialog,
-                lambda touchdown: hkwpd(
-                    account=hkwpd._fields['account'].type.from_sepa_account(account),
-                    touchdown_point=touchdown,
-                ),
-                lambda responses: responses,  # TODO
-                'HIWPD'
-            )
+        return self._holdings_from_responses(responses)
+
+    def _holdings_fetch(self, account):
+        """Return the arguments of _fetch_with_touchdowns() to fetch holdings"""
+        hkwpd = self._find_highest_supported_command(HKWPD5, HKWPD6)
+
+        return (
+            lambda touchdown: hkwpd(
+                account=hkwpd._fields['account'].type.from_sepa_account(account),
+                touchdown_point=touchdown,
+            ),
+            lambda responses: responses,  # TODO
+            'HIWPD'
+        )
 
+    @staticmethod
+    def _holdings_from_responses(responses):
         if isinstance(responses, NeedTANResponse):
             return responses
 
@@ -720,57 +763,66 @@ class FinTS3Client:
 
     def get_scheduled_debits(self, account: SEPAAccount, multiple=False):
         with self._get_dialog() as dialog:
-            if multiple:
-                command_classes = (HKDMB1, )
-                response_type = "HIDMB"
-            else:
-                command_classes = (HKDBS1, HKDBS2)
-                response_type = "HKDBS"
+            responses = self._fetch_with_touchdowns(dialog, *self._scheduled_debits_fetch(account, multiple))
 
-            hkdbs = self._find_highest_supported_command(*command_classes)
+        return responses
 
-            responses = self._fetch_with_touchdowns(
-                dialog,
-                lambda touchdown: hkdbs(
-                    account=hkdbs._fields['account'].type.from_sepa_account(account),
-                    touchdown_point=touchdown,
-                ),
-                lambda responses: responses,
-                response_type,
-            )
+    def _scheduled_debits_fetch(self, account, multiple):
+        """Return the arguments of _fetch_with_touchdowns() to fetch scheduled debits"""
+        if multiple:
+            command_classes = (HKDMB1, )
+            response_type = "HIDMB"
+        else:
+            command_classes = (HKDBS1, HKDBS2)
+            response_type = "HKDBS"
 
-        return responses
+        hkdbs = self._find_highest_supported_command(*command_classes)
+
+        return (
+            lambda touchdown: hkdbs(
+                account=hkdbs._fields['account'].type.from_sepa_account(account),
+                touchdown_point=touchdown,
+            ),
+            lambda responses: responses,
+            response_type,
+        )
 
     def get_status_protocol(self):
         with self._get_dialog() as dialog:
-            hkpro = self._find_highest_supported_command(HKPRO3, HKPRO4)
-
-            responses = self._fetch_with_touchdowns(
-                dialog,
-                lambda touchdown: hkpro(
-                    touchdown_point=touchdown,
-                ),
-                lambda responses: responses,
-                'HIPRO',
-            )
+            responses = self._fetch_with_touchdowns(dialog, *self._status_protocol_fetch())
 
         return responses
 
+    def _status_protocol_fetch(self):
+        """Return the arguments of _fetch_with_touchdowns() to fetch the status protocol"""
+        hkpro = self._find_highest_supported_command(HKPRO3, HKPRO4)
+
+        return (
+            lambda touchdown: hkpro(
+                touchdown_point=touchdown,
+            ),
+            lambda responses: responses,
+            'HIPRO',
+        )
+
     def get_communication_endpoints(self):
         with self._get_dialog() as dialog:
-            hkkom = self._find_highest_supported_command(HKKOM4)
-
-            responses = self._fetch_with_touchdowns(
-                dialog,
-                lambda touchdown: hkkom(
-                    touchdown_point=touchdown,
-                ),
-                lambda responses: responses,
-                'HIKOM'
-            )
+            responses = self._fetch_with_touchdowns(dialog, *self._communication_endpoints_fetch())
 
         return responses
 
+    def _communication_endpoints_fetch(self):
+        """Return the arguments of _fetch_with_touchdowns() to fetch the communication endpoints"""
+        hkkom = self._find_highest_supported_command(HKKOM4)
+
+        return (
+            lambda touchdown: hkkom(
+                touchdown_point=touchdown,
+            ),
+            lambda responses: responses,
+            'HIKOM'
+        )
+
     def get_statements(self, account: SEPAAccount):
         """
         Retrieve list of statements of an account.
@@ -779,20 +831,23 @@ class FinTS3Client:
         :return: List of HIKAU objects
         """
         with self._get_dialog() as dialog:
-            hkkau = self._find_highest_supported_command(HKKAU1, HKKAU2)
-
-            responses = self._fetch_with_touchdowns(
-                dialog,
-                lambda touchdown: hkkau(
-                    account=hkkau._fields['account'].type.from_sepa_account(account),
-                    touchdown_point=touchdown,
-                ),
-                lambda response: response,
-                'HIKAU'
-            )
+            responses = self._fetch_with_touchdowns(dialog, *self._statements_fetch(account))
 
             return responses
 
+    def _statements_fetch(self, account):
+        """Return the arguments of _fetch_with_touchdowns() to fetch the list of statements"""
+        hkkau = self._find_highest_supported_command(HKKAU1, HKKAU2)
+
+        return (
+            lambda touchdown: hkkau(
+                account=hkkau._fields['account'].type.from_sepa_account(account),
+                touchdown_point=touchdown,
+            ),
+            lambda response: response,
+            'HIKAU'
+        )
+
     def _get_statement(self, command_seg, response):
         for resp in response.response_segments(command_seg, 'HIEKA'):
             return resp
@@ -808,18 +863,21 @@ class FinTS3Client:
         :return: HIEKA object
         """
         with self._get_dialog() as dialog:
-            hkeka = self._find_highest_supported_command(HKEKA3, HKEKA4, HKEKA5)
-
-            seg = hkeka(
-                account=hkeka._fields['account'].type.from_sepa_account(account),
-                statement_format=format,
-                statement_number=number,
-                statement_year=year
-            )
+            seg = self._statement_segment(account, number, year, format)
 
             response = self._send_with_possible_retry(dialog, seg, self._get_statement)
             return response
 
+    def _statement_segment(self, account, number, year, format):
+        hkeka = self._find_highest_supported_command(HKEKA3, HKEKA4, HKEKA5)
+
+        return hkeka(
+            account=hkeka._fields['account'].type.from_sepa_account(account),
+            statement_format=format,
+            statement_number=number,
+            statement_year=year
+        )
+
     def _find_supported_sepa_version(self, candidate_versions):
         hispas = self.bpd.find_segment_first('HISPAS')
         if not hispas:
@@ -900,39 +958,45 @@ class FinTS3Client:
         """
 
         with self._get_dialog() as dialog:
-            if multiple:
-                command_class = HKIPM1 if instant_payment else HKCCM1
-            else:
-                command_class = HKIPZ1 if instant_payment else HKCCS1
+            seg = self._sepa_transfer_segment(account, pain_message, multiple, control_sum, currency, book_as_single,
+                                              pain_descriptor, instant_payment)
+            return self._send_pay_with_possible_retry(dialog, seg, self._continue_sepa_transfer)
 
-            hiccxs, hkccx = self._find_highest_supported_command(
-                command_class,
-                return_parameter_segment=True
-            )
+    def _sepa_transfer_segment(self, account, pain_message, multiple, control_sum, currency, book_as_single,
+                               pain_descriptor, instant_payment):
+        if multiple:
+            command_class = HKIPM1 if instant_payment else HKCCM1
+        else:
+            command_class = HKIPZ1 if instant_payment else HKCCS1
 
-            seg = hkccx(
-                account=hkccx._fields['account'].type.from_sepa_account(account),
-                sepa_descriptor=pain_descriptor,
-                sepa_pain_message=pain_message.encode(),
-            )
+        hiccxs, hkccx = self._find_highest_supported_command(
+            command_class,
+            return_parameter_segment=True
+        )
 
-            # if instant_payment:
-            #     seg.allow_convert_sepa_transfer = True
+        seg = hkccx(
+            account=hkccx._fields['account'].type.from_sepa_account(account),
+            sepa_descriptor=pain_descriptor,
+            sepa_pain_message=pain_message.encode(),
+        )
 
-            if multiple:
-                if hiccxs.parameter.sum_amount_required and control_sum is None:
-                    raise ValueError("Control sum required.")
-                if book_as_single and not hiccxs.parameter.single_booking_allowed:
-                    raise FinTSUnsupportedOperation("Single booking not allowed by bank.")
+        # if instant_payment:
+        #     seg.allow_convert_sepa_transfer = True
 
-                if control_sum:
-                    seg.sum_amount.amount = control_sum
-                    seg.sum_amount.currency = currency
+        if multiple:
+            if hiccxs.parameter.sum_amount_required and control_sum is None:
+                raise ValueError("Control sum required.")
+            if book_as_single and not hiccxs.parameter.single_booking_allowed:
+                raise FinTSUnsupportedOperation("Single booking not allowed by bank.")
 
-                if book_as_single:
-                    seg.request_single_booking = True
+            if control_sum:
+                seg.sum_amount.amount = control_sum
+                seg.sum_amount.currency = currency
 
-            return self._send_pay_with_possible_retry(dialog, seg, self._continue_sepa_transfer)
+            if book_as_single:
+                seg.request_single_booking = True
+
+        return seg
 
     def _continue_sepa_transfer(self, command_seg, response):
         retval = TransactionResponse(response)
@@ -965,42 +1029,48 @@ class FinTS3Client:
         """
 
         with self._get_dialog() as dialog:
-            if multiple:
-                if cor1:
-                    command_candidates = (HKDMC1, )
-                else:
-                    command_candidates = (HKDME1, HKDME2)
+            seg = self._sepa_debit_segment(account, pain_message, multiple, cor1, control_sum, currency, book_as_single,
+                                           pain_descriptor)
+            return self._send_with_possible_retry(dialog, seg, self._continue_sepa_debit)
+
+    def _sepa_debit_segment(self, account, pain_message, multiple, cor1, control_sum, currency, book_as_single,
+                            pain_descriptor):
+        if multiple:
+            if cor1:
+                command_candidates = (HKDMC1, )
             else:
-                if cor1:
-                    command_candidates = (HKDSC1, )
-                else:
-                    command_candidates = (HKDSE1, HKDSE2)
+                command_candidates = (HKDME1, HKDME2)
+        else:
+            if cor1:
+                command_candidates = (HKDSC1, )
+            else:
+                command_candidates = (HKDSE1, HKDSE2)
 
-            hidxxs, hkdxx = self._find_highest_supported_command(
-                *command_candidates,
-                return_parameter_segment=True
-            )
+        hidxxs, hkdxx = self._find_highest_supported_command(
+            *command_candidates,
+            return_parameter_segment=True
+        )
 
-            seg = hkdxx(
-                account=hkdxx._fields['account'].type.from_sepa_account(account),
-                sepa_descriptor=pain_descriptor,
-                sepa_pain_message=pain_message.encode(),
-            )
+        seg = hkdxx(
+            account=hkdxx._fields['account'].type.from_sepa_account(account),
+            sepa_descriptor=pain_descriptor,
+            sepa_pain_message=pain_message.encode(),
+        )
 
-            if multiple:
-                if hidxxs.parameter.sum_amount_required and control_sum is None:
-                    raise ValueError("Control sum required.")
-                if book_as_single and not hidxxs.parameter.single_booking_allowed:
-                    raise FinTSUnsupportedOperation("Single booking not allowed by bank.")
+        if multiple:
+            if hidxxs.parameter.sum_amount_required and control_sum is None:
+                raise ValueError("Control sum required.")
+            if book_as_single and not hidxxs.parameter.single_booking_allowed:
+                raise FinTSUnsupportedOperation("Single booking not allowed by bank.")
 
-                if control_sum:
-                    seg.sum_amount.amount = control_sum
-                    seg.sum_amount.currency = currency
+            if control_sum:
+                seg.sum_amount.amount = control_sum
+                seg.sum_amount.currency = currency
 
-                if book_as_single:
-                    seg.request_single_booking = True
+            if book_as_single:
+                seg.request_single_booking = True
 
-            return self._send_with_possible_retry(dialog, seg, self._continue_sepa_debit)
+        return seg
 
     def _continue_sepa_debit(self, command_seg, response):
         retval = TransactionResponse(response)
@@ -1100,7 +1170,7 @@ class FinTS3Client:
         """
         if self._standing_dialog:
             raise Exception("Cannot resume dialog, existing standing dialog")
-        self._standing_dialog = FinTSDialog.create_resume(self, dialog_data)
+        self._standing_dialog = self.dialog_class.create_resume(self, dialog_data)
         with self._standing_dialog:
             yield self
         self._standing_dialog = None
@@ -1262,17 +1332,23 @@ IMPLEMENTED_HKTAN_VERSIONS = {
 
 
 class FinTS3PinTanClient(FinTS3Client):
+    connection_class = FinTSHTTPSConnection
 
     def __init__(self, bank_identifier, user_id, pin, server, customer_id=None, tan_medium=None, *args, **kwargs):
         self.pin = Password(pin) if pin is not None else pin
         self._pending_tan = None
-        self.connection = FinTSHTTPSConnection(server)
+        self.connection = server if isinstance(server, FinTSConnection) else self.connection_class(server)
         self.allowed_security_functions = []
         self.selected_security_function = None
         self.selected_tan_medium = tan_medium
         self._bootstrap_mode = True
         super().__init__(bank_identifier=bank_identifier, user_id=user_id, customer_id=customer_id, *args, **kwargs)
 
+    def close(self):
+        """Release the resources of the connection to the bank, such as sockets and files. Call it when
+        the client is not used anymore."""
+        self.connection.close()
+
     def _new_dialog(self, lazy_init=False):
         if self.pin is None:
             enc = None
@@ -1288,7 +1364,7 @@ class FinTS3PinTanClient(FinTS3Client):
                 self.pin,
             )]
 
-        return FinTSDialog(
+        return self.dialog_class(
             self,
             lazy_init=lazy_init,
             enc_mechanism=enc,
@@ -1422,22 +1498,29 @@ class FinTS3PinTanClient(FinTS3Client):
 
                 response = dialog.send(command_seg, tan_seg)
 
-                for resp in response.responses(tan_seg):
-                    if resp.code in ('0030', '3955'):
-                        return NeedTANResponse(
-                            command_seg,
-                            response.find_segment_first('HITAN'),
-                            resume_func,
-                            self.is_challenge_structured(),
-                            resp.code == '3955',
-                        )
-                    if resp.code.startswith('9'):
-                        raise Exception("Error response: {!r}".format(response))
+                retval = self._need_tan_response(command_seg, tan_seg, response, resume_func)
+                if retval:
+                    return retval
             else:
                 response = dialog.send(command_seg)
 
             return resume_func(command_seg, response)
-        
+
+    def _need_tan_response(self, command_seg, tan_seg, response, resume_func, vop_result=None):
+        """Return a NeedTANResponse if the bank asks for a TAN for command_seg, raise on errors"""
+        for resp in response.responses(tan_seg):
+            if resp.code in ('0030', '3955'):
+                return NeedTANResponse(
+                    command_seg,
+                    response.find_segment_first('HITAN'),
+                    resume_func,
+                    self.is_challenge_structured(),
+                    resp.code == '3955',
+                    vop_result,
+                )
+            if resp.code.startswith('9'):
+                raise Exception("Error response: {!r}".format(response))
+
     def _send_pay_with_possible_retry(self, dialog, command_seg, resume_func):
         """
         This adds VoP under the assumption that TAN will be sent,
@@ -1454,50 +1537,49 @@ class FinTS3PinTanClient(FinTS3Client):
         - 'RVNA' - check not available, reason in single_vop_result.na_reason
         - 'PDNG' - pending, seems related to something not implemented right now.
         """
-        vop_seg = []
-        vop_standard = self._find_vop_format_for_segment(command_seg)
-        if vop_standard:
-            from .segments.auth import HKVPP1
-            vop_seg = [HKVPP1(supported_reports=PSRD1(psrd=[vop_standard]))]
-
         with dialog:
             if self._need_twostep_tan_for_segment(command_seg):
-                tan_seg = self._get_tan_segment(command_seg, '4')
-                segments = vop_seg + [command_seg, tan_seg]
+                vop_standard, segments, tan_seg = self._pay_segments(command_seg)
 
                 response = dialog.send(*segments)
 
-                if vop_standard:
-                    hivpp = response.find_segment_first(HIVPP1, throw=True)
-
-                    vop_result = hivpp.vop_single_result
-                     # Not Applicable, No Match, Close Match, or exact match but still requires confirmation
-                    if vop_result.result in ('RVNA', 'RVNM', 'RVMC')  or (vop_result.result == 'RCVC' and '3945' in [res.code for res in response.responses(tan_seg)]): 
-                        return NeedVOPResponse(
-                            vop_result=hivpp,
-                            command_seg=command_seg,
-                            resume_method=resume_func,
-                        )
-                else:
-                    hivpp = None
-
-                for resp in response.responses(tan_seg):
-                    if resp.code in ('0030', '3955'):
-                        return NeedTANResponse(
-                            command_seg,
-                            response.find_segment_first('HITAN'),
-                            resume_func,
-                            self.is_challenge_structured(),
-                            resp.code == '3955',
-                            hivpp,
-                        )
-                    if resp.code.startswith('9'):
-                        raise Exception("Error response: {!r}".format(response))
+                retval = self._need_pay_retry_response(command_seg, tan_seg, vop_standard, response, resume_func)
+                if retval:
+                    return retval
             else:
                 response = dialog.send(command_seg)
 
             return resume_func(command_seg, response)
 
+    def _pay_segments(self, command_seg):
+        """Return the VoP format, the segments to send for a payment command_seg, and its HKTAN segment"""
+        vop_seg = []
+        vop_standard = self._find_vop_format_for_segment(command_seg)
+        if vop_standard:
+            from .segments.auth import HKVPP1
+            vop_seg = [HKVPP1(supported_reports=PSRD1(psrd=[vop_standard]))]
+
+        tan_seg = self._get_tan_segment(command_seg, '4')
+        return vop_standard, vop_seg + [command_seg, tan_seg], tan_seg
+
+    def _need_pay_retry_response(self, command_seg, tan_seg, vop_standard, response, resume_func):
+        """Return a NeedVOPResponse or NeedTANResponse if the payment needs confirmation, raise on errors"""
+        if vop_standard:
+            hivpp = response.find_segment_first(HIVPP1, throw=True)
+
+            vop_result = hivpp.vop_single_result
+             # Not Applicable, No Match, Close Match, or exact match but still requires confirmation
+            if vop_result.result in ('RVNA', 'RVNM', 'RVMC')  or (vop_result.result == 'RCVC' and response.command_responses(tan_seg).has_code('3945')): 
+                return NeedVOPResponse(
+                    vop_result=hivpp,
+                    command_seg=command_seg,
+                    resume_method=resume_func,
+                )
+        else:
+            hivpp = None
+
+        return self._need_tan_response(command_seg, tan_seg, response, resume_func, hivpp)
+
     def is_challenge_structured(self):
         param = self.get_tan_mechanisms()[self.get_current_tan_mechanism()]
         if hasattr(param, 'challenge_structured'):
@@ -1512,25 +1594,33 @@ class FinTS3PinTanClient(FinTS3Client):
         :return: New response after sending VOP response
         """
         with self._get_dialog() as dialog:
-            vop_seg = [HKVPA1(vop_id=challenge.vop_result.vop_id)]
-            tan_seg = self._get_tan_segment(challenge.command_seg, '4')
-            segments = vop_seg + [challenge.command_seg, tan_seg]
+            tan_seg, segments = self._approve_vop_segments(challenge)
             response = dialog.send(*segments)
 
-            for resp in response.responses(tan_seg):
-                if resp.code in ('0030', '3955'):
-                    return NeedTANResponse(
-                        challenge.command_seg,
-                        response.find_segment_first('HITAN'),
-                        challenge.resume_method,
-                        self.is_challenge_structured(),
-                        resp.code == '3955',
-                        challenge.vop_result,
-                    )
+            retval = self._approve_vop_retry_response(challenge, tan_seg, response)
+            if retval:
+                return retval
 
             resume_func = getattr(self, challenge.resume_method)
             return resume_func(challenge.command_seg, response)
 
+    def _approve_vop_segments(self, challenge):
+        vop_seg = [HKVPA1(vop_id=challenge.vop_result.vop_id)]
+        tan_seg = self._get_tan_segment(challenge.command_seg, '4')
+        return tan_seg, vop_seg + [challenge.command_seg, tan_seg]
+
+    def _approve_vop_retry_response(self, challenge, tan_seg, response):
+        for resp in response.responses(tan_seg):
+            if resp.code in ('0030', '3955'):
+                return NeedTANResponse(
+                    challenge.command_seg,
+                    response.find_segment_first('HITAN'),
+                    challenge.resume_method,
+                    self.is_challenge_structured(),
+                    resp.code == '3955',
+                    challenge.vop_result,
+                )
+
     def send_tan(self, challenge: NeedTANResponse, tan: str):
         """
         Sends a TAN to confirm a pending operation.
@@ -1544,38 +1634,46 @@ class FinTS3PinTanClient(FinTS3Client):
         :return: New response after sending TAN
         """
         with self._get_dialog() as dialog:
-            if challenge.decoupled:
-                tan_seg = self._get_tan_segment(challenge.command_seg, 'S', challenge.tan_request)
-            else:
-                tan_seg = self._get_tan_segment(challenge.command_seg, '2', challenge.tan_request)
-                self._pending_tan = tan
-
-            vop_seg = []
-            if challenge.vop_result and challenge.vop_result.vop_single_result.result == 'RCVC':
-                vop_seg = [HKVPA1(vop_id=challenge.vop_result.vop_id)]
-            segments = vop_seg + [tan_seg]
+            tan_seg, segments = self._send_tan_segments(challenge, tan)
             response = dialog.send(*segments)
 
-            if challenge.decoupled:
-                # TAN process = S
-                status_segment = response.find_segment_first('HITAN')
-                if not status_segment:
-                    raise FinTSClientError(
-                        "No TAN status received."
-                    )
-                for resp in response.responses(tan_seg):
-                    if resp.code == '3956':
-                        return NeedTANResponse(
-                            challenge.command_seg,
-                            challenge.tan_request,
-                            challenge.resume_method,
-                            challenge.tan_request_structured,
-                            challenge.decoupled,
-                        )
+            retval = self._send_tan_retry_response(challenge, tan_seg, response)
+            if retval:
+                return retval
 
             resume_func = getattr(self, challenge.resume_method)
             return resume_func(challenge.command_seg, response)
 
+    def _send_tan_segments(self, challenge, tan):
+        if challenge.decoupled:
+            tan_seg = self._get_tan_segment(challenge.command_seg, 'S', challenge.tan_request)
+        else:
+            tan_seg = self._get_tan_segment(challenge.command_seg, '2', challenge.tan_request)
+            self._pending_tan = tan
+
+        vop_seg = []
+        if challenge.vop_result and challenge.vop_result.vop_single_result.result == 'RCVC':
+            vop_seg = [HKVPA1(vop_id=challenge.vop_result.vop_id)]
+        return tan_seg, vop_seg + [tan_seg]
+
+    def _send_tan_retry_response(self, challenge, tan_seg, response):
+        if challenge.decoupled:
+            # TAN process = S
+            status_segment = response.find_segment_first('HITAN')
+            if not status_segment:
+                raise FinTSClientError(
+                    "No TAN status received."
+                )
+            for resp in response.responses(tan_seg):
+                if resp.code == '3956':
+                    return NeedTANResponse(
+                        challenge.command_seg,
+                        challenge.tan_request,
+                        challenge.resume_method,
+                        challenge.tan_request_structured,
+                        challenge.decoupled,
+                    )
+
     def _process_response(self, dialog, segment, response):
         if response.code == '3920' and not self.bank_identifier == ING_BANK_IDENTIFIER:
             self.allowed_security_functions = list(response.parameters)
@@ -1701,3 +1799,367 @@ class FinTS3PinTanClient(FinTS3Client):
             'tan_mechanisms': self.get_tan_mechanisms(),
         }
         return retval
+
+
+class AsyncFinTS3PinTanClient(FinTS3PinTanClient):
+    """FinTS3PinTanClient for use with asyncio
+
+    The methods that talk to the bank are coroutines, with the same arguments and results as those
+    of FinTS3PinTanClient, such as get_sepa_accounts(), get_transactions(), sepa_transfer() and
+    send_tan(). A standing dialog is opened with ``async with client:``, and resume_dialog() is an
+    asynchronous context manager.
+
+    Messages are sent with :class:`~fints.connection.AsyncFinTSHTTPSConnection`, which does not block
+    the event loop while the bank answers, so one event loop can drive the dialogs of many clients.
+    Synchronous transports that don't wait for a server, such as
+    :class:`~fints.connection.InProcessConnection`, can be used as well.
+    """
+    connection_class = AsyncFinTSHTTPSConnection
+    dialog_class = AsyncFinTSDialog
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with {}".format(type(self).__name__))
+
+    async def __aenter__(self):
+        if self._standing_dialog:
+            raise Exception("Cannot double __aenter__() {}".format(self))
+        self._standing_dialog = await self._get_dialog()
+        await self._standing_dialog.__aenter__()
+        return self
+
+    async def close(self):
+        """Release the resources of the connection to the bank, such as its socket. Call it when the
+        client is not used anymore."""
+        retval = self.connection.close()
+        # Not a coroutine for synchronous transports such as InProcessConnection
+        if inspect.isawaitable(retval):
+            await retval
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._standing_dialog:
+            if exc_type is not None and issubclass(exc_type, FinTSSCARequiredError):
+                # In case of SCARequiredError, the dialog has already been closed by the bank
+                self._standing_dialog.open = False
+            else:
+                await self._standing_dialog.__aexit__(exc_type, exc_value, traceback)
+        else:
+            raise Exception("Cannot double __aexit__() {}".format(self))
+
+        self._standing_dialog = None
+
+    async def _get_dialog(self, lazy_init=False):
+        if lazy_init and self._standing_dialog:
+            raise Exception("Cannot _get_dialog(lazy_init=True) with _standing_dialog")
+
+        if self._standing_dialog:
+            return self._standing_dialog
+
+        if not lazy_init:
+            await self._ensure_system_id()
+
+        return self._new_dialog(lazy_init=lazy_init)
+
+    async def fetch_tan_mechanisms(self):
+        if (self.system_id and self.system_id != SYSTEM_ID_UNASSIGNED) and not self.get_current_tan_mechanism():
+            # system_id was persisted and given to the client, but nothing else
+            self.set_tan_mechanism('999')
+            async with await self._get_dialog(lazy_init=True) as dialog:
+                response = await dialog.init()
+                self.process_response_message(dialog, response, internal_send=True)
+        else:
+            self.set_tan_mechanism('999')
+            await self._ensure_system_id()
+        if self.get_current_tan_mechanism():
+            # We already got a reply through _ensure_system_id
+            return self.get_current_tan_mechanism()
+        async with self._new_dialog():
+            return self.get_current_tan_mechanism()
+
+    async def _ensure_system_id(self):
+        if self.system_id != SYSTEM_ID_UNASSIGNED or self.user_id == CUSTOMER_ID_ANONYMOUS:
+            return
+
+        async with await self._get_dialog(lazy_init=True) as dialog:
+            response = await dialog.init(
+                HKSYN3(SynchronizationMode.NEW_SYSTEM_ID),
+            )
+            self.process_response_message(dialog, response, internal_send=True)
+            seg = response.find_segment_first(HISYN4)
+            if not seg:
+                raise ValueError('Could not find system_id')
+            self.system_id = seg.system_id
+
+    @staticmethod
+    async def _resume(resume_func, command_seg, response):
+        retval = resume_func(command_seg, response)
+        if inspect.isawaitable(retval):
+            # _continue_fetch_with_touchdowns() sends the command for the next touchdown point
+            retval = await retval
+        return retval
+
+    async def _send_with_possible_retry(self, dialog, command_seg, resume_func):
+        async with dialog:
+            if self._need_twostep_tan_for_segment(command_seg):
+                tan_seg = self._get_tan_segment(command_seg, '4')
+
+                response = await dialog.send(command_seg, tan_seg)
+
+                retval = self._need_tan_response(command_seg, tan_seg, response, resume_func)
+                if retval:
+                    return retval
+            else:
+                response = await dialog.send(command_seg)
+
+            return await self._resume(resume_func, command_seg, response)
+
+    async def _send_pay_with_possible_retry(self, dialog, command_seg, resume_func):
+        async with dialog:
+            if self._need_twostep_tan_for_segment(command_seg):
+                vop_standard, segments, tan_seg = self._pay_segments(command_seg)
+
+                response = await dialog.send(*segments)
+
+                retval = self._need_pay_retry_response(command_seg, tan_seg, vop_standard, response, resume_func)
+                if retval:
+                    return retval
+            else:
+                response = await dialog.send(command_seg)
+
+            return await self._resume(resume_func, command_seg, response)
+
+    async def get_sepa_accounts(self):
+        """
+        Returns a list of SEPA accounts
+
+        :return: List of SEPAAccount objects.
+        """
+
+        seg = HKSPA1()
+        async with await self._get_dialog() as dialog:
+            return await self._send_with_possible_retry(dialog, seg, self._get_sepa_accounts)
+
+    async def get_balance(self, account: SEPAAccount):
+        """
+        Fetches an accounts current balance.
+
+        :param account: SEPA account to fetch the balance
+        :return: A mt940.models.Balance object
+        """
+
+        async with await self._get_dialog() as dialog:
+            seg = self._balance_segment(account)
+
+            response = await self._send_with_possible_retry(dialog, seg, self._get_balance)
+            return response
+
+    async def get_transactions(self, account: SEPAAccount, start_date: datetime.date = None,
+                               end_date: datetime.date = None, include_pending = False):
+        """
+        Fetches the list of transactions of a bank account in a certain timeframe, see
+        :meth:`FinTS3Client.get_transactions`.
+
+        :param account: SEPA
+        :param start_date: First day to fetch
+        :param end_date: Last day to fetch
+        :param include_pending: Include pending transactions (might lack some data like booking day)
+        :return: A list of mt940.models.Transaction or fints.models.Transaction objects
+        """
+
+        async with await self._get_dialog() as dialog:
+            try:
+                hkkaz = self._find_highest_supported_command(HKKAZ5, HKKAZ6, HKKAZ7)
+                return await self._get_transactions_mt940(dialog, hkkaz, account, start_date, end_date, include_pending)
+            except FinTSUnsupportedOperation:
+                hkcaz = self._find_highest_supported_command(HKCAZ1)
+                response = await self._get_transactions_xml(dialog, hkcaz, account, start_date, end_date)
+                return self._transactions_from_xml(response, include_pending)
+
+    async def _get_transactions_mt940(self, dialog, hkkaz, account: SEPAAccount, start_date, end_date, include_pending):
+        logger.info('Start fetching from {} to {}'.format(start_date, end_date))
+        response = await self._fetch_with_touchdowns(
+            dialog, *self._transactions_mt940_fetch(hkkaz, account, start_date, end_date, include_pending)
+        )
+        logger.info('Fetching done.')
+        return response
+
+    async def _get_transactions_xml(self, dialog, hkcaz, account, start_date, end_date, supported_camt_messages=None):
+        logger.info('Start fetching from {} to {}'.format(start_date, end_date))
+        responses = await self._fetch_with_touchdowns(
+            dialog, *self._transactions_xml_fetch(hkcaz, account, start_date, end_date, supported_camt_messages)
+        )
+        logger.info('Fetching done.')
+        return responses
+
+    async def get_transactions_xml(self, account: SEPAAccount, start_date: datetime.date = None,
+                                   end_date: datetime.date = None, supported_camt_messages = None) -> list:
+        """
+        Fetches the list of transactions of a bank account in a certain timeframe as camt XML files, see
+        :meth:`FinTS3Client.get_transactions_xml`.
+        """
+        async with await self._get_dialog() as dialog:
+            hkcaz = self._find_highest_supported_command(HKCAZ1)
+            return await self._get_transactions_xml(dialog, hkcaz, account, start_date, end_date, supported_camt_messages)
+
+    async def get_credit_card_transactions(self, account: SEPAAccount, credit_card_number: str,
+                                           start_date: datetime.date = None, end_date: datetime.date = None):
+        async with await self._get_dialog() as dialog:
+            return await self._fetch_with_touchdowns(
+                dialog, *self._credit_card_transactions_fetch(account, credit_card_number, start_date, end_date)
+            )
+
+    async def get_holdings(self, account: SEPAAccount):
+        """
+        Retrieve holdings of an account, see :meth:`FinTS3Client.get_holdings`.
+
+        :param account: SEPAAccount to retrieve holdings for.
+        :return: List of Holding objects
+        """
+        async with await self._get_dialog() as dialog:
+            responses = await self._fetch_with_touchdowns(dialog, *self._holdings_fetch(account))
+
+        return self._holdings_from_responses(responses)
+
+    async def get_scheduled_debits(self, account: SEPAAccount, multiple=False):
+        async with await self._get_dialog() as dialog:
+            return await self._fetch_with_touchdowns(dialog, *self._scheduled_debits_fetch(account, multiple))
+
+    async def get_status_protocol(self):
+        async with await self._get_dialog() as dialog:
+            return await self._fetch_with_touchdowns(dialog, *self._status_protocol_fetch())
+
+    async def get_communication_endpoints(self):
+        async with await self._get_dialog() as dialog:
+            return await self._fetch_with_touchdowns(dialog, *self._communication_endpoints_fetch())
+
+    async def get_statements(self, account: SEPAAccount):
+        """
+        Retrieve list of statements of an account, see :meth:`FinTS3Client.get_statements`.
+
+        :param account: SEPAAccount to retrieve statements for.
+        :return: List of HIKAU objects
+        """
+        async with await self._get_dialog() as dialog:
+            return await self._fetch_with_touchdowns(dialog, *self._statements_fetch(account))
+
+    async def get_statement(self, account: SEPAAccount, number: int, year: int, format: StatementFormat = None):
+        """
+        Retrieve a given statement of an account, see :meth:`FinTS3Client.get_statement`.
+
+        :return: HIEKA object
+        """
+        async with await self._get_dialog() as dialog:
+            seg = self._statement_segment(account, number, year, format)
+            return await self._send_with_possible_retry(dialog, seg, self._get_statement)
+
+    async def sepa_transfer(self, account: SEPAAccount, pain_message: str, multiple=False,
+                            control_sum=None, currency='EUR', book_as_single=False,
+                            pain_descriptor='urn:iso:std:iso:20022:tech:xsd:pain.001.001.03', instant_payment=False):
+        """
+        Custom SEPA transfer, see :meth:`FinTS3Client.sepa_transfer`.
+
+        :return: Returns either a NeedRetryResponse or TransactionResponse
+        """
+
+        async with await self._get_dialog() as dialog:
+            seg = self._sepa_transfer_segment(account, pain_message, multiple, control_sum, currency, book_as_single,
+                                              pain_descriptor, instant_payment)
+            return await self._send_pay_with_possible_retry(dialog, seg, self._continue_sepa_transfer)
+
+    async def sepa_debit(self, account: SEPAAccount, pain_message: str, multiple=False, cor1=False,
+                         control_sum=None, currency='EUR', book_as_single=False,
+                         pain_descriptor='urn:iso:std:iso:20022:tech:xsd:pain.008.003.01'):
+        """
+        Custom SEPA debit, see :meth:`FinTS3Client.sepa_debit`.
+
+        :return: Returns either a NeedRetryResponse or TransactionResponse (with data['task_id'] set, if available)
+        """
+
+        async with await self._get_dialog() as dialog:
+            seg = self._sepa_debit_segment(account, pain_message, multiple, cor1, control_sum, currency, book_as_single,
+                                           pain_descriptor)
+            return await self._send_with_possible_retry(dialog, seg, self._continue_sepa_debit)
+
+    async def approve_vop_response(self, challenge: NeedVOPResponse):
+        """
+        Approves an operation that had a non-match VoP (verification of payee) response.
+
+        :param challenge: NeedVOPResponse to respond to
+        :return: New response after sending VOP response
+        """
+        async with await self._get_dialog() as dialog:
+            tan_seg, segments = self._approve_vop_segments(challenge)
+            response = await dialog.send(*segments)
+
+            retval = self._approve_vop_retry_response(challenge, tan_seg, response)
+            if retval:
+                return retval
+
+            resume_func = getattr(self, challenge.resume_method)
+            return await self._resume(resume_func, challenge.command_seg, response)
+
+    async def send_tan(self, challenge: NeedTANResponse, tan: str):
+        """
+        Sends a TAN to confirm a pending operation, see :meth:`FinTS3PinTanClient.send_tan`.
+
+        :param challenge: NeedTANResponse to respond to
+        :param tan: TAN value
+        :return: New response after sending TAN
+        """
+        async with await self._get_dialog() as dialog:
+            tan_seg, segments = self._send_tan_segments(challenge, tan)
+            response = await dialog.send(*segments)
+
+            retval = self._send_tan_retry_response(challenge, tan_seg, response)
+            if retval:
+                return retval
+
+            resume_func = getattr(self, challenge.resume_method)
+            return await self._resume(resume_func, challenge.command_seg, response)
+
+    async def get_tan_media(self, media_type = TANMediaType2.ALL, media_class = TANMediaClass4.ALL):
+        """Get information about TAN lists/generators.
+
+        Returns tuple of fints.formals.TANUsageOption and a list of fints.formals.TANMedia4 or fints.formals.TANMedia5 objects."""
+        if self.connection.url == 'https://hbci.postbank.de/banking/hbci.do':
+            # see https://github.com/raphaelm/python-fints/issues/101#issuecomment-572486099
+            context = self._new_dialog(lazy_init=True)
+            method = lambda dialog: dialog.init
+        else:
+            context = await self._get_dialog()
+            method = lambda dialog: dialog.send
+
+        async with context as dialog:
+            if isinstance(self.init_tan_response, NeedTANResponse):
+                # See FinTS3PinTanClient.get_tan_media()
+                return TANUsageOption.ALL_ACTIVE, []
+
+            hktab = self._find_highest_supported_command(HKTAB4, HKTAB5)
+
+            seg = hktab(
+                tan_media_type=media_type,
+                tan_media_class=str(media_class),
+            )
+
+            try:
+                self._bootstrap_mode = True
+                response = await method(dialog)(seg)
+            finally:
+                self._bootstrap_mode = False
+
+            for resp in response.response_segments(seg, 'HITAB'):
+                return resp.tan_usage_option, list(resp.tan_media_list)
+
+    @asynccontextmanager
+    async def resume_dialog(self, dialog_data):
+        """
+        Create a dialog based on the data of a previous dialog, see :meth:`FinTS3Client.resume_dialog`.
+
+        **Warning:** `dialog_data` **MUST NOT** be from an untrusted source such as user-controlled
+        or client-side state or you will have a major security issue.
+        """
+        if self._standing_dialog:
+            raise Exception("Cannot resume dialog, existing standing dialog")
+        self._standing_dialog = self.dialog_class.create_resume(self, dialog_data)
+        async with self._standing_dialog:
+            yield self
+        self._standing_dialog = None
@@ -1,16 +1,36 @@
+import asyncio
 import base64
+import binascii
+import collections
+import contextvars
 import io
+import json
 import logging
+import queue
+import random
+import ssl
+import threading
+import time
+import urllib.parse
+import warnings
+from contextlib import contextmanager
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 from fints.utils import Password, log_configuration
 
+from . import metrics
 from .exceptions import *
 from .message import FinTSInstituteMessage, FinTSMessage
+from .parser import FinTS3Parser, FinTS3StreamParser, FinTSParserError
 from .types import SegmentSequence
 
 logger = logging.getLogger(__name__)
 
+#: Size of the chunks in which response bodies are read
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
 
 def reduce_message_for_log(msg):
     log_msg = msg
@@ -24,34 +44,1176 @@ def reduce_message_for_log(msg):
     return log_msg
 
 
-class FinTSHTTPSConnection:
-    def __init__(self, url):
+class WireTrace:
+    """Snapshot of a message that was sent or received, rendered for the log only when it is used.
+
+    Holds the raw message, so the rendering does not depend on later modifications of the message
+    object and can happen on any thread. Note that data contains the PIN of outgoing messages in
+    clear text, the rendering (:meth:`render` or ``str()``) masks it.
+
+    :param direction: ``'Sending'`` or ``'Received'``
+    :param data: The message as sent over the wire (before base64 encoding)
+    :param reduced: Whether to render only the payload, see :class:`~fints.utils.LogConfiguration`.
+                    Defaults to the log configuration of the current thread.
+    """
+
+    def __init__(self, direction, data, reduced=None):
+        self.direction = direction
+        self.data = bytes(data)
+        self.reduced = log_configuration.reduced if reduced is None else reduced
+        self.timestamp = time.time()
+        self._text = None
+
+    def render(self):
+        """Return the nested representation of the message, with all passwords masked"""
+        if self._text is None:
+            log_out = io.StringIO()
+            with Password.protect(), log_configuration.changed(reduced=self.reduced), warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                try:
+                    msg = FinTS3Parser().parse_message(self.data)
+                except (FinTSParserError, ValueError) as e:
+                    # Don't fall back to the raw data, it may contain the PIN
+                    log_out.write("\t<{} bytes, not parseable: {}>\n".format(len(self.data), e))
+                else:
+                    reduce_message_for_log(msg).print_nested(stream=log_out, prefix="\t")
+            self._text = log_out.getvalue()
+        return self._text
+
+    def __str__(self):
+        if self.direction == 'Sending':
+            arrows = '>' * 32, '>' * 40
+        else:
+            arrows = '<' * 31, '<' * 40
+        return "{} {}{}\n{}\n{}\n".format(
+            self.direction, "(abbrv.)" if self.reduced else "", arrows[0], self.render(), arrows[1]
+        )
+
+    def __repr__(self):
+        return "<{}({!r}, {} bytes)>".format(self.__class__.__name__, self.direction, len(self.data))
+
+
+class WireTraceBuffer:
+    """Ring buffer of the last messages of a connection, for post-mortem dumps.
+
+    :param size: Number of messages (sent and received) to keep
+    """
+
+    def __init__(self, size=20):
+        self.traces = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def append(self, trace: WireTrace):
+        with self._lock:
+            self.traces.append(trace)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self.traces))
+
+    def __len__(self):
+        return len(self.traces)
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+
+    def dump(self, stream=None):
+        """Write the rendering of all messages in the buffer to stream (default: sys.stderr), oldest first"""
+        import sys
+        stream = stream or sys.stderr
+        for trace in self:
+            stream.write(str(trace))
+
+
+class BackgroundTraceLogger:
+    """Renders wire traces and logs them from a background thread, so that sending a message does not wait for it.
+
+    Traces are dropped (and counted in :attr:`dropped`) when more than maxsize are waiting.
+
+    :param logger: Logger to log the traces to, at DEBUG level
+    :param maxsize: Maximum number of traces waiting to be logged
+    """
+
+    def __init__(self, logger=logger, maxsize=100):
+        self.logger = logger
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace: WireTrace):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fints-wire-trace', daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            trace = self.queue.get()
+            try:
+                if trace is None:
+                    return
+                self.logger.debug("%s", str(trace))
+            except Exception:
+                self.logger.exception("Could not render wire trace")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until all submitted traces have been logged"""
+        self.queue.join()
+
+    def close(self):
+        """Log the remaining traces and stop the background thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+
+_deadline = contextvars.ContextVar('fints_deadline', default=None)
+
+
+class Deadline:
+    """Point in time by which an operation has to be finished
+
+    :param seconds: Seconds from now
+    """
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        """Return the seconds left"""
+        return self.expires - time.monotonic()
+
+    def check(self, url=None):
+        """Return the seconds left, raise FinTSTimeoutError if the deadline has passed"""
+        remaining = self.expires - time.monotonic()
+        if remaining <= 0:
+            metrics.timeouts.inc(url=url or '', kind='deadline')
+            raise FinTSTimeoutError("Deadline exceeded")
+        return remaining
+
+
+def current_deadline():
+    """Return the :class:`Deadline` of the current operation, see :func:`deadline`, or None"""
+    return _deadline.get()
+
+
+@contextmanager
+def deadline(seconds):
+    """Context manager that limits the time that the operations in it may take, including all
+    messages that they send, retries and waits between them. When the time is up, the next
+    message is not sent and the current one is aborted, with FinTSTimeoutError.
+
+    The deadline applies to the current thread or asyncio task. Nested deadlines can only shorten it.
+
+    :param seconds: Seconds from now
+    """
+    new = Deadline(seconds)
+    outer = _deadline.get()
+    token = _deadline.set(new if outer is None or new.expires < outer.expires else outer)
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+class RetryPolicy:
+    """Decides whether and when a failed request to a bank server is sent again
+
+    A request is only repeated when the bank cannot have received it (no connection could be made),
+    or when the message opens a new dialog. A message of an open dialog is never repeated once it
+    may have reached the bank: the bank may have consumed its message number, and processed its
+    orders.
+
+    :param retries: Maximum number of times a request is repeated
+    :param backoff: Upper limit of the wait before the first retry, in seconds, doubled for each
+                    further retry. The actual wait is random between zero and this limit.
+    :param max_backoff: Maximum upper limit of the wait, in seconds
+    """
+
+    def __init__(self, retries=2, backoff=0.5, max_backoff=5.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt, deadline=None):
+        """Return the seconds to wait before repeating a request that failed attempt + 1 times, or
+        None if it is not to be repeated"""
+        if attempt >= self.retries:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
+
+
+def _timeouts(connect_timeout, read_timeout, deadline, url):
+    """Return the connect and read timeouts, shortened to the time left until deadline"""
+    if deadline is None:
+        return connect_timeout, read_timeout
+    remaining = deadline.check(url)
+    return (
+        remaining if connect_timeout is None else min(connect_timeout, remaining),
+        remaining if read_timeout is None else min(read_timeout, remaining),
+    )
+
+
+def _base64_size(size):
+    return (size + 2) // 3 * 4
+
+
+def _opens_dialog(msg):
+    """Whether msg opens a new dialog, so that it can be sent again without reusing a message number"""
+    segments = getattr(msg, 'segments', None)
+    # Dialog ID 0 is DIALOG_ID_UNASSIGNED
+    return bool(segments) and getattr(segments[0], 'dialog_id', None) == '0'
+
+
+_ENVELOPE_SEGMENTS = {'HNHBK', 'HNHBS', 'HNVSK', 'HNVSD', 'HNSHK', 'HNSHA'}
+
+
+def _command_type(segments):
+    """Return the type of the first segment that is not part of the envelope of a message, such as 'HKKAZ'"""
+    for segment in segments:
+        header = getattr(segment, 'header', None)
+        if header is None:
+            continue
+        if header.type == 'HNVSD':
+            retval = _command_type(segment.data.segments)
+            if retval:
+                return retval
+        elif header.type not in _ENVELOPE_SEGMENTS:
+            return header.type
+    return ''
+
+
+class CircuitBreaker:
+    """Fails the requests to a bank server right away while the server keeps failing
+
+    After failure_threshold failures in a row (connection errors, timeouts and 5xx responses), the
+    breaker opens: requests fail with FinTSCircuitOpenError without being sent. After reset_timeout
+    seconds, one request is let through. If it succeeds, the breaker closes again, otherwise it stays
+    open for another reset_timeout. Created by :class:`ConnectionManager`, one per server.
+
+    :param url: URL of the server, for the metrics
+    :param failure_threshold: Number of failures in a row that open the breaker, None to never open it
+    :param reset_timeout: Seconds until a request is let through again
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, url, failure_threshold=5, reset_timeout=30.0):
         self.url = url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._since = 0.0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        self._since = time.monotonic()
+        metrics.circuit_breaker_transitions.inc(url=self.url, state=state)
+
+    def before_request(self):
+        """Called before a request is sent, raises FinTSCircuitOpenError if it is not to be sent"""
+        if self.state == self.CLOSED:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if time.monotonic() - self._since >= self.reset_timeout:
+                # Let this request through, as a trial. Also when a trial has not finished in time.
+                self._set_state(self.HALF_OPEN)
+                return
+        metrics.circuit_breaker_rejections.inc(url=self.url)
+        raise FinTSCircuitOpenError("Not sending requests to {} after {} failures".format(self.url, self.failures))
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.failure_threshold is not None and self.failures >= self.failure_threshold):
+                self._set_state(self.OPEN)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """Transport adapter for the connections to one bank server, shared by all clients that talk to it.
+
+    Connections are kept open and reused for later requests, so that only the first request pays for
+    the TCP and TLS handshakes. Created by :class:`ConnectionManager`.
+
+    :param pool_size: Number of idle connections to keep open
+    :param max_concurrency: Maximum number of requests to the server in progress at the same time, further
+                            requests wait until the response of one of them has been read or closed. None
+                            (the default) means no limit.
+    :param keep_alive: Seconds after which idle connections are closed instead of reused, None to keep them
+                       until the server closes them
+    """
+
+    def __init__(self, pool_size=10, max_concurrency=None, keep_alive=60.0):
+        self.keep_alive = keep_alive
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_used = time.monotonic()
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def _begin(self):
+        with self._lock:
+            if not self._active and self.keep_alive is not None and time.monotonic() - self._last_used > self.keep_alive:
+                # All pooled connections have been idle for too long, the server has probably closed them
+                self.poolmanager.clear()
+            self._active += 1
+
+    def _end(self):
+        with self._lock:
+            self._active -= 1
+            self._last_used = time.monotonic()
+
+    def send(self, request, **kwargs):
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        self._begin()
+        try:
+            response = super().send(request, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        self._release_when_closed(response)
+        return response
+
+    def _release(self):
+        self._end()
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def _release_when_closed(self, response):
+        # The request stays in progress until its body has been read (urllib3 then calls
+        # release_conn()) or the response has been closed, not only until the headers arrived
+        raw = response.raw
+        released = threading.Lock()
+
+        def wrap(method):
+            def wrapper(*args, **kwargs):
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    if released.acquire(blocking=False):
+                        self._release()
+            return wrapper
+
+        raw.release_conn = wrap(raw.release_conn)
+        raw.close = wrap(raw.close)
+
+    def close(self):
+        # Called by Session.close(), but the connections are shared with other sessions
+        pass
+
+    def shutdown(self):
+        """Close all connections"""
+        super().close()
+
+
+class ConnectionManager:
+    """Shares HTTP connections and circuit breakers between all clients that talk to the same bank server.
+
+    Holds one :class:`PooledHTTPAdapter` and one :class:`CircuitBreaker` per server (scheme, host and
+    port of the URL), with the given settings. :class:`FinTSHTTPSConnection` uses
+    :data:`default_connection_manager` unless another one is given.
+
+    :param failure_threshold: Number of failed requests in a row after which no more requests are sent
+                              to a server for reset_timeout seconds, None to keep sending them
+    :param reset_timeout: Seconds until a request is sent again to a server that kept failing
+    """
+
+    def __init__(self, pool_size=10, max_concurrency=None, keep_alive=60.0, failure_threshold=5, reset_timeout=30.0):
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.keep_alive = keep_alive
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._adapters = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _server(url):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        return scheme, (parts.hostname or '').lower(), parts.port or {'http': 80, 'https': 443}.get(scheme)
+
+    def adapter_for(self, url) -> PooledHTTPAdapter:
+        """Return the adapter for the server of url"""
+        server = self._server(url)
+        with self._lock:
+            adapter = self._adapters.get(server)
+            if adapter is None:
+                adapter = self._adapters[server] = PooledHTTPAdapter(self.pool_size, self.max_concurrency, self.keep_alive)
+            return adapter
+
+    def circuit_breaker(self, url) -> CircuitBreaker:
+        """Return the circuit breaker for the server of url"""
+        server = self._server(url)
+        with self._lock:
+            breaker = self._breakers.get(server)
+            if breaker is None:
+                breaker = self._breakers[server] = CircuitBreaker(url, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def close(self):
+        """Close all connections. The adapters can still be used, they open new connections."""
+        with self._lock:
+            adapters = list(self._adapters.values())
+        for adapter in adapters:
+            adapter.shutdown()
+
+
+#: The ConnectionManager of all FinTSHTTPSConnection objects that are not given another one
+default_connection_manager = ConnectionManager()
+
+
+class Base64StreamDecoder:
+    """Incremental base64 decoder
+
+    Characters outside of the base64 alphabet (such as line breaks) are skipped, like
+    :func:`base64.b64decode` does. Only an incomplete group of up to three characters is kept
+    between chunks.
+    """
+
+    _IGNORED = bytes(set(range(256)) - set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='))
+
+    def __init__(self):
+        self._rest = b''
+
+    def decode(self, chunk) -> bytes:
+        """Decode a chunk of base64 data, return the bytes that are complete so far"""
+        data = self._rest + bytes(chunk).translate(None, self._IGNORED)
+        end = len(data) - len(data) % 4
+        self._rest = data[end:]
+        return base64.b64decode(data[:end])
+
+    def close(self):
+        """Signal the end of the data. Raises binascii.Error if it ended within a group."""
+        if self._rest:
+            raise binascii.Error("Incomplete base64 data at the end of the input")
+
+
+class ResponseDecoder:
+    """Decodes the base64 encoded body of a response and parses the message in it as it arrives
+
+    Feed the body in chunks with :meth:`feed`, then call :meth:`close` to get the
+    :class:`~fints.message.FinTSInstituteMessage`. Neither the encoded nor the decoded body are kept
+    in full, unless keep_data is set (for wire traces): only the segment that is currently arriving
+    is buffered.
+
+    :param keep_data: If True, keep the decoded body in :attr:`data`
+    :param timed: If True, measure the time spent decoding and parsing in :attr:`decode_time` and
+                  :attr:`parse_time`
+    """
+
+    def __init__(self, keep_data=False, timed=False):
+        self.base64 = Base64StreamDecoder()
+        self.parser = FinTS3StreamParser(unwrap=True, keep_envelope=True)
+        self.segments = []
+        #: Encoded bytes received so far
+        self.encoded_size = 0
+        #: Decoded bytes received so far
+        self.size = 0
+        self.data = bytearray() if keep_data else None
+        self.timed = timed
+        #: Seconds spent decoding base64 so far, if timed
+        self.decode_time = 0.0
+        #: Seconds spent parsing so far, if timed
+        self.parse_time = 0.0
+
+    def feed(self, chunk):
+        self.encoded_size += len(chunk)
+        if self.timed:
+            start = time.perf_counter()
+        data = self.base64.decode(chunk)
+        if self.timed:
+            decoded = time.perf_counter()
+            self.decode_time += decoded - start
+        self.size += len(data)
+        if self.data is not None:
+            self.data += data
+        self.segments.extend(self.parser.feed(data))
+        if self.timed:
+            self.parse_time += time.perf_counter() - decoded
+
+    def close(self) -> FinTSInstituteMessage:
+        self.base64.close()
+        if self.timed:
+            start = time.perf_counter()
+        self.parser.close()
+        retval = FinTSInstituteMessage(segments=self.segments)
+        if self.timed:
+            self.parse_time += time.perf_counter() - start
+        return retval
+
+
+class FinTSConnection:
+    """Base class of the transports that carry the messages of a dialog to the bank and back
+
+    Subclasses implement :meth:`send_bytes`, and may override the lifecycle hooks
+    :meth:`prepare_dialog` and :meth:`close`. :meth:`send` traces and parses the messages. A
+    connection can be passed to :class:`~fints.client.FinTS3PinTanClient` instead of the URL of the
+    server.
+    """
+
+    #: URL of the FinTS server, if there is one
+    url = None
+    trace_buffer = None
+    trace_logger = None
+
+    #: Bytes sent to the server, as on the wire (base64 encoded for HTTPS)
+    bytes_sent = 0
+    #: Bytes received from the server, as on the wire (base64 encoded for HTTPS)
+    bytes_received = 0
+    #: Size of the last response message, decoded
+    last_response_size = 0
+
+    def prepare_dialog(self):
+        """Called by :class:`~fints.dialog.FinTSDialog` before it initializes a dialog"""
+
+    def close(self):
+        """Release the resources of the connection"""
+
+    def send_bytes(self, data: bytes) -> bytes:
+        """Send a message, given as bytes, and return the response message as bytes. Does not
+        trace the messages."""
+        raise NotImplementedError
+
+    def send(self, msg: FinTSMessage) -> FinTSInstituteMessage:
+        data = msg.render_bytes()
+        self._trace('Sending', data)
+
+        measure = metrics.registry.enabled
+        start = time.perf_counter() if measure else None
+        try:
+            response = self.send_bytes(data)
+            if measure:
+                received = time.perf_counter()
+            retval = self._parse_response(data, response)
+        except Exception as e:
+            if measure:
+                self._record_metrics(msg, type(e).__name__)
+            raise
+        if measure:
+            self._record_metrics(msg, 'ok', len(data), len(response), received - start, None, time.perf_counter() - received)
+        return retval
+
+    def _record_metrics(self, msg, outcome, request_size=0, response_size=0, latency=0.0, decode_time=None, parse_time=0.0):
+        labels = {'url': self.url or '', 'segment': _command_type(getattr(msg, 'segments', ()))}
+        metrics.requests.inc(outcome=outcome, **labels)
+        if outcome != 'ok':
+            return
+        metrics.request_bytes.inc(request_size, **labels)
+        metrics.response_bytes.inc(response_size, **labels)
+        metrics.latency.observe(latency, **labels)
+        if decode_time is not None:
+            metrics.decode_time.observe(decode_time, **labels)
+        metrics.parse_time.observe(parse_time, **labels)
+
+    def _parse_response(self, data, response):
+        self.bytes_sent += len(data)
+        self.bytes_received += len(response)
+        self.last_response_size = len(response)
+        self._trace('Received', response)
+        return FinTSInstituteMessage(segments=response)
+
+    def _tracing(self):
+        return self.trace_buffer is not None or logger.isEnabledFor(logging.DEBUG)
+
+    def _response_decoder(self, timed=False):
+        return ResponseDecoder(keep_data=self._tracing(), timed=timed)
+
+    def _count_response(self, decoder):
+        """Count the bytes of a response, and trace it, even if it could not be parsed"""
+        self.bytes_received += decoder.encoded_size
+        self.last_response_size = decoder.size
+        if decoder.data:
+            self._trace('Received', bytes(decoder.data))
+
+    def _trace(self, direction, data):
+        log = logger.isEnabledFor(logging.DEBUG)
+        if not log and self.trace_buffer is None:
+            return
+        trace = WireTrace(direction, data)
+        if self.trace_buffer is not None:
+            self.trace_buffer.append(trace)
+        if log:
+            if self.trace_logger is not None:
+                self.trace_logger.submit(trace)
+            else:
+                # Only rendered when a handler formats the record
+                logger.debug("%s", trace)
+
+
+class FinTSHTTPSConnection(FinTSConnection):
+    """Connection to the FinTS server of a bank, over HTTPS
+
+    Messages are logged to the ``fints.connection`` logger at DEBUG level. They are only rendered
+    if a log handler uses them.
+
+    The HTTP connections to the server are shared with all other FinTSHTTPSConnection objects for
+    the same server, see :class:`ConnectionManager`. Cookies are not shared.
+
+    :param url: URL of the FinTS server
+    :param trace_buffer: Optional :class:`WireTraceBuffer` to keep the last messages in
+    :param trace_logger: Optional :class:`BackgroundTraceLogger` to log the messages with, instead of
+                         logging them from the thread that sends them
+    :param connection_manager: :class:`ConnectionManager` to get the HTTP connections from, defaults
+                               to :data:`default_connection_manager`
+    :param warm_up: If True, open a connection to the server in the background when a dialog is
+                    initialized, while the first message of the dialog is prepared
+    :param connect_timeout: Seconds to wait for a connection to the server, None to wait forever
+    :param read_timeout: Seconds to wait for the server to answer or send more of the answer, None to
+                         wait forever
+    :param retry_policy: :class:`RetryPolicy` for failed requests, defaults to ``RetryPolicy()``
+    """
+
+    def __init__(self, url, trace_buffer=None, trace_logger=None, connection_manager=None, warm_up=False,
+                 connect_timeout=10.0, read_timeout=120.0, retry_policy=None):
+        self.url = url
+        self.trace_buffer = trace_buffer
+        self.trace_logger = trace_logger
+        self.connection_manager = connection_manager if connection_manager is not None else default_connection_manager
+        self.warm_up_on_init = warm_up
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
         self.session = requests.session()
+        self.session.mount(url, self.connection_manager.adapter_for(url))
+
+    def warm_up(self, background=True):
+        """Open a connection to the server now, so that the next message does not wait for the handshakes.
+
+        The connection is opened with a HEAD request, whose response is dropped, and then kept in the
+        pool of the connection manager.
+
+        :param background: If True (the default), connect in a background thread and return immediately
+        """
+        if background:
+            threading.Thread(target=self._warm_up, name='fints-warm-up', daemon=True).start()
+        else:
+            self._warm_up()
+
+    def _warm_up(self):
+        try:
+            self.session.head(self.url, timeout=(self.connect_timeout, self.read_timeout)).close()
+        except requests.RequestException as e:
+            # The request will try again
+            logger.debug("Could not connect to %s in advance: %s", self.url, e)
+
+    def prepare_dialog(self):
+        if self.warm_up_on_init:
+            self.warm_up()
+
+    def close(self):
+        # The HTTP connections stay in the pool of the connection manager
+        self.session.close()
+
+    def _post(self, data, repeatable=False):
+        """Send data, repeating it where the retry policy allows, and return the successful response,
+        the :func:`time.perf_counter` value of when its attempt started, and how often data has been sent
+
+        :param repeatable: Whether data may be sent again after it may have reached the bank
+        """
+        body = base64.b64encode(data)
+        deadline = current_deadline()
+        breaker = self.connection_manager.circuit_breaker(self.url)
+        attempt = sends = 0
+        while True:
+            timeout = _timeouts(self.connect_timeout, self.read_timeout, deadline, self.url)
+            breaker.before_request()
+            started = time.perf_counter()
+            try:
+                r = self.session.post(
+                    self.url, data=body,
+                    headers={
+                        'Content-Type': 'text/plain',
+                    },
+                    stream=True,
+                    timeout=timeout,
+                )
+            except requests.RequestException as e:
+                breaker.record_failure()
+                not_sent = isinstance(e, requests.ConnectTimeout) or isinstance(
+                    getattr(e.args[0] if e.args else None, 'reason', None), urllib3.exceptions.NewConnectionError
+                )
+                if isinstance(e, requests.Timeout):
+                    kind = 'connect' if isinstance(e, requests.ConnectTimeout) else 'read'
+                    metrics.timeouts.inc(url=self.url, kind=kind)
+                    error = FinTSTimeoutError("Timed out {} {}".format(
+                        'connecting to' if kind == 'connect' else 'waiting for a response from', self.url
+                    ))
+                else:
+                    error = FinTSConnectionError("Request to {} failed: {}".format(self.url, e))
+                error.__cause__ = e
+                reason = type(e).__name__
+                if not not_sent:
+                    sends += 1
+                    self.bytes_sent += len(body)
+            else:
+                sends += 1
+                self.bytes_sent += len(body)
+                if 200 <= r.status_code <= 299:
+                    breaker.record_success()
+                    return r, started, sends
+                r.close()
+                error = FinTSConnectionError('Bad status code {}'.format(r.status_code))
+                if r.status_code < 500:
+                    # The server works, but does not like the request
+                    breaker.record_success()
+                    raise error
+                breaker.record_failure()
+                not_sent = False
+                reason = str(r.status_code)
+
+            delay = self.retry_policy.delay(attempt, deadline) if not_sent or repeatable else None
+            if delay is None:
+                raise error
+            logger.info("Repeating request to %s in %.1f seconds, after: %s", self.url, delay, error)
+            metrics.retries.inc(url=self.url, reason=reason)
+            time.sleep(delay)
+            attempt += 1
+
+    def _iter_content(self, r, deadline):
+        try:
+            for chunk in r.iter_content(RESPONSE_CHUNK_SIZE):
+                yield chunk
+                if deadline is not None:
+                    deadline.check(self.url)
+        except requests.RequestException as e:
+            if e.args and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError):
+                metrics.timeouts.inc(url=self.url, kind='read')
+                raise FinTSTimeoutError("Timed out reading the response from {}".format(self.url)) from e
+            raise FinTSConnectionError("Reading the response from {} failed: {}".format(self.url, e)) from e
+
+    def send_bytes(self, data):
+        with self._post(data)[0] as r:
+            content = b''.join(self._iter_content(r, current_deadline()))
+        self.bytes_received += len(content)
+        response = base64.b64decode(content)
+        self.last_response_size = len(response)
+        return response
 
     def send(self, msg: FinTSMessage):
-        log_out = io.StringIO()
-        with Password.protect():
-            log_msg = reduce_message_for_log(msg)
-            log_msg.print_nested(stream=log_out, prefix="\t")
-            logger.debug("Sending {}>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n{}\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n".format("(abbrv.)" if log_configuration.reduced else "", log_out.getvalue()))
-            log_out.truncate(0)
-
-        r = self.session.post(
-            self.url, data=base64.b64encode(msg.render_bytes()),
-            headers={
-                'Content-Type': 'text/plain',
-            },
+        data = msg.render_bytes()
+        self._trace('Sending', data)
+
+        measure = metrics.registry.enabled
+        decoder = self._response_decoder(timed=measure)
+        try:
+            r, started, sends = self._post(data, _opens_dialog(msg))
+            with r:
+                responded = time.perf_counter() if measure else None
+                try:
+                    for chunk in self._iter_content(r, current_deadline()):
+                        decoder.feed(chunk)
+                    retval = decoder.close()
+                finally:
+                    self._count_response(decoder)
+        except Exception as e:
+            if measure:
+                self._record_metrics(msg, type(e).__name__)
+            raise
+        if measure:
+            self._record_metrics(
+                msg, 'ok', sends * _base64_size(len(data)), decoder.encoded_size, responded - started,
+                decoder.decode_time, decoder.parse_time,
+            )
+        return retval
+
+
+class AsyncFinTSConnection(FinTSConnection):
+    """Base class of the transports for :class:`~fints.client.AsyncFinTS3PinTanClient`, whose
+    :meth:`send_bytes`, :meth:`send` and :meth:`close` are coroutines"""
+
+    async def close(self):
+        """Release the resources of the connection"""
+
+    async def send_bytes(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    async def send(self, msg: FinTSMessage) -> FinTSInstituteMessage:
+        data = msg.render_bytes()
+        self._trace('Sending', data)
+
+        measure = metrics.registry.enabled
+        start = time.perf_counter() if measure else None
+        try:
+            response = await self.send_bytes(data)
+            if measure:
+                received = time.perf_counter()
+            retval = self._parse_response(data, response)
+        except Exception as e:
+            if measure:
+                self._record_metrics(msg, type(e).__name__)
+            raise
+        if measure:
+            self._record_metrics(msg, 'ok', len(data), len(response), received - start, None, time.perf_counter() - received)
+        return retval
+
+
+class AsyncFinTSHTTPSConnection(AsyncFinTSConnection):
+    """Connection to the FinTS server of a bank, over HTTPS, for use with asyncio
+
+    send() is a coroutine and does not block the event loop while waiting for the server. The
+    connection speaks HTTP/1.1 on asyncio streams and keeps one connection to the server open
+    between messages, which is reopened when the server has closed it. Messages are traced like with
+    :class:`FinTSHTTPSConnection`.
+
+    :param url: URL of the FinTS server
+    :param trace_buffer: Optional :class:`WireTraceBuffer` to keep the last messages in
+    :param trace_logger: Optional :class:`BackgroundTraceLogger` to log the messages with
+    :param ssl_context: :class:`ssl.SSLContext` for https URLs, defaults to :func:`ssl.create_default_context`
+    :param connect_timeout: Seconds to wait for a connection to the server, None to wait forever
+    :param read_timeout: Seconds to wait for the server to answer or send more of the answer, None to
+                         wait forever
+    :param retry_policy: :class:`RetryPolicy` for failed requests, defaults to ``RetryPolicy()``
+    :param connection_manager: :class:`ConnectionManager` to get the circuit breaker from, defaults to
+                               :data:`default_connection_manager`
+    """
+
+    def __init__(self, url, trace_buffer=None, trace_logger=None, ssl_context=None, connect_timeout=10.0,
+                 read_timeout=120.0, retry_policy=None, connection_manager=None):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError("Unsupported URL {!r}".format(url))
+        self.url = url
+        self.trace_buffer = trace_buffer
+        self.trace_logger = trace_logger
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.connection_manager = connection_manager if connection_manager is not None else default_connection_manager
+        self._address = (parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        self._ssl = (ssl_context or ssl.create_default_context()) if parts.scheme == 'https' else None
+        self._request_head = (
+            'POST {path} HTTP/1.1\r\n'
+            'Host: {host}\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Length: {{}}\r\n'
+            '\r\n'
+        ).format(
+            path=(parts.path or '/') + ('?' + parts.query if parts.query else ''),
+            host=parts.netloc.rpartition('@')[2],
         )
+        self._lock = asyncio.Lock()
+        self._streams = None
+        self._loop = None
+
+    async def _wait(self, aw, timeout, kind='read'):
+        try:
+            async with asyncio.timeout(timeout):
+                return await aw
+        except TimeoutError as e:
+            metrics.timeouts.inc(url=self.url, kind=kind)
+            raise FinTSTimeoutError("Timed out {} {}".format(
+                'connecting to' if kind == 'connect' else 'waiting for a response from', self.url
+            )) from e
+
+    async def _connect(self, timeout):
+        loop = asyncio.get_running_loop()
+        if self._streams is not None and self._loop is not loop:
+            # Opened by another event loop, which may be gone by now
+            self._drop()
+        if self._streams is not None and (self._streams[0].at_eof() or self._streams[1].transport.is_closing()):
+            # The server closed the connection while it was idle, nothing has been sent over it yet
+            self._drop()
+        if self._streams is None:
+            self._streams = await self._wait(
+                asyncio.open_connection(*self._address, ssl=self._ssl), timeout, 'connect'
+            )
+            self._loop = loop
+        return self._streams
+
+    def _drop(self):
+        if self._streams is not None:
+            self._streams[1].close()
+            self._streams = None
+
+    async def close(self):
+        """Close the connection to the server"""
+        if self._streams is not None:
+            writer = self._streams[1]
+            self._streams = None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _post(self, body, feed, repeatable=False):
+        """Send body, repeating it where the retry policy allows, feed the body of a successful
+        response to feed, and return the :func:`time.perf_counter` values of when its attempt started
+        and when the server answered, and how often body has been sent
+
+        :param repeatable: Whether body may be sent again after it may have reached the bank
+        """
+        request = self._request_head.format(len(body)).encode('us-ascii') + body
+        deadline = current_deadline()
+        breaker = self.connection_manager.circuit_breaker(self.url)
+        attempt = sends = 0
+        while True:
+            connect_timeout, read_timeout = _timeouts(self.connect_timeout, self.read_timeout, deadline, self.url)
+            breaker.before_request()
+            started = time.perf_counter()
+            sent = False
+            status_line = b''
+            try:
+                async with self._lock:
+                    try:
+                        reader, writer = await self._connect(connect_timeout)
+                        sent = True
+                        sends += 1
+                        self.bytes_sent += len(body)
+                        writer.write(request)
+                        await writer.drain()
+                        status_line = await self._wait(reader.readline(), read_timeout)
+                        if not status_line:
+                            raise ConnectionResetError("Connection closed by server")
+                        responded = time.perf_counter()
+                        status = await self._read_response(reader, status_line, feed, read_timeout, deadline)
+                    except BaseException:
+                        # Also when cancelled while the response is outstanding, the connection can't be used anymore
+                        self._drop()
+                        raise
+            except (OSError, asyncio.IncompleteReadError, FinTSConnectionError) as e:
+                # FinTSConnectionError: timeouts, and malformed responses
+                breaker.record_failure()
+                if isinstance(e, FinTSConnectionError):
+                    error = e
+                else:
+                    error = FinTSConnectionError("Request to {} failed: {}".format(self.url, e))
+                    error.__cause__ = e
+                # A response that has been fed in part can't be read again
+                retry = not sent or (repeatable and not status_line)
+                reason = type(e.__cause__ or e).__name__
+            else:
+                if 200 <= status <= 299:
+                    breaker.record_success()
+                    return started, responded, sends
+                error = FinTSConnectionError('Bad status code {}'.format(status))
+                if status < 500:
+                    # The server works, but does not like the request
+                    breaker.record_success()
+                    raise error
+                breaker.record_failure()
+                retry = repeatable
+                reason = str(status)
+
+            delay = self.retry_policy.delay(attempt, deadline) if retry else None
+            if delay is None:
+                raise error
+            logger.info("Repeating request to %s in %.1f seconds, after: %s", self.url, delay, error)
+            metrics.retries.inc(url=self.url, reason=reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _read_response(self, reader, status_line, feed, timeout, deadline):
+        while True:
+            try:
+                http_version, status = status_line.split(None, 2)[:2]
+                status = int(status)
+            except ValueError:
+                raise FinTSConnectionError("Malformed status line from {}: {!r}".format(self.url, status_line))
+            headers = {}
+            while True:
+                line = await self._wait(reader.readline(), timeout)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('iso-8859-1').partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+            if not 100 <= status < 200:
+                break
+            status_line = await self._wait(reader.readline(), timeout)
+
+        keep_alive = headers.get('connection') != 'close' if http_version == b'HTTP/1.1' else \
+            headers.get('connection') == 'keep-alive'
+        # The body of an error response is read and dropped, to keep the connection usable
+        if not 200 <= status <= 299:
+            feed = lambda chunk: None
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            while True:
+                line = await self._wait(reader.readline(), timeout)
+                try:
+                    size = int(line.split(b';')[0], 16)
+                except ValueError:
+                    raise FinTSConnectionError("Malformed chunk size from {}: {!r}".format(self.url, line))
+                if not size:
+                    break
+                await self._read_body(reader, size, feed, timeout, deadline)
+                await self._wait(reader.readexactly(2), timeout)
+            while (await self._wait(reader.readline(), timeout)) not in (b'\r\n', b'\n', b''):
+                pass  # Trailers
+        elif 'content-length' in headers:
+            await self._read_body(reader, int(headers['content-length']), feed, timeout, deadline)
+        else:
+            while True:
+                chunk = await self._wait(reader.read(RESPONSE_CHUNK_SIZE), timeout)
+                if not chunk:
+                    break
+                feed(chunk)
+                if deadline is not None:
+                    deadline.check(self.url)
+            keep_alive = False
+
+        if not keep_alive:
+            self._drop()
+        return status
 
-        if r.status_code < 200 or r.status_code > 299:
-            raise FinTSConnectionError('Bad status code {}'.format(r.status_code))
+    async def _read_body(self, reader, size, feed, timeout, deadline):
+        while size:
+            chunk = await self._wait(reader.read(min(size, RESPONSE_CHUNK_SIZE)), timeout)
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', size)
+            size -= len(chunk)
+            feed(chunk)
+            if deadline is not None:
+                deadline.check(self.url)
 
-        response = base64.b64decode(r.content.decode('iso-8859-1'))
-        retval = FinTSInstituteMessage(segments=response)
+    async def send_bytes(self, data):
+        chunks = []
+        await self._post(base64.b64encode(data), chunks.append)
+        content = b''.join(chunks)
+        self.bytes_received += len(content)
+        response = base64.b64decode(content)
+        self.last_response_size = len(response)
+        return response
 
-        with Password.protect():
-            log_msg = reduce_message_for_log(retval)
-            log_msg.print_nested(stream=log_out, prefix="\t")
-            logger.debug("Received {}<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<\n{}\n<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<\n".format("(abbrv.)" if log_configuration.reduced else "", log_out.getvalue()))
+    async def send(self, msg: FinTSMessage):
+        data = msg.render_bytes()
+        self._trace('Sending', data)
+
+        measure = metrics.registry.enabled
+        decoder = self._response_decoder(timed=measure)
+        try:
+            try:
+                started, responded, sends = await self._post(base64.b64encode(data), decoder.feed, _opens_dialog(msg))
+                retval = decoder.close()
+            finally:
+                self._count_response(decoder)
+        except Exception as e:
+            if measure:
+                self._record_metrics(msg, type(e).__name__)
+            raise
+        if measure:
+            self._record_metrics(
+                msg, 'ok', sends * _base64_size(len(data)), decoder.encoded_size, responded - started,
+                decoder.decode_time, decoder.parse_time,
+            )
         return retval
+
+
+class InProcessConnection(FinTSConnection):
+    """Transport that hands the messages to a bank simulator in the same process, without sockets
+    and without base64 encoding, for tests and for benchmarking the client on its own.
+
+    :param handler: Called with every message as bytes, returns the response message as bytes, e.g.
+                    the method of a bank simulator that processes a message
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def send_bytes(self, data):
+        return self.handler(data)
+
+
+def _mask_password(data):
+    """Return the message data with the PIN masked, or None if it can't be parsed"""
+    with Password.protect(), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            return FinTS3Parser().parse_message(data).render_bytes()
+        except (FinTSParserError, ValueError):
+            return None
+
+
+class RecordingConnection(FinTSConnection):
+    """Transport that sends the messages over another connection and records the exchanges in a
+    file, to be replayed with :class:`ReplayConnection`.
+
+    The file has one JSON object per exchange and line, with the ``request`` and the ``response`` as
+    ISO-8859-1 text. The PIN is masked in the requests, the responses are recorded as they are and
+    contain account data.
+
+    :param connection: The :class:`FinTSConnection` to send the messages over (not an
+                       :class:`AsyncFinTSConnection`)
+    :param path: File to write the exchanges to, it is overwritten
+    """
+
+    def __init__(self, connection, path):
+        self.connection = connection
+        self.url = connection.url
+        self.file = open(path, 'w', encoding='us-ascii')
+
+    def prepare_dialog(self):
+        self.connection.prepare_dialog()
+
+    def close(self):
+        self.file.close()
+        self.connection.close()
+
+    def send_bytes(self, data):
+        response = self.connection.send_bytes(data)
+        request = _mask_password(data)
+        self.file.write(json.dumps({
+            'request': request.decode('iso-8859-1') if request is not None else None,
+            'response': response.decode('iso-8859-1'),
+        }) + '\n')
+        self.file.flush()
+        return response
+
+
+class ReplayConnection(FinTSConnection):
+    """Transport that answers the messages with the responses recorded by
+    :class:`RecordingConnection`, in order and without sending anything.
+
+    The recording is loaded up front, so the responses come at full speed, e.g. to profile parsing
+    and the dialog logic on real traffic. The requests are not compared to the recorded ones, they
+    differ in timestamps at least. For a faithful replay, construct the client from the same data
+    blob as the recorded one (see :meth:`~fints.client.FinTS3Client.deconstruct`) and make the same
+    calls.
+
+    :param path: File written by :class:`RecordingConnection`
+    """
+
+    def __init__(self, path):
+        with open(path, encoding='us-ascii') as f:
+            self.responses = [json.loads(line)['response'].encode('iso-8859-1') for line in f if line.strip()]
+        self.position = 0
+
+    def rewind(self):
+        """Start again with the first recorded response"""
+        self.position = 0
+
+    def send_bytes(self, data):
+        if self.position >= len(self.responses):
+            raise FinTSConnectionError("No more recorded responses, {} have been replayed".format(len(self.responses)))
+        self.position += 1
+        return self.responses[self.position - 1]
@@ -1,8 +1,10 @@
+import inspect
 import io
 import logging
 import pickle
+from contextlib import contextmanager
 
-from .connection import FinTSConnectionError
+from .connection import FinTSConnectionError, current_deadline
 from .exceptions import *
 from .formals import CUSTOMER_ID_ANONYMOUS, Language2, SystemIDStatus
 from .message import FinTSCustomerMessage, MessageDirection
@@ -45,91 +47,134 @@ class FinTSDialog:
                 self.end()
 
     def init(self, *extra_segments):
+        if self._start_init():
+            segments, tan_seg = self._init_segments(extra_segments)
+
+            with self._initializing():
+                retval = self.send(*segments, internal_send=True)
+                self._process_init_response(retval, tan_seg)
+                return retval
+
+    def _start_init(self):
+        """Return whether the dialog needs to be initialized, and prepare the connection if so"""
         if self.paused:
             raise FinTSDialogStateError("Cannot init() a paused dialog")
 
-        from fints.client import FinTSClientMode, NeedTANResponse
+        from fints.client import FinTSClientMode
         if self.client.mode == FinTSClientMode.OFFLINE:
             raise FinTSDialogOfflineError("Cannot open a dialog with mode=FinTSClientMode.OFFLINE. "
                                           "This is a control flow error, no online functionality "
                                           "should have been attempted with this FinTSClient object.")
 
         if self.need_init and not self.open:
-            segments = [
-                HKIDN2(
-                    self.client.bank_identifier,
-                    self.client.customer_id,
-                    self.client.system_id,
-                    SystemIDStatus.ID_NECESSARY if self.client.customer_id != CUSTOMER_ID_ANONYMOUS else SystemIDStatus.ID_UNNECESSARY
-                ),
-                HKVVB3(
-                    self.client.bpd_version,
-                    self.client.upd_version,
-                    Language2.DE,
-                    self.client.product_name,
-                    self.client.product_version
-                ),
-            ]
-
-            if self.client.mode == FinTSClientMode.INTERACTIVE and self.client.get_tan_mechanisms():
-                tan_seg = self.client._get_tan_segment(segments[0], '4')
-                segments.append(tan_seg)
+            self.client.connection.prepare_dialog()
+            return True
+        return False
+
+    @contextmanager
+    def _initializing(self):
+        """Open the dialog while the initialization message is sent, and close it again if that fails"""
+        try:
+            self.open = True
+            yield
+        except Exception as e:
+            self.open = False
+            if isinstance(e, (FinTSConnectionError, FinTSClientError)):
+                raise
             else:
-                tan_seg = None
-
-            for s in extra_segments:
-                segments.append(s)
-
-            try:
-                self.open = True
-                retval = self.send(*segments, internal_send=True)
-
-                if tan_seg:
-                    for resp in retval.responses(tan_seg):
-                        if resp.code in ('0030', '3955'):
-                            self.client.init_tan_response = NeedTANResponse(
-                                None,
-                                retval.find_segment_first('HITAN'),
-                                '_continue_dialog_initialization',
-                                self.client.is_challenge_structured(),
-                                False,
-                            )
-                            if resp.code == '3955':
-                                self.client.init_tan_response.decoupled = True
-                                break
-
-                self.need_init = False
-                return retval
-            except Exception as e:
-                self.open = False
-                if isinstance(e, (FinTSConnectionError, FinTSClientError)):
-                    raise
-                else:
-                    raise FinTSDialogInitError("Couldn't establish dialog with bank, Authentication data wrong?") from e
-            finally:
-                self.lazy_init = False
+                raise FinTSDialogInitError("Couldn't establish dialog with bank, Authentication data wrong?") from e
+        finally:
+            self.lazy_init = False
+
+    def _init_segments(self, extra_segments):
+        """Return the segments of the dialog initialization message, and its HKTAN segment (or None)"""
+        from fints.client import FinTSClientMode
+
+        segments = [
+            HKIDN2(
+                self.client.bank_identifier,
+                self.client.customer_id,
+                self.client.system_id,
+                SystemIDStatus.ID_NECESSARY if self.client.customer_id != CUSTOMER_ID_ANONYMOUS else SystemIDStatus.ID_UNNECESSARY
+            ),
+            HKVVB3(
+                self.client.bpd_version,
+                self.client.upd_version,
+                Language2.DE,
+                self.client.product_name,
+                self.client.product_version
+            ),
+        ]
+
+        if self.client.mode == FinTSClientMode.INTERACTIVE and self.client.get_tan_mechanisms():
+            tan_seg = self.client._get_tan_segment(segments[0], '4')
+            segments.append(tan_seg)
+        else:
+            tan_seg = None
+
+        for s in extra_segments:
+            segments.append(s)
+
+        return segments, tan_seg
+
+    def _process_init_response(self, retval, tan_seg):
+        from fints.client import NeedTANResponse
+
+        if tan_seg:
+            for resp in retval.responses(tan_seg):
+                if resp.code in ('0030', '3955'):
+                    self.client.init_tan_response = NeedTANResponse(
+                        None,
+                        retval.find_segment_first('HITAN'),
+                        '_continue_dialog_initialization',
+                        self.client.is_challenge_structured(),
+                        False,
+                    )
+                    if resp.code == '3955':
+                        self.client.init_tan_response.decoupled = True
+                        break
+
+        self.need_init = False
 
     def end(self):
+        if self._start_end():
+            response = self.send(HKEND1(self.dialog_id), internal_send=True)
+            self.open = False
+
+    def _start_end(self):
+        """Return whether the dialog is open and has to be ended"""
         if self.paused:
             raise FinTSDialogStateError("Cannot end() on a paused dialog")
 
-        if self.open:
-            response = self.send(HKEND1(self.dialog_id), internal_send=True)
-            self.open = False
+        return self.open
 
     def send(self, *segments, **kwargs):
         internal_send = kwargs.pop('internal_send', False)
 
+        if self._start_send():
+            self.init()
+
+        message = self._prepare_send(segments)
+        response = self.client.connection.send(message)
+        return self._process_send_response(message, response, internal_send)
+
+    def _start_send(self):
+        """Return whether a lazily initialized dialog has to be initialized before sending"""
         if self.paused:
             raise FinTSDialogStateError("Cannot send() on a paused dialog")
 
-        if not self.open:
-            if self.lazy_init and self.need_init:
-                self.init()
+        return not self.open and self.lazy_init and self.need_init
 
+    def _prepare_send(self, segments):
+        """Build the message to send for segments, and count it as sent"""
         if not self.open:
             raise FinTSDialogStateError("Cannot send on dialog that is not open")
 
+        deadline = current_deadline()
+        if deadline is not None:
+            # Before the message number is used up
+            deadline.check(self.client.connection.url)
+
         message = self.new_customer_message()
         for s in segments:
             message += s
@@ -139,8 +184,10 @@ class FinTSDialog:
         self.messages[message.DIRECTION][message.segments[0].message_number] = message
         self.next_message_number[message.DIRECTION] += 1
 
-        response = self.client.connection.send(message)
+        return message
 
+    def _process_send_response(self, message, response, internal_send):
+        """Record and process the response to message"""
         # assert response.segments[0].message_number == self.next_message_number[response.DIRECTION]
         # FIXME Better handling of HKEND in exception case
         self.messages[response.DIRECTION][response.segments[0].message_number] = response
@@ -187,7 +234,19 @@ class FinTSDialog:
         if self.enc_mechanism:
             self.enc_mechanism.encrypt(message)
 
-        message.segments[0].message_size = len(message.render_bytes())
+        # Render once, with a placeholder size, then patch the actual size into the fixed-width size field
+        # of HNHBK, which directly follows the segment header
+        header = message.segments[0]
+        header.message_size = 0
+        data = bytearray(message.render_bytes())
+        size_field = HNHBK3._fields['message_size']
+        size_start = data.index(b'+') + 1
+        size_end = size_start + size_field.length
+        assert data[size_start:size_end] == size_field.render(0).encode('us-ascii')
+
+        header.message_size = len(data)
+        data[size_start:size_end] = size_field.render(len(data)).encode('us-ascii')
+        message.set_rendered_bytes(bytes(data))
 
     def pause(self):
         # FIXME Document, test
@@ -251,3 +310,53 @@ class FinTSDialog:
 
         for k, v in data_unpickled.items():
             setattr(self, k, v)
+
+
+class AsyncFinTSDialog(FinTSDialog):
+    """FinTSDialog that sends its messages over an asynchronous connection, for
+    :class:`~fints.client.AsyncFinTS3PinTanClient`.
+
+    init(), end() and send() are coroutines, and the dialog is used with ``async with``.
+    """
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with {}".format(type(self).__name__))
+
+    async def __aenter__(self):
+        if self._context_count == 0:
+            if not self.lazy_init:
+                await self.init()
+        self._context_count += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._context_count -= 1
+        if not self.paused:
+            if self._context_count == 0:
+                await self.end()
+
+    async def init(self, *extra_segments):
+        if self._start_init():
+            segments, tan_seg = self._init_segments(extra_segments)
+
+            with self._initializing():
+                retval = await self.send(*segments, internal_send=True)
+                self._process_init_response(retval, tan_seg)
+                return retval
+
+    async def end(self):
+        if self._start_end():
+            response = await self.send(HKEND1(self.dialog_id), internal_send=True)
+            self.open = False
+
+    async def send(self, *segments, **kwargs):
+        internal_send = kwargs.pop('internal_send', False)
+
+        if self._start_send():
+            await self.init()
+
+        message = self._prepare_send(segments)
+        response = self.client.connection.send(message)
+        if inspect.isawaitable(response):
+            response = await response
+        return self._process_send_response(message, response, internal_send)
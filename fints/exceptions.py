@@ -44,3 +44,11 @@ class FinTSUnsupportedOperation(FinTSError):
 
 class FinTSNoResponseError(FinTSError):
     pass
+
+
+class FinTSTimeoutError(FinTSConnectionError):
+    pass
+
+
+class FinTSCircuitOpenError(FinTSConnectionError):
+    pass
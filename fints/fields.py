@@ -1,6 +1,7 @@
 import datetime
 import decimal
 import re
+import sys
 import warnings
 
 from fints.types import Container, SegmentSequence, TypedField
@@ -9,6 +10,15 @@ from fints.utils import (
 )
 
 
+#: Parsed alphanumeric values up to this length are interned. They are mostly codes (segment types,
+#: currencies, bank codes) that repeat throughout the BPD and UPD.
+INTERN_MAX_LENGTH = 8
+
+
+def _intern_short(value):
+    return sys.intern(value) if len(value) <= INTERN_MAX_LENGTH else value
+
+
 class DataElementField(DocTypeMixin, TypedField):
     pass
 
@@ -63,6 +73,8 @@ class TextField(FieldRenderFormatStringMixin, DataElementField):
 class AlphanumericField(TextField):
     type = 'an'
 
+    def _parse_value(self, value): return _intern_short(str(value))
+
 
 class DTAUSField(DataElementField):
     type = 'dta'
@@ -79,6 +91,8 @@ class NumericField(FieldRenderFormatStringMixin, DataElementField):
             raise ValueError("Leading zeroes not allowed for value of type 'num': {!r}".format(value))
         return int(_value, 10)
 
+    def _parse_value_trusted(self, value): return int(value, 10)
+
 
 class ZeroPaddedNumericField(NumericField):
     type = ''
@@ -107,7 +121,9 @@ class DigitsField(FieldRenderFormatStringMixin, DataElementField):
         _value = str(value)
         if not re.match(r'^\d*$', _value):
             raise TypeError("Only digits allowed for value of type 'dig': {!r}".format(value))
-        return _value
+        return _intern_short(_value)
+
+    def _parse_value_trusted(self, value): return _intern_short(value)
 
 
 class FloatField(DataElementField):
@@ -129,6 +145,9 @@ class FloatField(DataElementField):
 
         return float(_value.replace(",", "."))
 
+    def _parse_value_trusted(self, value):
+        return float(value.replace(",", "."))
+
     def _render_value(self, value):
         retval = self._FORMAT_STRING.format(value)
         retval = retval.replace('.', ',').rstrip('0')
@@ -155,6 +174,12 @@ class AmountField(FixedLengthMixin, DataElementField):
 
         return decimal.Decimal(_value.replace(",", "."))
 
+    def _parse_value_trusted(self, value):
+        try:
+            return decimal.Decimal(value.replace(",", "."))
+        except decimal.InvalidOperation as e:
+            raise ValueError("Invalid value {!r} for type 'wrt'".format(value)) from e
+
     def _render_value(self, value):
         retval = str(value)
         retval = retval.replace('.', ',').rstrip('0')
@@ -172,7 +197,15 @@ class BinaryField(DataElementField):
 
         return retval
 
-    def _parse_value(self, value): return bytes(value)
+    def _check_value(self, value):
+        # Same check as _render_value(), but without copying memoryview values
+        self._check_value_length(value)
+
+    def _parse_value(self, value):
+        if isinstance(value, memoryview):
+            # Keep zero-copy parse results as they are, they are converted on first access
+            return value
+        return bytes(value)
 
 
 class IDField(FixedLengthMixin, AlphanumericField):
@@ -269,6 +302,9 @@ class DateField(FixedLengthMixin, NumericField):
         val = str(val)
         return datetime.date(int(val[0:4]), int(val[4:6]), int(val[6:8]))
 
+    def _parse_value_trusted(self, value):
+        return datetime.date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
     def _render_value(self, value):
         val = "{:04d}{:02d}{:02d}".format(value.year, value.month, value.day)
         val = int(val)
@@ -286,6 +322,9 @@ class TimeField(FixedLengthMixin, DigitsField):
         val = super()._parse_value(value)
         return datetime.time(int(val[0:2]), int(val[2:4]), int(val[4:6]))
 
+    def _parse_value_trusted(self, value):
+        return datetime.time(int(value[0:2]), int(value[2:4]), int(value[4:6]))
+
     def _render_value(self, value):
         val = "{:02d}{:02d}{:02d}".format(value.hour, value.minute, value.second)
         return super()._render_value(val)
@@ -309,6 +348,8 @@ class TimestampField(DataElementField):
 class PasswordField(AlphanumericField):
     type = ''
     _DOC_TYPE = Password
+    # Renders differently within Password.protect()
+    _RENDER_CACHEABLE = False
 
     def _parse_value(self, value):
         return Password(value)
@@ -319,6 +360,9 @@ class PasswordField(AlphanumericField):
 
 class SegmentSequenceField(DataElementField):
     type = 'sf'
+    _SEGMENT_SEQUENCE = True
+    # Modifications of the contained segment list are not tracked
+    _RENDER_CACHEABLE = False
 
     def _parse_value(self, value):
         if isinstance(value, SegmentSequence):
@@ -326,5 +370,11 @@ class SegmentSequenceField(DataElementField):
         else:
             return SegmentSequence(value)
 
+    def _check_value(self, value):
+        # Don't render the nested message just to check it, that would also
+        # construct all segments of a lazily parsed message.
+        if not isinstance(value, SegmentSequence):
+            raise TypeError("Value {!r} is not a SegmentSequence".format(value))
+
     def _render_value(self, value):
         return value.render_bytes()
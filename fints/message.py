@@ -1,8 +1,10 @@
+import weakref
 from enum import Enum
 
 from .formals import SegmentSequence
 from .segments.base import FinTS3Segment
 from .segments.dialog import HIRMS2
+from .types import _add_render_parent_below
 
 
 class MessageDirection(Enum):
@@ -14,6 +16,11 @@ class FinTSMessage(SegmentSequence):
     DIRECTION = None
     # Auto-Numbering, dialog relation, security base
 
+    #: Serialization of the finished message, see set_rendered_bytes()
+    _rendered_bytes = None
+    #: HIRMS responses by reference, see _get_response_index()
+    _response_index = None
+
     def __init__(self, dialog=None, *args, **kwargs):
         self.dialog = dialog
         self.next_segment_number = 1
@@ -25,18 +32,61 @@ class FinTSMessage(SegmentSequence):
         segment.header.number = self.next_segment_number
         self.next_segment_number += 1
         self.segments.append(segment)
+        self._rendered_bytes = None
         return self
 
+    def set_rendered_bytes(self, data: bytes):
+        """Store the serialization of the finished message, to be returned by render_bytes() from now on.
+
+        Used by FinTSDialog.finish_message(), so that the message is only serialized once. Appending
+        a segment discards it, other modifications of the message are not tracked."""
+        self._rendered_bytes = data
+
+    def render_bytes(self) -> bytes:
+        if self._rendered_bytes is not None:
+            return self._rendered_bytes
+        return super().render_bytes()
+
+    def _invalidate_render_cache(self):
+        self._response_index = None
+        super()._invalidate_render_cache()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_response_index', None)
+        return state
+
+    def _get_response_index(self):
+        """Return the HIRMS responses of this message, as a dict that maps the number of the segment that they
+        refer to to a tuple (responses, by_code). responses is the list of all these responses, by_code maps
+        their codes to lists of responses.
+
+        Like the segment index of find_segments(), this is kept until the message is modified."""
+        index = self._response_index
+        if index is not None:
+            return index
+
+        index = {}
+        ref = weakref.ref(self)
+        for segment in self.find_segments(HIRMS2):
+            responses, by_code = index.setdefault(segment.header.reference, ([], {}))
+            for response in segment.responses:
+                responses.append(response)
+                by_code.setdefault(response.code, []).append(response)
+            # Modifications of the responses are not seen by the segment index
+            _add_render_parent_below(segment, ref)
+        self._response_index = index
+        return index
+
+    def command_responses(self, ref):
+        """Return the :class:`CommandResponses` to the command segment ref"""
+        return CommandResponses(self, ref)
+
     def response_segments(self, ref, *args, **kwargs):
-        for segment in self.find_segments(*args, **kwargs):
-            if segment.header.reference == ref.header.number:
-                yield segment
+        return self.command_responses(ref).segments(*args, **kwargs)
 
     def responses(self, ref, code=None):
-        for segment in self.response_segments(ref, HIRMS2):
-            for response in segment.responses:
-                if code is None or response.code == code:
-                    yield response
+        return self.command_responses(ref).responses(code)
 
 
 class FinTSCustomerMessage(FinTSMessage):
@@ -46,3 +96,116 @@ class FinTSCustomerMessage(FinTSMessage):
 
 class FinTSInstituteMessage(FinTSMessage):
     DIRECTION = MessageDirection.FROM_INSTITUTE
+
+
+class CommandResponses:
+    """View of the responses of the bank to one command segment, in a response message.
+
+    Lookups use the indexes of the message, so they do not scan the message and stay
+    valid when the message is modified.
+
+    :param message: The response message
+    :param ref: The command segment, from the message that was answered with message
+    """
+
+    def __init__(self, message: FinTSMessage, ref: FinTS3Segment):
+        self.message = message
+        self.reference = ref.header.number
+
+    def _entry(self):
+        return self.message._get_response_index().get(self.reference, ((), {}))
+
+    def segments(self, *args, **kwargs):
+        """Yields the segments that refer to the command segment, with the same parameters as find_segments()"""
+        return self.message.find_segments(*args, reference=[self.reference], **kwargs)
+
+    def responses(self, code=None):
+        """Return the list of responses (of HIRMS segments) to the command segment, only those with code if given"""
+        responses, by_code = self._entry()
+        if code is None:
+            return list(responses)
+        return list(by_code.get(code, ()))
+
+    def codes(self):
+        """Return the set of response codes to the command segment"""
+        return set(self._entry()[1])
+
+    def has_code(self, *codes):
+        """Return whether there is a response with one of codes"""
+        by_code = self._entry()[1]
+        return any(code in by_code for code in codes)
+
+    def __repr__(self):
+        return "<{}(reference={!r}, codes={!r})>".format(self.__class__.__name__, self.reference, sorted(self.codes()))
+
+
+def _walk_segments(sequence):
+    # All segments of sequence and of the segment sequences nested in them, in message order. Unlike
+    # find_segments(), this does not build an index that would only be used once.
+    for segment in sequence.segments:
+        yield segment
+        for name in segment._segment_sequence_fields:
+            val = getattr(segment, name)
+            if isinstance(val, SegmentSequence):
+                yield from _walk_segments(val)
+
+
+class ResponseDispatcher:
+    """Routes the segments of a response message to handlers, walking the message only once.
+
+    Each handler is registered with a query that selects the segments it wants to see. :meth:`dispatch`
+    collects the matching segments of all handlers in one walk over the message (including nested
+    messages, see :meth:`~fints.types.SegmentSequence.find_segments`), then calls the handlers in the order in which they were registered. A handler is only
+    called if at least one segment matched, with the list of matching segments in message order."""
+
+    def __init__(self):
+        self.handlers = []
+        # (segment class, segment type) -> indices of the handlers that match, see _match()
+        self._matches = {}
+
+    def register(self, handler, query=None, type_filter=None):
+        """Register handler, to be called as ``handler(segments, *args)`` from :meth:`dispatch`.
+
+        :param query: Either a str or class specifying a segment type (such as 'HIUPD', or
+                     :class:`~fints.segments.bank.HIUPA4`), or a list or tuple of strings or classes,
+                     like for :meth:`~fints.types.SegmentSequence.find_segments`.
+        :param type_filter: A callable that will be given the segment type (such as 'HIUPD') and must
+                            return a boolean indicating whether to pass the segment to the handler.
+
+        The match results of both parameters are AND-combined."""
+        if query is None:
+            query = ()
+        elif isinstance(query, (str, type)):
+            query = (query, )
+        self.handlers.append((handler, tuple(query), type_filter))
+        self._matches.clear()
+
+    def unregister(self, handler):
+        self.handlers = [h for h in self.handlers if h[0] != handler]
+        self._matches.clear()
+
+    def _match(self, clazz, type_):
+        retval = []
+        for i, (handler, query, type_filter) in enumerate(self.handlers):
+            if query and not any((issubclass(clazz, t) if isinstance(t, type) else type_ == t) for t in query):
+                continue
+            if type_filter is not None and not type_filter(type_):
+                continue
+            retval.append(i)
+        return tuple(retval)
+
+    def dispatch(self, message, *args):
+        """Pass the segments of message to the registered handlers, with the additional arguments args"""
+        matches = self._matches
+        buckets = [[] for _ in self.handlers]
+        for segment in _walk_segments(message):
+            key = (segment.__class__, segment.header.type)
+            indices = matches.get(key)
+            if indices is None:
+                indices = matches[key] = self._match(*key)
+            for i in indices:
+                buckets[i].append(segment)
+
+        for (handler, _, _), segments in zip(list(self.handlers), buckets):
+            if segments:
+                handler(segments, *args)
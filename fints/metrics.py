@@ -0,0 +1,243 @@
+"""In-process metrics of the connection layer
+
+The connections record their metrics in :data:`registry`: the bytes, latency, base64 decode and
+parse time of every request, by URL and type of the command segment of the request (such as
+``HKKAZ``), and timeouts, retries and the decisions of the circuit breakers. Read them as a dict
+with :meth:`MetricsRegistry.snapshot`, or in the Prometheus text format with
+:meth:`MetricsRegistry.prometheus_text`. Recording is off by default, set ``registry.enabled = True``
+to turn it on; while it is off, the connections skip the measurements as well.
+"""
+import bisect
+import math
+import threading
+
+#: Upper bounds of the buckets of the histograms, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    ) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _enabled(self):
+        return self.registry is None or self.registry.enabled
+
+    def _items(self):
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Counter with labels
+
+    :param name: Name of the counter
+    :param documentation: What is counted
+    :param labelnames: Names of the labels, which are passed as keyword arguments to :meth:`inc`
+    :param registry: :class:`MetricsRegistry` that the counter belongs to, for its ``enabled`` switch
+    """
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self._enabled():
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the current value for the given labels"""
+        return self._values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        """Return a list of dicts with the ``labels`` and the ``value`` of every label combination"""
+        return [{'labels': labels, 'value': value} for labels, value in self._items()]
+
+    def _prometheus_lines(self):
+        for labels, value in self._items():
+            yield '{}{} {}'.format(self.name, _format_labels(labels), _format_value(value))
+
+
+class Histogram(_Metric):
+    """Histogram with labels, which counts the observed values in buckets, and keeps their sum
+
+    :param name: Name of the histogram
+    :param documentation: What is observed
+    :param labelnames: Names of the labels, which are passed as keyword arguments to :meth:`observe`
+    :param registry: :class:`MetricsRegistry` that the histogram belongs to, for its ``enabled`` switch
+    :param buckets: Upper bounds of the buckets, in ascending order
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not self._enabled():
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Counts per bucket (the last one is for values above all bounds), sum
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _cumulative(self, entry):
+        retval = {}
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf, ), entry[0]):
+            total += count
+            retval[bound] = total
+        return retval
+
+    def value(self, **labels):
+        """Return the ``count``, ``sum`` and cumulative ``buckets`` (by upper bound) for the given labels"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            entry = [list(entry[0]), entry[1]] if entry is not None else [[0] * (len(self.buckets) + 1), 0.0]
+        return {'count': sum(entry[0]), 'sum': entry[1], 'buckets': self._cumulative(entry)}
+
+    def _items(self):
+        with self._lock:
+            return [
+                (dict(zip(self.labelnames, key)), [list(entry[0]), entry[1]]) for key, entry in self._values.items()
+            ]
+
+    def snapshot(self):
+        """Return a list of dicts with the ``labels``, ``count``, ``sum`` and cumulative ``buckets`` (by
+        upper bound) of every label combination"""
+        return [
+            {'labels': labels, 'count': sum(entry[0]), 'sum': entry[1], 'buckets': self._cumulative(entry)}
+            for labels, entry in self._items()
+        ]
+
+    def _prometheus_lines(self):
+        for labels, entry in self._items():
+            for bound, count in self._cumulative(entry).items():
+                yield '{}_bucket{} {}'.format(self.name, _format_labels(dict(labels, le=_format_value(bound))), count)
+            yield '{}_sum{} {}'.format(self.name, _format_labels(labels), _format_value(entry[1]))
+            yield '{}_count{} {}'.format(self.name, _format_labels(labels), sum(entry[0]))
+
+
+class MetricsRegistry:
+    """Holds the metrics of a process, by name
+
+    :param enabled: Whether the metrics record anything
+    """
+
+    def __init__(self, enabled=False):
+        #: Whether the metrics record anything, and the connections measure anything
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, self, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric {} is a {}".format(name, metric.type))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        """Return the counter with the given name, create it if it does not exist yet"""
+        return self._get(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        """Return the histogram with the given name, create it if it does not exist yet"""
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def _all(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def clear(self):
+        """Reset all metrics to zero"""
+        for metric in self._all():
+            metric.clear()
+
+    def snapshot(self):
+        """Return the values of all metrics as a plain dict, by name, see :meth:`Counter.snapshot`
+        and :meth:`Histogram.snapshot`"""
+        return {metric.name: metric.snapshot() for metric in self._all()}
+
+    def prometheus_text(self):
+        """Return the values of all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._all():
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric._prometheus_lines())
+        return '\n'.join(lines) + '\n'
+
+
+#: The registry the connections record their metrics in, disabled until ``registry.enabled`` is set
+registry = MetricsRegistry()
+
+requests = registry.counter(
+    'fints_requests_total', "Requests sent, by outcome: ok or the name of the exception", ('url', 'segment', 'outcome'),
+)
+request_bytes = registry.counter(
+    'fints_request_bytes_total', "Bytes sent, as on the wire", ('url', 'segment'),
+)
+response_bytes = registry.counter(
+    'fints_response_bytes_total', "Bytes received, as on the wire", ('url', 'segment'),
+)
+latency = registry.histogram(
+    'fints_latency_seconds', "Seconds from sending a request until the server answers", ('url', 'segment'),
+)
+decode_time = registry.histogram(
+    'fints_decode_seconds', "Seconds spent decoding the base64 encoded responses", ('url', 'segment'),
+)
+parse_time = registry.histogram(
+    'fints_parse_seconds', "Seconds spent parsing the responses", ('url', 'segment'),
+)
+timeouts = registry.counter(
+    'fints_timeouts_total', "Requests that timed out, by kind: connect, read or deadline", ('url', 'kind'),
+)
+retries = registry.counter(
+    'fints_retries_total', "Requests that were repeated after a failure", ('url', 'reason'),
+)
+circuit_breaker_transitions = registry.counter(
+    'fints_circuit_breaker_transitions_total', "State changes of the circuit breakers, by new state", ('url', 'state'),
+)
+circuit_breaker_rejections = registry.counter(
+    'fints_circuit_breaker_rejections_total', "Requests that were not sent because the circuit breaker was open", ('url', ),
+)
@@ -1,17 +1,19 @@
+import linecache
 import re
 import warnings
 from collections.abc import Iterable
 from enum import Enum
 
 from .formals import (
-    Container, DataElementGroupField, SegmentSequence, ValueList,
+    Container, DataElementGroupField, SegmentHeader, SegmentSequence, ValueList,
 )
+from .types import LazySegmentList
 # Ensure that all segment types are loaded (otherwise the subclass find won't see them)
 from .segments import (  # noqa
     accounts, auth, bank, base, debit, depot, dialog,
     journal, message, saldo, statement, transfer,
 )
-from .segments.base import FinTS3Segment
+from .segments.base import FinTS3Segment, SkimmedSegment
 
 # 
 # FinTS 3.0 structure:
@@ -53,14 +55,28 @@ class FinTSParserError(ValueError):
     pass
 
 
+# Note: TOKEN_RE is applied with an explicit position (TOKEN_RE.match(data, pos, end)),
+# so it must not be anchored with "^", which would only match at the start of the buffer.
 TOKEN_RE = re.compile(rb"""
-                        ^(?:  (?: \? (?P<ECHAR>.) )
+                        (?:  (?: \? (?P<ECHAR>.) )
                             | (?P<CHAR>[^?:+@']+)
                             | (?P<TOK>[+:'])
                             | (?: @ (?P<BINLEN>[0-9]+) @ )
                          )""", re.X | re.S)
 
 
+SEGMENT_DELIMITER_RE = re.compile(rb"[?@']")
+
+BINLEN_PREFIX_RE = re.compile(rb"@[0-9]*")
+
+#: Characters that need to be escaped with "?" when serializing
+ESCAPE_CHARACTERS = b"+:'@?"
+
+ESCAPE_RE = re.compile(rb"([+:'@?])")
+
+SEGMENT_HEADER_RE = re.compile(rb"([A-Za-z]+):([0-9]+):([0-9]+)(?::([0-9]+))?:?[+']")
+
+
 class Token(Enum):
     EOF = 'eof'
     CHAR = 'char'
@@ -70,6 +86,13 @@ class Token(Enum):
     APOSTROPHE = "'"
 
 
+_TOKEN_TYPES = {
+    b'+': Token.PLUS,
+    b':': Token.COLON,
+    b"'": Token.APOSTROPHE,
+}
+
+
 class ParserState:
     def __init__(self, data: bytes, start=0, end=None, encoding='iso-8859-1'):
         self._token = None
@@ -91,40 +114,43 @@ class ParserState:
 
     @staticmethod
     def _tokenize(data, start, end, encoding):
+        # Scan by offset: slicing the buffer for every token (data[pos:end]) would copy the
+        # remainder of the message each time and make tokenizing quadratic in message size.
         pos = start
         unclaimed = []
         last_was = None
-        
+        match_token = TOKEN_RE.match
+
         while pos < end:
-            match = TOKEN_RE.match(data[pos:end])
-            if match:
-                pos += match.end()
-                d = match.groupdict()
-                if d['ECHAR'] is not None:
-                    unclaimed.append(d['ECHAR'])
-                elif d['CHAR'] is not None:
-                    unclaimed.append(d['CHAR'])
-                else:
-                    if unclaimed:
-                        if last_was in (Token.BINARY, Token.CHAR):
-                            raise ValueError
-                        yield Token.CHAR, b''.join(unclaimed).decode(encoding)
-                        unclaimed.clear()
-                        last_was = Token.CHAR
-
-                    if d['TOK'] is not None:
-                        token = Token(d['TOK'].decode('us-ascii'))
-                        yield token, d['TOK']
-                        last_was = token
-                    elif d['BINLEN'] is not None:
-                        blen = int(d['BINLEN'].decode('us-ascii'), 10)
-                        if last_was in (Token.BINARY, Token.CHAR):
-                            raise ValueError
-                        yield Token.BINARY, data[pos:pos+blen]
-                        pos += blen
-                        last_was = Token.BINARY
-                    else:
-                        raise ValueError
+            match = match_token(data, pos, end)
+            if not match:
+                raise ValueError
+
+            pos = match.end()
+            kind = match.lastgroup
+            if kind == 'CHAR' or kind == 'ECHAR':
+                unclaimed.append(match.group(kind))
+                continue
+
+            if unclaimed:
+                if last_was in (Token.BINARY, Token.CHAR):
+                    raise ValueError
+                yield Token.CHAR, b''.join(unclaimed).decode(encoding)
+                unclaimed.clear()
+                last_was = Token.CHAR
+
+            if kind == 'TOK':
+                value = match.group(kind)
+                token = _TOKEN_TYPES[value]
+                yield token, value
+                last_was = token
+            elif kind == 'BINLEN':
+                blen = int(match.group(kind), 10)
+                if last_was in (Token.BINARY, Token.CHAR):
+                    raise ValueError
+                yield Token.BINARY, data[pos:pos+blen]
+                pos += blen
+                last_was = Token.BINARY
             else:
                 raise ValueError
 
@@ -138,20 +164,461 @@ class ParserState:
         yield Token.EOF, b''
 
 
+#: Available implementations for FinTS3Parser(engine=...)
+PARSER_ENGINES = ('plan', 'generic', 'codegen')
+
+#: Available implementations for FinTS3Serializer(engine=...)
+SERIALIZER_ENGINES = ('direct', 'generic', 'codegen')
+
+
+def _no_check(value):
+    pass
+
+
+def _trusted_parse_function(field):
+    # The _parse_value_trusted() of the class that defines the _parse_value() in effect, if any
+    for klass in type(field).__mro__:
+        if '_parse_value' in klass.__dict__:
+            if '_parse_value_trusted' in klass.__dict__:
+                return field._parse_value_trusted
+            break
+    return field._parse_value
+
+
+def get_parse_plan(clazz, trusted=False):
+    """Return the parse plan of a Container subclass, building it on first use.
+
+    The plan is a tuple with one entry per field, in field order, holding everything
+    the parser needs to know about the field: (name, field, repeat, constructed, is_last,
+    count, max_count, required, deg_type, nested, parse, check, default, index). parse, check
+    and default are the bound _parse_value, _check_value and _default_value methods of
+    the field, index is the position of its value in Container._values. The plan is cached
+    on the class itself.
+
+    The plan for trusted input uses _parse_value_trusted where available, and does not check values."""
+    attribute = '_parse_plan_trusted' if trusted else '_parse_plan'
+    plan = clazz.__dict__.get(attribute)
+    if plan is None:
+        fields = list(clazz._fields.items())
+        plan = tuple(
+            (
+                name,
+                field,
+                field.count != 1,
+                isinstance(field, DataElementGroupField),
+                number == len(fields) - 1,
+                field.count,
+                field.max_count,
+                field.required,
+                field.type if isinstance(field, DataElementGroupField) else None,
+                field._SEGMENT_SEQUENCE,
+                _trusted_parse_function(field) if trusted else field._parse_value,
+                _no_check if trusted else field._check_value,
+                field._default_value,
+                field._index,
+            )
+            for number, (name, field) in enumerate(fields)
+        )
+        setattr(clazz, attribute, plan)
+    return plan
+
+
+def is_render_cacheable(clazz):
+    """Return whether renderings of instances of a Container subclass may be cached, see FinTS3Serializer"""
+    retval = clazz.__dict__.get('_render_cacheable')
+    if retval is None:
+        retval = all(
+            field._RENDER_CACHEABLE and (
+                not isinstance(field, DataElementGroupField)
+                or (field.type is not None and is_render_cacheable(field.type))
+            )
+            for field in clazz._fields.values()
+        )
+        clazz._render_cacheable = retval
+    return retval
+
+
+def _parse_deg_noniter_generated(parser, parse_deg, clazz, data, required):
+    if not isinstance(data, Iterable) or isinstance(data, (str, bytes, bytearray, memoryview)):
+        data = [data]
+
+    data_i = iter(data)
+
+    retval = parse_deg(parser, data_i, required)
+
+    remainder = list(data_i)
+    if remainder:
+        raise FinTSParserError("Unparsed data {!r} after parsing {!r}".format(remainder, clazz))
+
+    return retval
+
+
+def _compile_function(clazz, kind, function_name, lines, namespace):
+    source = "\n".join(lines) + "\n"
+    filename = "<fints {} {}.{}>".format(kind, clazz.__module__, clazz.__qualname__)
+    exec(compile(source, filename, 'exec'), namespace)
+    # Make the generated source show up in tracebacks
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    return namespace[function_name]
+
+
+def _cached_function(clazz, attribute, builder):
+    function = clazz.__dict__.get(attribute)
+    if function is None:
+        function = builder(clazz)
+        setattr(clazz, attribute, staticmethod(function))
+    else:
+        function = function.__func__
+    return function
+
+
+def _generate_parse_function(clazz, segment_level, trusted=False):
+    """Generate the source of a parse function for clazz, with all fields unrolled.
+
+    On segment level the function is called as f(parser, segment) with an exploded
+    segment, otherwise as f(parser, data_i, required) with an iterator over the flattened
+    data elements of the group. The generated code follows the logic of
+    FinTS3Parser._parse_segment_with_plan and FinTS3Parser._parse_deg_with_plan exactly,
+    with the parse plan for trusted input if trusted is True."""
+    namespace = {
+        'FinTSParserError': FinTSParserError,
+        'ValueList': ValueList,
+        'new_unset': clazz._new_unset,
+        'parse_deg_noniter': _parse_deg_noniter_generated,
+        'BINARY_TYPES': (bytes, bytearray, memoryview),
+    }
+
+    if segment_level:
+        lines = [
+            "def parse(parser, segment):",
+            "    retval = new_unset()",
+            "    values = retval._values",
+            "    data = iter(segment)",
+        ]
+        source, stop = "data", ["    return retval"]
+    else:
+        lines = [
+            "def parse(parser, data_i, required):",
+            "    retval = new_unset()",
+            "    values = retval._values",
+            "    empty = True",
+        ]
+        source, stop = "data_i", ["    return None if empty else retval"]
+
+    def indent(level, block):
+        return ["    " * level + line for line in block]
+
+    for number, (name, field, repeat, constructed, is_last, count, max_count, required, deg_type, nested, parse, check, default, index) in enumerate(get_parse_plan(clazz, trusted)):
+        namespace.update({
+            'F{}'.format(number): field,
+            'P{}'.format(number): parse,
+            'C{}'.format(number): check,
+            'D{}'.format(number): default,
+        })
+        if constructed:
+            namespace['T{}'.format(number)] = deg_type
+            namespace['G{}'.format(number)] = get_generated_deg_parser(deg_type, trusted)
+        wrong_input = "Wrong input when setting {}.{}".format(clazz.__name__, name)
+        not_present = "Required field {}.{} was not present".format(clazz.__name__, name)
+        convert = ["val = P{}(val)".format(number)]
+        if not trusted:
+            convert.append("C{}(val)".format(number))
+        limit = min(x for x in (count, max_count, float('inf')) if x is not None)
+
+        lines.append("    # {}".format(name))
+        if not repeat:
+            if segment_level:
+                lines += [
+                    "    try:",
+                    "        val = next(data)",
+                    "    except StopIteration:",
+                ]
+                lines += ["        raise FinTSParserError({!r})".format(not_present)] if required else indent(1, stop)
+                if nested:
+                    lines += [
+                        "    if isinstance(val, BINARY_TYPES):",
+                        "        val = parser.parse_message(val)",
+                    ]
+                lines.append("    try:")
+                if constructed:
+                    lines.append("        val = parse_deg_noniter(parser, G{0}, T{0}, val, {1!r})".format(number, required))
+            else:
+                lines.append("    try:")
+                if not constructed:
+                    lines += [
+                        "        try:",
+                        "            val = next(data_i)",
+                        "        except StopIteration:",
+                    ]
+                    if required:
+                        lines += [
+                            "            if required:",
+                            "                raise FinTSParserError({!r})".format(not_present),
+                        ]
+                    lines += indent(2, stop)
+                else:
+                    lines.append("        val = G{}(parser, data_i, {})".format(number, "required" if required else "False"))
+            lines.append("        if val is not None:")
+            lines += indent(3, convert)
+            lines.append("            values[{}] = val".format(index))
+            if not segment_level:
+                lines.append("            empty = False")
+            lines += [
+                "    except ValueError as e:",
+                "        raise FinTSParserError({!r}) from e".format(wrong_input),
+            ]
+        else:
+            lines.append("    items = None")
+            if not segment_level:
+                lines.append("    skipped = 0")
+            if limit != float('inf'):
+                lines.append("    i = 0")
+            if constructed and not segment_level:
+                require_last = (max_count is None) if is_last else True
+                lines += [
+                    "    while True:",
+                    "        try:",
+                    "            val = G{}(parser, data_i, {})".format(number, "required" if require_last and required else "False"),
+                ]
+            else:
+                lines.append("    for val in {}:".format(source))
+                if segment_level:
+                    lines += [
+                        "        if items is None:",
+                        "            items = []",
+                        "            values[{}] = ValueList(F{}, items)".format(index, number),
+                    ]
+                lines.append("        try:")
+                if constructed:
+                    lines.append("            val = parse_deg_noniter(parser, G{0}, T{0}, val, {1!r})".format(number, required))
+            if segment_level:
+                lines += [
+                    "            if val is None:",
+                    "                val = D{}()".format(number),
+                    "            else:",
+                ]
+                lines += indent(4, convert)
+                lines.append("            items.append(val)")
+            else:
+                lines += [
+                    "            if val is None:",
+                    "                skipped += 1",
+                    "            else:",
+                ]
+                lines += indent(4, convert)
+                lines += [
+                    "                if items is None:",
+                    "                    items = []",
+                    "                    values[{}] = ValueList(F{}, items)".format(index, number),
+                    "                    empty = False",
+                    "                if skipped:",
+                    "                    items.extend(D{}() for _ in range(skipped))".format(number),
+                    "                    skipped = 0",
+                    "                items.append(val)",
+                ]
+            lines += [
+                "        except ValueError as e:",
+                "            raise FinTSParserError({!r}) from e".format(wrong_input),
+            ]
+            if limit != float('inf'):
+                lines += [
+                    "        i += 1",
+                    "        if i >= {}:".format(limit),
+                    "            break",
+                ]
+
+    if segment_level:
+        lines += [
+            "    additional_data = list(data)",
+            "    if additional_data:",
+            "        retval._additional_data = additional_data",
+        ]
+    lines += indent(0, stop)
+
+    return _compile_function(clazz, 'parser', 'parse', lines, namespace)
+
+
+def get_generated_segment_parser(clazz, trusted=False):
+    """Return the generated parse function f(parser, segment) of a segment class, generating it on first use"""
+    return _cached_function(
+        clazz, '_generated_parse_segment_trusted' if trusted else '_generated_parse_segment',
+        lambda clazz: _generate_parse_function(clazz, True, trusted)
+    )
+
+
+def get_generated_deg_parser(clazz, trusted=False):
+    """Return the generated parse function f(parser, data_i, required) of a data element group class, generating it on first use"""
+    return _cached_function(
+        clazz, '_generated_parse_deg_trusted' if trusted else '_generated_parse_deg',
+        lambda clazz: _generate_parse_function(clazz, False, trusted)
+    )
+
+
+def _serialize_deg_generated(serializer, deg, allow_skip):
+    return get_generated_deg_serializer(deg.__class__)(serializer, deg, allow_skip)
+
+
+def _generate_serialize_function(clazz, segment_level):
+    """Generate the source of a serialize function for clazz, with all fields unrolled.
+
+    On segment level the function is called as f(serializer, segment), otherwise as
+    f(serializer, deg, allow_skip). The generated code follows the logic of
+    FinTS3Serializer.serialize_segment and FinTS3Serializer.serialize_deg exactly."""
+    namespace = {
+        'serialize_deg': _serialize_deg_generated,
+    }
+
+    if segment_level:
+        lines = [
+            "def serialize(serializer, segment):",
+            "    result = []",
+            "    filler = 0",
+        ]
+        instance = "segment"
+    else:
+        lines = [
+            "def serialize(serializer, deg, allow_skip):",
+            "    result = []",
+            "    filler = 0",
+        ]
+        instance = "deg"
+
+    may_have_filler = False
+    for number, (name, field) in enumerate(clazz._fields.items()):
+        repeat = field.count != 1
+        constructed = isinstance(field, DataElementGroupField)
+        namespace['R{}'.format(number)] = field.render
+
+        if constructed:
+            namespace['T{}'.format(number)] = field.type
+            namespace['S{}'.format(number)] = get_generated_deg_serializer(field.type)
+            call = "(S{0} if {{0}}.__class__ is T{0} else serialize_deg)(serializer, {{0}}, {{1}})".format(number)
+            if repeat:
+                render = [
+                    "for item in val:",
+                    "    result.{}({})".format("append" if segment_level else "extend", call.format("item", "False")),
+                ]
+            else:
+                render = ["result.{}({})".format("append" if segment_level else "extend", call.format("val", "True" if segment_level else "False"))]
+        else:
+            if repeat:
+                render = ["result.extend([R{}(item) for item in val])".format(number)]
+            else:
+                render = ["result.append(R{}(val))".format(number)]
+
+        flush = [
+            "if filler:",
+            "    result.extend([None] * filler)",
+            "    filler = 0",
+        ] if may_have_filler else []
+
+        lines.append("    # {}".format(name))
+        lines.append("    val = {}.{}".format(instance, name))
+        if not field.required and (segment_level or not repeat):
+            if repeat:
+                empty = "len(val) == 0"
+            elif constructed:
+                empty = "val.is_unset()"
+            else:
+                empty = "val is None"
+            lines.append("    if {}:".format(empty))
+            if segment_level:
+                lines.append("        filler += 1")
+                may_have_filler = True
+            else:
+                lines += [
+                    "        if allow_skip:",
+                    "            filler += 1",
+                    "        else:",
+                    "            result.append(None)",
+                ]
+                may_have_filler = True
+            lines.append("    else:")
+            lines += ["        " + line for line in flush + render]
+        else:
+            lines += ["    " + line for line in flush + render]
+
+    if segment_level:
+        lines += [
+            "    if segment._additional_data:",
+            "        result.extend(segment._additional_data)",
+        ]
+    lines.append("    return result")
+
+    return _compile_function(clazz, 'serializer', 'serialize', lines, namespace)
+
+
+def get_generated_segment_serializer(clazz):
+    """Return the generated serialize function f(serializer, segment) of a segment class, generating it on first use"""
+    return _cached_function(clazz, '_generated_serialize_segment', lambda clazz: _generate_serialize_function(clazz, True))
+
+
+def get_generated_deg_serializer(clazz):
+    """Return the generated serialize function f(serializer, deg, allow_skip) of a data element group class, generating it on first use"""
+    return _cached_function(clazz, '_generated_serialize_deg', lambda clazz: _generate_serialize_function(clazz, False))
+
+
 class FinTS3Parser:
     """Parser for FinTS/HBCI 3.0 messages
+
+    :param zero_copy: If True, binary data elements (and the nested messages contained in them)
+        are not copied out of the input buffer, but kept as :class:`memoryview` slices of it.
+        Binary fields are converted to :class:`bytes` only when they are first read. Passing
+        a :class:`memoryview` to :meth:`parse_message` has the same effect.
+    :param lazy: If True, :meth:`parse_message` only indexes the segment boundaries and headers
+        of the message. Segment objects are constructed when they are first accessed, e.g.
+        through :meth:`~fints.types.SegmentSequence.find_segments`, iteration or indexing.
+        Note that parser errors in a segment will only be raised when it is accessed.
+    :param skim: Optional collection of segment types (e.g. ``{'HIRMG', 'HIRMS'}``) to parse completely.
+        Of all other segments, only the header is parsed, and the rest is kept as raw bytes in a
+        :class:`~fints.segments.base.SkimmedSegment`. Segments that contain nested messages (HNVSD)
+        are always parsed, their nested message is skimmed with the same settings.
+    :param engine: Implementation used to turn exploded segments into objects. ``'plan'`` (the
+        default) runs the cached parse plan of each class (see :func:`get_parse_plan`),
+        ``'generic'`` walks the field definitions of each class for every instance, ``'codegen'``
+        runs a parse function generated for each class (see :func:`get_generated_segment_parser`).
+    :param trusted: If True, the input is trusted to be well-formed, e.g. because it is a response of
+        the bank that will only be read. Values are converted without syntax checks, and without
+        checking that they can be rendered again (length restrictions etc.). The latter is done
+        anyway when the object is serialized. Ignored by the ``'generic'`` engine.
     """
 
+    def __init__(self, zero_copy=False, lazy=False, engine='plan', skim=None, trusted=False):
+        if engine not in PARSER_ENGINES:
+            raise ValueError("Unknown parser engine {!r}, must be one of {!r}".format(engine, PARSER_ENGINES))
+        self.zero_copy = zero_copy
+        self.lazy = lazy
+        self.engine = engine
+        self.skim = frozenset(skim) if skim is not None else None
+        self.trusted = trusted
+
     def parse_message(self, data: bytes) -> SegmentSequence:
         """Takes a FinTS 3.0 message as byte array, and returns a parsed segment sequence"""
-        if isinstance(data, bytes):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if self.zero_copy and not isinstance(data, memoryview):
+                data = memoryview(data)
+            if self.lazy:
+                return SegmentSequence(LazySegmentList(self, data, self.index_segments(data)))
+            if self.skim is not None:
+                return SegmentSequence([self.parse_segment_at(data, *entry) for entry in self.index_segments(data)])
             data = self.explode_segments(data)
 
-        message = SegmentSequence()
-        for segment in data:
-            seg = self.parse_segment(segment)
-            message.segments.append(seg)
-        return message
+        return SegmentSequence([self.parse_segment(segment) for segment in data])
+
+    def parse_segment_at(self, data, start, end, header):
+        """Parse the segment data[start:end], with an entry of :meth:`index_segments`"""
+        if self.skim is not None and header is not None and header[0] not in self.skim:
+            if not FinTS3Segment.lookup_subclass(header[0], header[2])._segment_sequence_fields:
+                return self._skim_segment(data, start, end, header)
+
+        return self.parse_segment(self.explode_segments(data, start, end)[0])
+
+    def _skim_segment(self, data, start, end, header):
+        body_start = SEGMENT_HEADER_RE.match(data, start, end).end()
+        return SkimmedSegment(
+            header=SegmentHeader(*header),
+            _raw=data[body_start:end-1] if isinstance(data, memoryview) else bytes(data[body_start:end-1]),
+        )
 
     def parse_segment(self, segment):
         clazz = FinTS3Segment.find_subclass(segment)
@@ -166,6 +633,11 @@ class FinTS3Parser:
                 raise
 
     def _parse_segment_as_class(self, clazz, segment):
+        if self.engine == 'plan':
+            return self._parse_segment_with_plan(clazz, segment)
+        elif self.engine == 'codegen':
+            return get_generated_segment_parser(clazz, self.trusted)(self, segment)
+
         seg = clazz()
 
         data = iter(segment)
@@ -181,6 +653,10 @@ class FinTS3Parser:
                         raise FinTSParserError("Required field {}.{} was not present".format(seg.__class__.__name__, name))
                     break
 
+                if field._SEGMENT_SEQUENCE and isinstance(val, (bytes, bytearray, memoryview)):
+                    # Parse nested messages with the same settings
+                    val = self.parse_message(val)
+
                 try:
                     if not constructed:
                         setattr(seg, name, val)
@@ -217,8 +693,158 @@ class FinTS3Parser:
 
         return seg
 
+    def _parse_segment_with_plan(self, clazz, segment):
+        seg = clazz._new_unset()
+        values = seg._values
+
+        data = iter(segment)
+        for name, field, repeat, constructed, is_last, count, max_count, required, deg_type, nested, parse, check, default, index in get_parse_plan(clazz, self.trusted):
+            if not repeat:
+                try:
+                    val = next(data)
+                except StopIteration:
+                    if required:
+                        raise FinTSParserError("Required field {}.{} was not present".format(clazz.__name__, name))
+                    break
+
+                if nested and isinstance(val, (bytes, bytearray, memoryview)):
+                    # Parse nested messages with the same settings
+                    val = self.parse_message(val)
+
+                try:
+                    if constructed:
+                        val = self._parse_deg_noniter_with_plan(deg_type, val, required)
+                    # Empty values are not stored, the field returns its default value
+                    if val is not None:
+                        val = parse(val)
+                        check(val)
+                        values[index] = val
+                except ValueError as e:
+                    raise FinTSParserError("Wrong input when setting {}.{}".format(clazz.__name__, name)) from e
+            else:
+                items = None
+                i = 0
+                while True:
+                    try:
+                        val = next(data)
+                    except StopIteration:
+                        break
+
+                    if items is None:
+                        # Items are added directly, without going through ValueList
+                        items = []
+                        values[index] = ValueList(field, items)
+
+                    try:
+                        if constructed:
+                            val = self._parse_deg_noniter_with_plan(deg_type, val, required)
+                        if val is None:
+                            val = default()
+                        else:
+                            val = parse(val)
+                            check(val)
+                        items.append(val)
+                    except ValueError as e:
+                        raise FinTSParserError("Wrong input when setting {}.{}".format(clazz.__name__, name)) from e
+
+                    i = i + 1
+
+                    if count is not None and i >= count:
+                        break
+                    if max_count is not None and i >= max_count:
+                        break
+
+        additional_data = list(data)
+        if additional_data:
+            seg._additional_data = additional_data
+
+        return seg
+
+    def _parse_deg_noniter_with_plan(self, clazz, data, required):
+        if not isinstance(data, Iterable) or isinstance(data, (str, bytes, bytearray, memoryview)):
+            data = [data]
+
+        data_i = iter(data)
+
+        retval = self._parse_deg_with_plan(clazz, data_i, required)
+
+        remainder = list(data_i)
+        if remainder:
+            raise FinTSParserError("Unparsed data {!r} after parsing {!r}".format(remainder, clazz))
+
+        return retval
+
+    def _parse_deg_with_plan(self, clazz, data_i, required=True):
+        """Parse a data element group of class clazz from data_i. Returns None if all its data elements are empty."""
+        retval = clazz._new_unset()
+        values = retval._values
+        empty = True
+
+        for name, field, repeat, constructed, is_last, count, max_count, field_required, deg_type, nested, parse, check, default, index in get_parse_plan(clazz, self.trusted):
+            if not repeat:
+                try:
+                    if not constructed:
+                        try:
+                            val = next(data_i)
+                        except StopIteration:
+                            if required and field_required:
+                                raise FinTSParserError("Required field {}.{} was not present".format(clazz.__name__, name))
+                            break
+                    else:
+                        val = self._parse_deg_with_plan(deg_type, data_i, required and field_required)
+
+                    if val is not None:
+                        val = parse(val)
+                        check(val)
+                        values[index] = val
+                        empty = False
+                except ValueError as e:
+                    raise FinTSParserError("Wrong input when setting {}.{}".format(clazz.__name__, name)) from e
+            else:
+                items = None
+                # Empty items are only added when a non-empty item follows, trailing empty items are not stored
+                skipped = 0
+                i = 0
+                while True:
+                    try:
+                        if not constructed:
+                            try:
+                                val = next(data_i)
+                            except StopIteration:
+                                break
+                        else:
+                            require_last = (max_count is None) if is_last else True
+                            val = self._parse_deg_with_plan(deg_type, data_i, require_last and required and field_required)
+
+                        if val is None:
+                            skipped += 1
+                        else:
+                            val = parse(val)
+                            check(val)
+                            if items is None:
+                                items = []
+                                values[index] = ValueList(field, items)
+                                empty = False
+                            if skipped:
+                                items.extend(default() for _ in range(skipped))
+                                skipped = 0
+                            items.append(val)
+                    except ValueError as e:
+                        raise FinTSParserError("Wrong input when setting {}.{}".format(clazz.__name__, name)) from e
+
+                    i = i + 1
+
+                    if count is not None and i >= count:
+                        break
+                    if max_count is not None and i >= max_count:
+                        break
+
+        if empty:
+            return None
+        return retval
+
     def parse_deg_noniter(self, clazz, data, required):
-        if not isinstance(data, Iterable) or isinstance(data, (str, bytes)):
+        if not isinstance(data, Iterable) or isinstance(data, (str, bytes, bytearray, memoryview)):
             data = [data]
 
         data_i = iter(data)
@@ -280,6 +906,47 @@ class FinTS3Parser:
 
         return retval
 
+    @staticmethod
+    def index_segments(data: bytes, start=0, end=None):
+        """Find the segment boundaries and headers of a message in one pass, without tokenizing the segments.
+
+        Returns a list of (start, end, header) tuples, where data[start:end] is the segment including its
+        terminating "'", and header is a (type, number, version, reference) tuple, or None if the segment
+        header could not be read."""
+        end = len(data) if end is None else end
+        retval = []
+
+        pos = start
+        while pos < end:
+            segment_start = pos
+            while True:
+                match = SEGMENT_DELIMITER_RE.search(data, pos, end)
+                if not match:
+                    raise ValueError("Unterminated segment at position {}".format(segment_start))
+                char = match.group()
+                if char == b"?":
+                    pos = match.end() + 1
+                elif char == b"@":
+                    binlen = TOKEN_RE.match(data, match.start(), end)
+                    if not binlen or binlen.lastgroup != 'BINLEN':
+                        raise ValueError("Invalid binary length at position {}".format(match.start()))
+                    pos = binlen.end() + int(binlen.group('BINLEN'), 10)
+                else:
+                    pos = match.end()
+                    break
+
+            header = SEGMENT_HEADER_RE.match(data, segment_start, pos)
+            if header:
+                header = (
+                    header.group(1).decode('us-ascii'),
+                    int(header.group(2), 10),
+                    int(header.group(3), 10),
+                    int(header.group(4), 10) if header.group(4) else None,
+                )
+            retval.append((segment_start, pos, header))
+
+        return retval
+
     @staticmethod
     def explode_segments(data: bytes, start=0, end=None):
         segments = []
@@ -318,25 +985,385 @@ class FinTS3Parser:
         return segments
 
 
+class FinTS3StreamParser:
+    """Incremental (push) parser for FinTS/HBCI 3.0 messages
+
+    Data is passed in in chunks of any size with :meth:`feed`, which returns the segments
+    that have been completed by the chunk, as soon as their terminating "'" has arrived.
+    Escape sequences and binary data elements may be split across chunks.
+
+    :param parser: The :class:`FinTS3Parser` to parse the segments with. Defaults to a new
+        parser with default settings (the ``lazy`` setting has no effect here).
+    :param unwrap: If True, the message nested in a HNVSD segment (the encryption envelope)
+        is parsed incrementally as well: its segments are returned as they arrive, in place
+        of the HNVSD segment itself.
+    :param keep_envelope: With unwrap, return the HNVSD segment with the nested segments in
+        its ``data`` once it is complete, instead of the nested segments. The result is the same
+        as without unwrap, but the nested message is never buffered as a whole.
+    """
+
+    def __init__(self, parser=None, unwrap=False, keep_envelope=False):
+        self.parser = parser or FinTS3Parser()
+        self.unwrap = unwrap
+        self.keep_envelope = keep_envelope
+        self._buffer = bytearray()
+        self._scan_pos = 0
+        self._nested = None
+        self._nested_remaining = 0
+        self._envelope = None
+        self._discard_segment = False
+
+    def feed(self, chunk) -> list:
+        """Add a chunk of data, return a list of the segments that were completed by it"""
+        self._buffer += chunk
+        retval = []
+
+        while True:
+            if self._nested is not None:
+                n = min(self._nested_remaining, len(self._buffer))
+                segments = self._nested.feed(self._buffer[:n])
+                del self._buffer[:n]
+                self._nested_remaining -= n
+                if self._envelope is not None:
+                    self._envelope[1].extend(segments)
+                else:
+                    retval.extend(segments)
+                if self._nested_remaining:
+                    break
+                self._nested.close()
+                self._nested = None
+                if self._envelope is not None:
+                    envelope, segments = self._envelope
+                    self._envelope = None
+                    envelope.data = SegmentSequence(segments)
+                    retval.append(envelope)
+                # Drop the rest of the HNVSD segment
+                self._discard_segment = True
+
+            end = self._find_segment_end()
+            if end is None:
+                break
+            if end < 0:
+                continue
+
+            with memoryview(self._buffer) as view:
+                segment = bytes(view[:end])
+            del self._buffer[:end]
+            self._scan_pos = 0
+
+            if self._discard_segment:
+                self._discard_segment = False
+                continue
+
+            if self.parser.zero_copy:
+                segment = memoryview(segment)
+            for entry in self.parser.index_segments(segment):
+                retval.append(self.parser.parse_segment_at(segment, *entry))
+
+        return retval
+
+    def close(self):
+        """Signal the end of the data. Raises FinTSParserError if it ended within a segment."""
+        if self._nested is not None or self._buffer:
+            raise FinTSParserError("Data ended within a segment")
+
+    def _find_segment_end(self):
+        """Continue scanning the buffer for the end of the current segment.
+
+        Returns the position after the "'" that terminates the segment, None if more data is needed,
+        or -1 if a nested message has been entered."""
+        data = self._buffer
+        end = len(data)
+        pos = self._scan_pos
+
+        while True:
+            if pos > end:
+                # Within binary data
+                break
+            match = SEGMENT_DELIMITER_RE.search(data, pos, end)
+            if not match:
+                pos = end
+                break
+            char = match.group()
+            if char == b"?":
+                if match.end() == end:
+                    # Escaped character has not arrived yet
+                    pos = match.start()
+                    break
+                pos = match.end() + 1
+            elif char == b"@":
+                binlen = TOKEN_RE.match(data, match.start(), end)
+                if not binlen or binlen.lastgroup != 'BINLEN':
+                    if BINLEN_PREFIX_RE.fullmatch(data, match.start(), end):
+                        # Length has not fully arrived yet
+                        pos = match.start()
+                        break
+                    raise FinTSParserError("Invalid binary length at position {}".format(match.start()))
+                pos = binlen.end() + int(binlen.group('BINLEN'), 10)
+                if self.unwrap and data.startswith(b"HNVSD:"):
+                    self._nested = FinTS3StreamParser(self.parser, unwrap=True, keep_envelope=self.keep_envelope)
+                    self._nested_remaining = int(binlen.group('BINLEN'), 10)
+                    if self.keep_envelope:
+                        # Parse the envelope with empty data, the nested segments are filled in later
+                        empty = bytes(data[:binlen.start()]) + b"@0@'"
+                        self._envelope = (self.parser.parse_segment(FinTS3Parser.explode_segments(empty)[0]), [])
+                    del data[:binlen.end()]
+                    self._scan_pos = 0
+                    return -1
+            else:
+                return match.end()
+
+        self._scan_pos = pos
+        return None
+
+
+class Verbatim:
+    """Already escaped data that the serializer emits as it is"""
+
+    __slots__ = ('data', )
+
+    def __init__(self, data):
+        self.data = data
+
+
 class FinTS3Serializer:
     """Serializer for FinTS/HBCI 3.0 messages
+
+    :param engine: Implementation used to serialize the segments. ``'direct'`` (the default) writes
+        each segment straight into the output buffer in a single pass. ``'generic'`` first turns each
+        segment into nested lists of data elements (see :meth:`serialize_segment`) and joins them in
+        :meth:`implode_segments`, ``'codegen'`` does the same with a serialize function generated for
+        each class (see :func:`get_generated_segment_serializer`). All produce identical output.
+    :param cache: Only for the ``'direct'`` engine: Keep the rendering of each segment on the segment
+        object, and reuse it until the object is modified. Modifications are tracked when
+        they go through the fields (and their lists) of the object and of the objects it contains. Segments
+        with nested messages or passwords, and segments with unparsed additional data, are never cached.
     """
 
-    def serialize_message(self, message: SegmentSequence) -> bytes:
-        """Serialize a message (as SegmentSequence, list of FinTS3Segment, or FinTS3Segment) into a byte array"""
+    def __init__(self, engine='direct', cache=True):
+        if engine not in SERIALIZER_ENGINES:
+            raise ValueError("Unknown serializer engine {!r}, must be one of {!r}".format(engine, SERIALIZER_ENGINES))
+        self.engine = engine
+        self.cache = cache
+
+    def serialize_message(self, message: SegmentSequence, sink=None) -> bytes:
+        """Serialize a message (as SegmentSequence, list of FinTS3Segment, or FinTS3Segment) into a byte array
+
+        If sink (any object with a write() method, e.g. a file) is given, the message is written
+        to it segment by segment instead, and None is returned."""
         if isinstance(message, FinTS3Segment):
             message = SegmentSequence([message])
         if isinstance(message, (list, tuple, Iterable)):
             message = SegmentSequence(list(message))
 
-        result = []
+        if self.engine != 'direct':
+            if sink is None:
+                return self.implode_segments([self.serialize_segment(segment) for segment in message.segments])
+            for segment in message.segments:
+                sink.write(self.implode_segments([self.serialize_segment(segment)]))
+            return None
 
+        out = bytearray()
         for segment in message.segments:
-            result.append(self.serialize_segment(segment))
+            self.write_segment(out, segment)
+            out += b"'"
+            if sink is not None:
+                # A new buffer for every segment, the sink may keep what it is given
+                sink.write(out)
+                out = bytearray()
+
+        if sink is None:
+            return bytes(out)
+
+    def write_segment(self, out: bytearray, segment):
+        """Append the serialization of a segment, without the terminating "'", to out"""
+        if self.cache and is_render_cacheable(segment.__class__) and not segment._additional_data:
+            data = segment._render_cache
+            if data is None:
+                buf = bytearray()
+                self._write_segment_fields(buf, segment)
+                data = bytes(buf)
+                segment._set_render_cache(data)
+            out += data
+            return
+
+        self._write_segment_fields(out, segment)
 
-        return self.implode_segments(result)
+    @staticmethod
+    def _unset_value(field, repeat):
+        # The default value of a field that has never been set, without storing it in the container
+        return ValueList(parent=field) if repeat else field._default_value()
+
+    @classmethod
+    def _unset_is_empty(cls, field, repeat):
+        retval = field.__dict__.get('_unset_is_empty')
+        if retval is None:
+            val = cls._unset_value(field, repeat)
+            if isinstance(val, Container):
+                retval = val.is_unset()
+            elif isinstance(val, ValueList):
+                retval = len(val) == 0
+            else:
+                retval = val is None
+            field._unset_is_empty = retval
+        return retval
+
+    def _write_segment_fields(self, out, segment):
+        if isinstance(segment, SkimmedSegment):
+            # Only the header is serialized, the rest is passed through as it was received
+            self._write_deg(out, segment.header, True, 0)
+            if segment._raw_data:
+                out += b"+"
+                out += segment._raw_data
+            return
+
+        filler = 0
+        first = True
+        values = segment._values
+
+        for name, field, repeat, constructed, is_last, count, max_count, required, deg_type, nested, parse, check, default, index in get_parse_plan(segment.__class__):
+            val = values[index]
+            if val is None:
+                if not required and self._unset_is_empty(field, repeat):
+                    filler += 1
+                    continue
+                val = self._unset_value(field, repeat)
+            elif not required:
+                if isinstance(val, Container):
+                    empty = val.is_unset()
+                elif isinstance(val, ValueList):
+                    empty = len(val) == 0
+                else:
+                    empty = val is None
+
+                if empty:
+                    filler += 1
+                    continue
+
+            if filler:
+                # Empty fields in between are written as empty data elements
+                out += b"+" * filler
+                filler = 0
+
+            if not constructed:
+                if repeat:
+                    for item in val:
+                        if not first:
+                            out += b"+"
+                        first = False
+                        self._write_value(out, field.render(item))
+                else:
+                    if not first:
+                        out += b"+"
+                    first = False
+                    self._write_value(out, field.render(val))
+            else:
+                if repeat:
+                    for item in val:
+                        if not first:
+                            out += b"+"
+                        first = False
+                        self._write_deg(out, item, False, 0)
+                else:
+                    if not first:
+                        out += b"+"
+                    first = False
+                    self._write_deg(out, val, True, 0)
+
+        for deg in segment._additional_data:
+            if not first:
+                out += b"+"
+            first = False
+            if isinstance(deg, (list, tuple)):
+                pending = 0
+                for de in deg:
+                    pending = self._write_data_element(out, de, pending)
+            else:
+                self._write_value(out, deg)
+
+    def _write_deg(self, out, deg, allow_skip, pending):
+        # pending is the number of ":" that go before the next non-empty data element. Writing them
+        # only when that element arrives drops empty data elements at the end of the group.
+        filler = 0
+        values = deg._values
+
+        for name, field, repeat, constructed, is_last, count, max_count, required, deg_type, nested, parse, check, default, index in get_parse_plan(deg.__class__):
+            val = values[index]
+            if val is None:
+                if not repeat and not required and self._unset_is_empty(field, repeat):
+                    if allow_skip:
+                        filler += 1
+                    else:
+                        pending += 1
+                    continue
+                val = self._unset_value(field, repeat)
+            elif not repeat and not required:
+                if isinstance(val, Container):
+                    empty = val.is_unset()
+                elif isinstance(val, ValueList):
+                    empty = len(val) == 0
+                else:
+                    empty = val is None
+
+                if empty:
+                    if allow_skip:
+                        filler += 1
+                    else:
+                        pending += 1
+                    continue
+
+            pending += filler
+            filler = 0
+
+            if not constructed:
+                if repeat:
+                    for item in val:
+                        pending = self._write_data_element(out, field.render(item), pending)
+                else:
+                    pending = self._write_data_element(out, field.render(val), pending)
+            else:
+                if repeat:
+                    for item in val:
+                        pending = self._write_deg(out, item, False, pending)
+                else:
+                    pending = self._write_deg(out, val, False, pending)
+
+        return pending
+
+    def _write_data_element(self, out, val, pending):
+        if val is None or val == b'':
+            return pending + 1
+        if pending:
+            out += b":" * pending
+        self._write_value(out, val)
+        return 1
+
+    @staticmethod
+    def _write_value(out, val):
+        if isinstance(val, str):
+            val = val.encode('iso-8859-1')
+            if len(val.translate(None, ESCAPE_CHARACTERS)) != len(val):
+                val = ESCAPE_RE.sub(rb"?\1", val)
+            out += val
+        elif isinstance(val, bytes):
+            out += b"@%d@" % len(val)
+            out += val
+        elif isinstance(val, memoryview):
+            out += b"@%d@" % val.nbytes
+            out += val
+        elif val is not None:
+            raise TypeError("Can only escape str, bytes and None")
 
     def serialize_segment(self, segment):
+        if isinstance(segment, SkimmedSegment):
+            # Only the header is serialized, the rest is passed through as it was received
+            seg = [self.serialize_deg(segment.header, allow_skip=True)]
+            if segment._raw_data:
+                seg.append(Verbatim(segment._raw_data))
+            return seg
+
+        if self.engine == 'codegen':
+            return get_generated_segment_serializer(segment.__class__)(self, segment)
 
         seg = []
         filler = []
@@ -434,7 +1461,9 @@ class FinTS3Serializer:
         for segment in message:
             level2 = []
             for deg in segment:
-                if isinstance(deg, (list, tuple)):
+                if isinstance(deg, Verbatim):
+                    level2.append(deg.data)
+                elif isinstance(deg, (list, tuple)):
                     highest_index = max(((i+1) for (i, e) in enumerate(deg) if e != b'' and e is not None), default=0)
                     level2.append(
                         b":".join(FinTS3Serializer.escape_value(de) for de in deg[:highest_index])
@@ -448,9 +1477,14 @@ class FinTS3Serializer:
     @staticmethod
     def escape_value(val):
         if isinstance(val, str):
-            return re.sub(r"([+:'@?])", r"?\1", val).encode('iso-8859-1')
+            val = val.encode('iso-8859-1')
+            if len(val.translate(None, ESCAPE_CHARACTERS)) != len(val):
+                val = ESCAPE_RE.sub(rb"?\1", val)
+            return val
         elif isinstance(val, bytes):
             return "@{}@".format(len(val)).encode('us-ascii') + val
+        elif isinstance(val, memoryview):
+            return "@{}@".format(val.nbytes).encode('us-ascii') + val.tobytes()
         elif val is None:
             return b''
         else:
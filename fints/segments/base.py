@@ -17,9 +17,20 @@ class FinTS3SegmentMeta(ContainerMeta):
             if isinstance(field, DataElementGroupField):
                 FinTS3SegmentMeta._check_fields_recursive(field.type)
 
+    #: All segment classes by (TYPE, VERSION). If a class is defined more than once, the last definition wins.
+    registry = {}
+
     def __new__(cls, name, bases, classdict):
         retval = super().__new__(cls, name, bases, classdict)
         FinTS3SegmentMeta._check_fields_recursive(retval)
+
+        match = TYPE_VERSION_RE.match(name)
+        if match:
+            retval._TYPE_VERSION = (match.group(1), int(match.group(2)))
+            FinTS3SegmentMeta.registry[retval._TYPE_VERSION] = retval
+        else:
+            retval._TYPE_VERSION = (None, None)
+
         return retval
 
 
@@ -28,15 +39,11 @@ class FinTS3Segment(Container, SubclassesMixin, metaclass=FinTS3SegmentMeta):
 
     @classproperty
     def TYPE(cls):
-        match = TYPE_VERSION_RE.match(cls.__name__)
-        if match:
-            return match.group(1)
+        return cls._TYPE_VERSION[0]
 
     @classproperty
     def VERSION(cls):
-        match = TYPE_VERSION_RE.match(cls.__name__)
-        if match:
-            return int(match.group(2))
+        return cls._TYPE_VERSION[1]
 
     def __init__(self, *args, **kwargs):
         if 'header' not in kwargs:
@@ -49,11 +56,19 @@ class FinTS3Segment(Container, SubclassesMixin, metaclass=FinTS3SegmentMeta):
     @classmethod
     def find_subclass(cls, segment):
         h = SegmentHeader.naive_parse(segment[0])
-        target_cls = None
+        return cls.lookup_subclass(h.type, h.version)
+
+    @classmethod
+    def lookup_subclass(cls, type_, version):
+        """Return the subclass of this class for segment type and version, or this class if there is none."""
+        target_cls = FinTS3SegmentMeta.registry.get((type_, version))
 
-        for possible_cls in cls._all_subclasses():
-            if getattr(possible_cls, 'TYPE', None) == h.type and getattr(possible_cls, 'VERSION', None) == h.version:
-                target_cls = possible_cls
+        if target_cls is not None and not issubclass(target_cls, cls):
+            # Registered class is from a different branch of the hierarchy, look for one below cls
+            target_cls = None
+            for possible_cls in cls._all_subclasses():
+                if possible_cls._TYPE_VERSION == (type_, version):
+                    target_cls = possible_cls
 
         if not target_cls:
             target_cls = cls
@@ -70,3 +85,40 @@ class ParameterSegment(FinTS3Segment):
     max_number_tasks = DataElementField(type='num', max_length=3, _d="Maximale Anzahl Aufträge")
     min_number_signatures = DataElementField(type='num', length=1, _d="Anzahl Signaturen mindestens")
     security_class = IntCodeField(SecurityClass, length=1, _d="Sicherheitsklasse")
+
+
+class SkimmedSegment(FinTS3Segment):
+    """A segment of which only the header has been parsed, see ``FinTS3Parser(skim=...)``.
+
+    The rest of the segment is kept as raw (escaped) bytes, exactly as received, and
+    re-emitted verbatim by the serializer."""
+
+    __slots__ = ('_raw_data', )
+
+    # _raw is not a field, changes to it would not be tracked
+    _render_cacheable = False
+
+    def __init__(self, *args, _raw=b'', **kwargs):
+        super().__init__(*args, **kwargs)
+        self._raw_data = _raw
+
+    @property
+    def _raw(self):
+        if self._raw_data.__class__ is memoryview:
+            # Zero-copy parse result, only convert to bytes when actually used
+            self._raw_data = self._raw_data.tobytes()
+        return self._raw_data
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_raw_data'] = self._raw
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._raw_data = state['_raw_data']
+
+    @property
+    def _repr_items(self):
+        yield from super()._repr_items
+        yield ("_raw", self._raw)
@@ -1,12 +1,60 @@
+import heapq
+import weakref
 from collections import OrderedDict
-from collections.abc import Iterable
+from collections.abc import Iterable, MutableSequence
 from contextlib import suppress
 
 from .exceptions import FinTSNoResponseError
 from .utils import SubclassesMixin
 
 
+def _materialize_views(values):
+    return [v.tobytes() if v.__class__ is memoryview else v for v in values]
+
+
+def _invalidate_render_parents(parents):
+    # parents is a weak reference, or a tuple of them if there is more than one
+    for ref in (parents if parents.__class__ is tuple else (parents, )):
+        parent = ref()
+        if parent is not None:
+            parent._invalidate_render_cache()
+
+
+def _add_render_parent(obj, ref):
+    parents = obj._render_parents
+    if parents is None:
+        obj._render_parents = ref
+    elif parents.__class__ is tuple:
+        if ref not in parents:
+            obj._render_parents = parents + (ref, )
+    elif parents is not ref:
+        obj._render_parents = (parents, ref)
+
+
+def _add_render_parent_below(container, ref):
+    # Register ref with all containers and lists that container contains, at any depth
+    stack = [container]
+    while stack:
+        for child in stack.pop()._values:
+            if child.__class__ is ValueList:
+                _add_render_parent(child, ref)
+                for item in child._data:
+                    if isinstance(item, Container):
+                        _add_render_parent(item, ref)
+                        stack.append(item)
+            elif isinstance(child, Container):
+                _add_render_parent(child, ref)
+                stack.append(child)
+
+
 class Field:
+    #: Whether values of this field are SegmentSequence objects (that find_segments() descends into)
+    _SEGMENT_SEQUENCE = False
+    #: Whether the rendering of values of this field may be cached, see Container._render_cache
+    _RENDER_CACHEABLE = True
+    #: Position of the value of this field in Container._values, assigned by ContainerMeta
+    _index = None
+
     def __init__(self, length=None, min_length=None, max_length=None, count=None, min_count=None, max_count=None, required=True, _d=None):
         if length is not None and (min_length is not None or max_length is not None):
             raise ValueError("May not specify both 'length' AND 'min_length'/'max_length'")
@@ -30,27 +78,36 @@ class Field:
         return None
 
     def __get__(self, instance, owner):
-        if self not in instance._values:
-            self.__set__(instance, None)
-
-        return instance._values[self]
+        value = instance._values[self._index]
+        if value is None:
+            # Unset fields are stored as None. Only mutable defaults (containers and lists) are stored
+            # on first access, so that modifications of the returned object are not lost.
+            value = self._default_value() if self.count == 1 else ValueList(parent=self)
+            if value is not None:
+                instance._values[self._index] = value
+                if instance._render_cache is not None or instance._render_parents is not None:
+                    # The new value is not known to the render cache, so it cannot report its modifications
+                    instance._invalidate_render_cache()
+        elif value.__class__ is memoryview:
+            # Zero-copy parse result, only convert to bytes when actually used
+            value = instance._values[self._index] = value.tobytes()
+        return value
 
     def __set__(self, instance, value):
         if value is None:
-            if self.count == 1:
-                instance._values[self] = self._default_value()
-            else:
-                instance._values[self] = ValueList(parent=self)
+            instance._values[self._index] = None
         else:
             if self.count == 1:
                 value_ = self._parse_value(value)
                 self._check_value(value_)
             else:
                 value_ = ValueList(parent=self)
-                for i, v in enumerate(value):
-                    value_[i] = v
+                value_.extend(value)
+
+            instance._values[self._index] = value_
 
-            instance._values[self] = value_
+        if instance._render_cache is not None or instance._render_parents is not None:
+            instance._invalidate_render_cache()
 
     def __delete__(self, instance):
         self.__set__(instance, None)
@@ -58,6 +115,13 @@ class Field:
     def _parse_value(self, value):
         raise NotImplementedError('Needs to be implemented in subclass')
 
+    def _parse_value_trusted(self, value):
+        """Faster _parse_value() for values from trusted input, see FinTS3Parser(trusted=True).
+
+        Only used if it is defined in the same class as the _parse_value() that applies to
+        the field, so that subclasses that change _parse_value() are not bypassed."""
+        return self._parse_value(value)
+
     def _render_value(self, value):
         raise NotImplementedError('Needs to be implemented in subclass')
 
@@ -90,19 +154,34 @@ class Field:
 
 
 class TypedField(Field, SubclassesMixin):
+    # Classes chosen by __new__(), by (class, type). Reset when a new subclass is defined.
+    _target_classes = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        TypedField._target_classes.clear()
+
     def __new__(cls, *args, **kwargs):
+        key = (cls, kwargs.get('type', None))
+        target_cls = TypedField._target_classes.get(key)
+        if target_cls is None:
+            target_cls = TypedField._target_classes[key] = cls._find_target_class(key[1])
+        retval = object.__new__(target_cls)
+        return retval
+
+    @classmethod
+    def _find_target_class(cls, type_):
         target_cls = None
         fallback_cls = None
         for subcls in cls._all_subclasses():
             if getattr(subcls, 'type', '') is None:
                 fallback_cls = subcls
-            if getattr(subcls, 'type', None) == kwargs.get('type', None):
+            if getattr(subcls, 'type', None) == type_:
                 target_cls = subcls
                 break
         if target_cls is None and fallback_cls is not None and issubclass(fallback_cls, cls):
             target_cls = fallback_cls
-        retval = object.__new__(target_cls or cls)
-        return retval
+        return target_cls or cls
 
     def __init__(self, type=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -111,18 +190,32 @@ class TypedField(Field, SubclassesMixin):
 
 
 class ValueList:
-    def __init__(self, parent):
+    __slots__ = ('_parent', '_data', '_length', '_render_parents', '__weakref__')
+
+    def __init__(self, parent, data=None):
+        """List of the values of a repeated field.
+
+        :param parent: The repeated field
+        :param data: Initial values, already parsed and checked (used by the parser)
+        """
         self._parent = parent
-        self._data = []
+        self._data = [] if data is None else data
+        # Cached result of _get_minimal_true_length(), reset on modifications (see _invalidate_render_cache())
+        self._length = None
+        #: Segments that have cached a rendering that includes this list, see Container._render_cache
+        self._render_parents = None
 
     def __getitem__(self, i):
         if i >= len(self._data):
             self.__setitem__(i, None)
         if i < 0:
             raise IndexError("Cannot access negative index")
-        return self._data[i]
+        value = self._data[i]
+        if value.__class__ is memoryview:
+            value = self._data[i] = value.tobytes()
+        return value
 
-    def __setitem__(self, i, value):
+    def _check_index(self, i):
         if i < 0:
             raise IndexError("Cannot access negative index")
 
@@ -133,32 +226,81 @@ class ValueList:
             if i >= self._parent.max_count:
                 raise IndexError("Cannot access index {} beyound max_count {}".format(i, self._parent.max_count))
 
-        for x in range(len(self._data), i):
-            self.__setitem__(x, None)
-
+    def _convert(self, value):
         if value is None:
-            value = self._parent._default_value()
-        else:
-            value = self._parent._parse_value(value)
-            self._parent._check_value(value)
+            return self._parent._default_value()
+        value = self._parent._parse_value(value)
+        self._parent._check_value(value)
+        return value
+
+    def __setitem__(self, i, value):
+        self._check_index(i)
+
+        data = self._data
+        if i > len(data):
+            default = self._parent._default_value
+            data.extend(default() for _ in range(len(data), i))
 
-        if i == len(self._data):
-            self._data.append(value)
+        value = self._convert(value)
+        if i == len(data):
+            data.append(value)
         else:
-            self._data[i] = value
+            data[i] = value
+
+        self._invalidate_render_cache()
 
     def __delitem__(self, i):
         self.__setitem__(i, None)
 
+    def extend(self, values):
+        """Append values after the stored items, parsing and checking them like item assignment does"""
+        data = self._data
+        new = []
+        for value in values:
+            self._check_index(len(data) + len(new))
+            new.append(self._convert(value))
+        data.extend(new)
+        self._invalidate_render_cache()
+
+    def _invalidate_render_cache(self):
+        # Called on modifications of the list, and of the items that are registered in _get_minimal_true_length()
+        self._length = None
+        if self._render_parents is not None:
+            parents = self._render_parents
+            self._render_parents = None
+            _invalidate_render_parents(parents)
+
+    def __getstate__(self):
+        return {'_parent': self._parent, '_data': _materialize_views(self._data)}
+
+    def __setstate__(self, state):
+        self._parent = state['_parent']
+        self._data = state['_data']
+        self._length = None
+        self._render_parents = None
+
     def _get_minimal_true_length(self):
-        retval = 0
-        for i, val in enumerate(self._data):
-            if isinstance(val, Container):
-                if val.is_unset():
-                    continue
-            elif val is None:
-                continue
-            retval = i + 1
+        retval = self._length
+        if retval is None:
+            # Count from the end, only trailing empty items are not part of the list
+            data = self._data
+            retval = len(data)
+            while retval:
+                val = data[retval - 1]
+                if val is None or (isinstance(val, Container) and val.is_unset()):
+                    retval -= 1
+                else:
+                    break
+
+            # Modifications of the last item or of the trailing empty items can change the length. Items
+            # before them are not relevant, the length changes only when the list itself is modified.
+            ref = weakref.ref(self)
+            for val in data[max(retval - 1, 0):]:
+                if isinstance(val, Container):
+                    _add_render_parent(val, ref)
+                    _add_render_parent_below(val, ref)
+
+            self._length = retval
         return retval
 
     def __len__(self):
@@ -172,8 +314,15 @@ class ValueList:
             return retval
 
     def __iter__(self):
-        for i in range(len(self)):
-            yield self[i]
+        length = len(self)
+        if length > len(self._data):
+            self.__setitem__(length - 1, None)
+        data = self._data
+        for i in range(length):
+            value = data[i]
+            if value.__class__ is memoryview:
+                value = data[i] = value.tobytes()
+            yield value
 
     def __repr__(self):
         return "{!r}".format(list(self))
@@ -207,16 +356,254 @@ class ValueList:
         stream.write((prefix + level * indent) + "]{}\n".format(trailer))
 
 
+class LazySegmentList(MutableSequence):
+    """List of segments of a parsed message that are only constructed when accessed.
+
+    Created by :class:`~fints.parser.FinTS3Parser` in lazy mode. Holds the message buffer
+    and an index of segment boundaries and headers (see :meth:`~fints.parser.FinTS3Parser.index_segments`),
+    segment objects are parsed on first access and then kept. Segments that are added or
+    replaced are stored as they are."""
+
+    #: Segment sequences that have indexed this list, see SegmentSequence._get_segment_index()
+    _render_parents = None
+
+    def __init__(self, parser, data, index):
+        self._parser = parser
+        self._data = data
+        self._index = list(index)
+        self._segments = [None] * len(self._index)
+
+    def _parse(self, i):
+        start, end, header = self._index[i]
+        segment = self._parser.parse_segment_at(self._data, start, end, header)
+        self._segments[i] = segment
+        self._index[i] = None
+        return segment
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        segment = self._segments[i]
+        if segment is None:
+            segment = self._parse(i if i >= 0 else len(self) + i)
+        return segment
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            value = list(value)
+            self._segments[i] = value
+            self._index[i] = [None] * len(value)
+        else:
+            self._segments[i] = value
+            self._index[i] = None
+        self._invalidate_render_cache()
+
+    def __delitem__(self, i):
+        del self._segments[i]
+        del self._index[i]
+        self._invalidate_render_cache()
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __iter__(self):
+        for i in range(len(self._segments)):
+            yield self[i]
+
+    def insert(self, i, value):
+        self._segments.insert(i, value)
+        self._index.insert(i, None)
+        self._invalidate_render_cache()
+
+    def _invalidate_render_cache(self):
+        if self._render_parents is not None:
+            parents = self._render_parents
+            self._render_parents = None
+            _invalidate_render_parents(parents)
+
+    def is_parsed(self, i):
+        return self._segments[i] is not None
+
+    def peek_header(self, i):
+        """Return the (type, version) tuple of segment i, without parsing it if possible."""
+        entry = self._index[i]
+        if entry is None or entry[2] is None:
+            header = self[i].header
+            return header.type, header.version
+        return entry[2][0], entry[2][2]
+
+    def _iter_candidates(self, query, version, recurse):
+        """Yield all segments that could match query and version, or that may contain nested segments.
+
+        Segments that can be ruled out by their header alone are not parsed."""
+        from .segments.base import FinTS3Segment
+
+        for i in range(len(self._segments)):
+            entry = self._index[i]
+            if entry is not None and entry[2] is not None:
+                type_, number, version_, reference = entry[2]
+                clazz = FinTS3Segment.lookup_subclass(type_, version_)
+                if not (recurse and clazz._segment_sequence_fields):
+                    if query and not any((issubclass(clazz, t) if isinstance(t, type) else type_ == t) for t in query):
+                        continue
+                    if version and not any(version_ == v for v in version):
+                        continue
+            yield self[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        # The message buffer may be a memoryview, which cannot be pickled
+        return (list, (list(self),))
+
+
+class SegmentList(list):
+    """List of the segments of a :class:`SegmentSequence`, that invalidates the segment index of
+    the sequence when it is modified."""
+
+    #: Segment sequences that have indexed this list, see SegmentSequence._get_segment_index()
+    _render_parents = None
+
+    def _invalidate_render_cache(self):
+        if self._render_parents is not None:
+            parents = self._render_parents
+            self._render_parents = None
+            _invalidate_render_parents(parents)
+
+    def __reduce__(self):
+        return self.__class__, (list(self), )
+
+
+def _segment_list_modifier(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        retval = method(self, *args)
+        if self._render_parents is not None:
+            self._invalidate_render_cache()
+        return retval
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(SegmentList, _name, _segment_list_modifier(_name))
+del _name
+
+
 class SegmentSequence:
     """A sequence of FinTS3Segment objects"""
 
-    def __init__(self, segments=None):
-        if isinstance(segments, bytes):
+    # The segment index is built on the first call of find_segments() and kept until the segment list,
+    # one of the segments (or its header) or a nested segment sequence is modified. These notify us
+    # through the same mechanism that invalidates Container._render_cache, see _get_segment_index().
+    _segment_index = None
+    _render_parents = None
+
+    def __init__(self, segments=None, lazy=False, trusted=False):
+        if isinstance(segments, (bytes, bytearray, memoryview)):
             from .parser import FinTS3Parser
-            parser = FinTS3Parser()
-            data = list(parser.explode_segments(segments))
-            segments = [parser.parse_segment(segment) for segment in data]
-        self.segments = list(segments) if segments else []
+            self.segments = FinTS3Parser(lazy=lazy, trusted=trusted).parse_message(segments).segments
+        elif isinstance(segments, (LazySegmentList, SegmentList)):
+            self.segments = segments
+        else:
+            self.segments = SegmentList(segments) if segments else SegmentList()
+
+    @property
+    def segments(self):
+        return self._segments
+
+    @segments.setter
+    def segments(self, segments):
+        if not isinstance(segments, (LazySegmentList, SegmentList)):
+            segments = SegmentList(segments)
+        self._segments = segments
+        self._invalidate_render_cache()
+
+    def _invalidate_render_cache(self):
+        # Called on modifications of anything that is part of the segment index
+        self._segment_index = None
+        if self._render_parents is not None:
+            parents = self._render_parents
+            self._render_parents = None
+            _invalidate_render_parents(parents)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_segment_index', None)
+        state.pop('_render_parents', None)
+        return state
+
+    def _get_segment_index(self):
+        """Return the index of all segments of this sequence, including the segments of nested sequences.
+
+        The index is a tuple (entries, by_type, by_class, by_reference). entries holds a tuple
+        (position, segment, top_level, version, reference) for each segment, in the order in which
+        find_segments() returns them: each segment is followed by the segments nested in it. by_type,
+        by_class and by_reference map header type, segment class and header reference to lists of the
+        entries with that value."""
+        index = self._segment_index
+        if index is not None:
+            return index
+
+        ref = weakref.ref(self)
+        entries = []
+        by_type = {}
+        by_class = {}
+        by_reference = {}
+
+        def add(segments, top_level):
+            _add_render_parent(segments, ref)
+            for segment in segments:
+                header = segment.header
+                _add_render_parent(segment, ref)
+                _add_render_parent(header, ref)
+                entry = (len(entries), segment, top_level, header.version, header.reference)
+                entries.append(entry)
+                by_type.setdefault(header.type, []).append(entry)
+                by_class.setdefault(segment.__class__, []).append(entry)
+                by_reference.setdefault(entry[4], []).append(entry)
+                for name in segment._segment_sequence_fields:
+                    val = getattr(segment, name)
+                    if isinstance(val, SegmentSequence):
+                        _add_render_parent(val, ref)
+                        add(val.segments, False)
+
+        add(self.segments, True)
+        index = self._segment_index = (entries, by_type, by_class, by_reference)
+        return index
+
+    def _find_segments_indexed(self, query, version, reference, recurse):
+        entries, by_type, by_class, by_reference = self._get_segment_index()
+
+        if query:
+            candidates = []
+            for t in query:
+                if isinstance(t, type):
+                    candidates.extend(l for (clazz, l) in by_class.items() if issubclass(clazz, t))
+                else:
+                    candidates.append(by_type.get(t, ()))
+        elif reference:
+            candidates = [by_reference.get(r, ()) for r in reference]
+        else:
+            candidates = [entries]
+
+        if len(candidates) > 1:
+            # Merge in message order, dropping entries that matched more than one query
+            candidates = heapq.merge(*candidates)
+            last = None
+            for entry in candidates:
+                if entry is last:
+                    continue
+                last = entry
+                if (recurse or entry[2]) and ((not version) or entry[3] in version) and ((not reference) or entry[4] in reference):
+                    yield entry[1]
+        else:
+            for entry in (candidates[0] if candidates else ()):
+                if (recurse or entry[2]) and ((not version) or entry[3] in version) and ((not reference) or entry[4] in reference):
+                    yield entry[1]
 
     def render_bytes(self) -> bytes:
         from .parser import FinTS3Serializer
@@ -246,7 +633,7 @@ class SegmentSequence:
                                  first_line_suffix=docstring)
         stream.write((prefix + level * indent) + "]){}\n".format(trailer))
 
-    def find_segments(self, query=None, version=None, callback=None, recurse=True, throw=False):
+    def find_segments(self, query=None, version=None, callback=None, recurse=True, throw=False, reference=None):
         """Yields an iterable of all matching segments.
 
         :param query: Either a str or class specifying a segment type (such as 'HNHBK', or :class:`~fints.segments.message.HNHBK3`), or a list or tuple of strings or classes.
@@ -256,8 +643,14 @@ class SegmentSequence:
         :param callback: A callable that will be given the segment as its sole argument and must return a boolean indicating whether to return this segment.
         :param recurse: If True (the default), recurse into SegmentSequenceField values, otherwise only look at segments in this SegmentSequence.
         :param throw: If True, a FinTSNoResponseError is thrown if no result is found. Defaults to False.
+        :param reference: Either an int specifying the segment number that the segment header refers to (see
+                          :class:`~fints.formals.SegmentHeader`), or a list or tuple of ints.
 
         The match results of all given parameters will be AND-combined.
+
+        Segments are looked up in an index by type, class, version and reference, that is built on the first call
+        and kept until the segments are modified. Lazily parsed messages (see :class:`~fints.parser.FinTS3Parser`)
+        are scanned instead, so that segments are only constructed when they can match.
         """
         found_something = False
 
@@ -265,35 +658,51 @@ class SegmentSequence:
             query = []
         elif isinstance(query, str) or not isinstance(query, (list, tuple, Iterable)):
             query = [query]
+        else:
+            query = list(query)
 
         if version is None:
             version = []
         elif not isinstance(version, (list, tuple, Iterable)):
             version = [version]
+        else:
+            version = list(version)
 
-        if callback is None:
-            callback = lambda s: True
+        if reference is None:
+            reference = []
+        elif not isinstance(reference, (list, tuple, Iterable)):
+            reference = [reference]
+        else:
+            reference = list(reference)
 
-        for s in self.segments:
-            if ((not query) or any((isinstance(s, t) if isinstance(t, type) else s.header.type == t) for t in query)) and \
-                    ((not version) or any(s.header.version == v for v in version)) and \
-                    callback(s):
+        if isinstance(self.segments, LazySegmentList):
+            matches = self._find_segments_scan(query, version, reference, recurse)
+        else:
+            matches = self._find_segments_indexed(query, version, reference, recurse)
+
+        for s in matches:
+            if callback is None or callback(s):
                 yield s
                 found_something = True
 
-            if recurse:
-                for name, field in s._fields.items():
-                    val = getattr(s, name)
-                    if val and hasattr(val, 'find_segments'):
-                        for v in val.find_segments(query=query, version=version, callback=callback, recurse=recurse):
-                            yield v
-                            found_something = True
-
         if throw and not found_something:
             raise FinTSNoResponseError(
                 'The bank\'s response did not contain a response to your request, please inspect debug log.'
             )
 
+    def _find_segments_scan(self, query, version, reference, recurse):
+        for s in self.segments._iter_candidates(query, version, recurse):
+            if ((not query) or any((isinstance(s, t) if isinstance(t, type) else s.header.type == t) for t in query)) and \
+                    ((not version) or any(s.header.version == v for v in version)) and \
+                    ((not reference) or s.header.reference in reference):
+                yield s
+
+            if recurse:
+                for name in s._segment_sequence_fields:
+                    val = getattr(s, name)
+                    if isinstance(val, SegmentSequence):
+                        yield from val.find_segments(query=query, version=version, recurse=recurse, reference=reference)
+
     def find_segment_first(self, *args, **kwargs):
         """Finds the first matching segment.
 
@@ -328,20 +737,35 @@ class ContainerMeta(type):
         return OrderedDict()
 
     def __new__(cls, name, bases, classdict):
+        # Field values live in Container._values, instances don't need a __dict__
+        classdict.setdefault('__slots__', ())
         retval = super().__new__(cls, name, bases, classdict)
         retval._fields = OrderedDict()
         for supercls in reversed(bases):
             if hasattr(supercls, '_fields'):
                 retval._fields.update((k, v) for (k, v) in supercls._fields.items())
         retval._fields.update((k, v) for (k, v) in classdict.items() if isinstance(v, Field))
+        for index, field in enumerate(retval._fields.values()):
+            if field._index is None:
+                field._index = index
+            elif field._index != index:
+                raise TypeError("Field {!r} of {} is already used at a different position in another class".format(field, name))
+        retval._segment_sequence_fields = tuple(k for (k, v) in retval._fields.items() if v._SEGMENT_SEQUENCE)
         return retval
 
 
 class Container(metaclass=ContainerMeta):
+    # _values holds the value of each field at the position of the field in _fields, None for fields that
+    # have never been set. _render_cache is the cached serialization of this container, maintained
+    # by FinTS3Serializer and reset on every modification through the fields of this container or of the
+    # containers and lists it contains. _render_parents are the containers that have cached a rendering
+    # that includes this container.
+    __slots__ = ('_values', '_additional_data', '_render_cache', '_render_parents', '__weakref__')
+
     def __init__(self, *args, **kwargs):
         init_values = OrderedDict()
 
-        additional_data = kwargs.pop("_additional_data", [])
+        additional_data = kwargs.pop("_additional_data", ())
 
         for init_value, field_name in zip(args, self._fields):
             init_values[field_name] = init_value
@@ -354,12 +778,49 @@ class Container(metaclass=ContainerMeta):
                 init_values[field_name] = kwargs.pop(field_name)
 
         super().__init__(*args, **kwargs)
-        self._values = {}
+        self._values = [None] * len(self._fields)
         self._additional_data = additional_data
+        self._render_cache = None
+        self._render_parents = None
 
         for k, v in init_values.items():
             setattr(self, k, v)
 
+    @classmethod
+    def _new_unset(cls):
+        """Create an instance with no field values set, without going through __init__ (used by the parser)."""
+        retval = cls.__new__(cls)
+        retval._values = [None] * len(cls._fields)
+        retval._additional_data = ()
+        retval._render_cache = None
+        retval._render_parents = None
+        return retval
+
+    def __getstate__(self):
+        # Zero-copy parse results reference the message buffer as memoryview, which cannot be pickled
+        return {
+            '_values': _materialize_views(self._values),
+            '_additional_data': _materialize_views(self._additional_data),
+        }
+
+    def __setstate__(self, state):
+        self._values = state['_values']
+        self._additional_data = state['_additional_data']
+        self._render_cache = None
+        self._render_parents = None
+
+    def _set_render_cache(self, data):
+        # Ask all contained containers and lists, at any depth, to invalidate our cache when they are modified
+        _add_render_parent_below(self, weakref.ref(self))
+        self._render_cache = data
+
+    def _invalidate_render_cache(self):
+        self._render_cache = None
+        if self._render_parents is not None:
+            parents = self._render_parents
+            self._render_parents = None
+            _invalidate_render_parents(parents)
+
     @classmethod
     def naive_parse(cls, data):
         if data is None:
@@ -370,8 +831,12 @@ class Container(metaclass=ContainerMeta):
         return retval
 
     def is_unset(self):
-        for name in self._fields.keys():
-            val = getattr(self, name)
+        for field, val in zip(self._fields.values(), self._values):
+            if val is None:
+                # Never set, check the default value without storing it
+                if field.count != 1:
+                    return False
+                val = field._default_value()
             if isinstance(val, Container):
                 if not val.is_unset():
                     return False
@@ -77,6 +77,8 @@ def decompress_datablob(magic: bytes, blob: bytes, obj: object = None):
 
 
 class SubclassesMixin:
+    __slots__ = ()
+
     @classmethod
     def _all_subclasses(cls):
         for subcls in cls.__subclasses__():
@@ -128,6 +130,8 @@ class FixedLengthMixin:
 
 
 class ShortReprMixin:
+    __slots__ = ()
+
     def __repr__(self):
         return "{}{}({})".format(
             "{}.".format(self.__class__.__module__),
@@ -242,21 +246,33 @@ class MT535_Miniparser:
         return retval
 
 
+class _PasswordProtection(threading.local):
+    active = False
+
+
 class Password(str):
-    protected = False
+    # Whether Password.protect() is active, per thread: traces of messages may be rendered on a
+    # background thread while the client uses the PIN on another one
+    _protection = _PasswordProtection()
 
     def __init__(self, value):
         self.value = value
         self.blocked = False
 
+    @classproperty
+    def protected(cls):
+        return Password._protection.active
+
     @classmethod
     @contextmanager
     def protect(cls):
+        """Render all Password objects as '***' in the current thread, while the context is active"""
+        old_active = Password._protection.active
         try:
-            cls.protected = True
+            Password._protection.active = True
             yield None
         finally:
-            cls.protected = False
+            Password._protection.active = old_active
 
     def block(self):
         self.blocked = True
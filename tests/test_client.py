@@ -227,3 +227,413 @@ def test_get_transactions(fints_client):
 
         assert len(transactions) == 3
         assert transactions[0].data['amount'].amount == Decimal('182.34')
+
+
+def test_finish_message_renders_once(mocker):
+    from fints.parser import FinTS3Serializer
+    from fints.segments.dialog import HKEND1
+
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', 'http://127.0.0.1/', product_id="TEST-123")
+    dialog = client._new_dialog()
+    message = dialog.new_customer_message()
+    message += HKEND1('0')
+    dialog.finish_message(message)
+
+    data = message.render_bytes()
+    assert message.segments[0].message_size == len(data)
+    assert data.startswith(b"HNHBK:1:3+%012d+" % len(data))
+    assert FinTS3Serializer().serialize_message(message) == data
+
+    spy = mocker.spy(FinTS3Serializer, 'serialize_message')
+    assert message.render_bytes() is data
+    assert spy.call_count == 0
+
+
+def test_response_dispatcher(fints_client):
+    from fints.segments.bank import HIUPA4
+    from fints.segments.dialog import HIRMS2
+
+    calls = []
+
+    def handle_upa(segments, dialog, internal_send):
+        # Runs after the handlers of the client
+        assert fints_client.upa is segments[0]
+        calls.append(('upa', segments))
+
+    fints_client.response_dispatcher.register(handle_upa, HIUPA4)
+    fints_client.response_dispatcher.register(lambda segments, dialog, internal_send: calls.append(('hirms', segments)), HIRMS2)
+
+    with fints_client:
+        accounts = fints_client.get_sepa_accounts()
+
+    assert accounts
+    assert fints_client.bpd.find_segment_first('HIPINS')
+    assert [s.header.type for s in fints_client.upd.segments] == ['HIUPD', 'HIUPD']
+
+    # Handlers run in the order of registration, and see the segments of nested messages
+    assert calls[0][0] == 'upa' and calls[1][0] == 'hirms'
+    assert all(isinstance(s, HIRMS2) for (kind, segments) in calls if kind == 'hirms' for s in segments)
+
+
+def test_wire_trace(fints_client, caplog, mocker):
+    import io
+    import logging
+    from fints.connection import BackgroundTraceLogger, WireTraceBuffer
+    from fints.types import SegmentSequence
+
+    # Nothing is rendered while debug logging is off
+    spy = mocker.spy(SegmentSequence, 'print_nested')
+    caplog.set_level(logging.INFO, logger='fints.connection')
+    with fints_client:
+        fints_client.get_sepa_accounts()
+    assert spy.call_count == 0
+
+    fints_client.connection.trace_buffer = WireTraceBuffer(3)
+    fints_client.connection.trace_logger = trace_logger = BackgroundTraceLogger()
+    caplog.set_level(logging.DEBUG, logger='fints.connection')
+    with fints_client:
+        fints_client.get_sepa_accounts()
+    trace_logger.close()
+
+    messages = [r.getMessage() for r in caplog.records if r.name == 'fints.connection']
+    assert messages[0].startswith('Sending') and messages[1].startswith('Received')
+    assert 'HKSPA' in ''.join(messages) and "'1234'" not in ''.join(messages)
+    assert "'***'" in messages[0]
+    assert all(r.threadName == 'fints-wire-trace' for r in caplog.records if r.name == 'fints.connection')
+
+    # The buffer keeps the last messages, and masks the PIN when dumped
+    traces = list(fints_client.connection.trace_buffer)
+    assert len(traces) == 3 and traces[-1].direction == 'Received'
+    out = io.StringIO()
+    fints_client.connection.trace_buffer.dump(out)
+    assert 'HIRMG' in out.getvalue() and "'1234'" not in out.getvalue()
+
+
+def test_shared_connections(fints_server, mocker):
+    import http.server
+    import threading
+    import time
+    from fints.connection import ConnectionManager, FinTSHTTPSConnection
+
+    clients = [
+        FinTS3PinTanClient('12345678', 'test1', '1234', fints_server, product_id="TEST-123")
+        for _ in range(2)
+    ]
+    assert clients[0].connection.session is not clients[1].connection.session
+    assert clients[0].connection.session.get_adapter(fints_server) is clients[1].connection.session.get_adapter(fints_server)
+    with clients[1]:
+        assert clients[1].get_sepa_accounts()
+
+    # Closing one session does not close the shared connections
+    adapter = clients[0].connection.session.get_adapter(fints_server)
+    clients[0].connection.session.close()
+    assert adapter.poolmanager.pools
+
+    # Connections are opened in advance, and dropped after being idle for too long
+    opened = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            opened.append(self.client_address)
+
+        def do_HEAD(self):
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    manager = ConnectionManager(keep_alive=0.2)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        connection = FinTSHTTPSConnection(url, connection_manager=manager)
+        connection.warm_up(background=False)
+        connection.warm_up(background=False)
+        assert len(opened) == 1
+
+        adapter = manager.adapter_for(url.upper())
+        clear = mocker.spy(adapter.poolmanager, 'clear')
+        time.sleep(0.25)
+        connection.warm_up(background=False)
+        assert len(opened) == 2 and clear.call_count == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+        manager.close()
+
+    # Requests wait when max_concurrency requests are in progress, until their response has been read
+    handled = []
+
+    class SlowHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            start = time.monotonic()
+            self.rfile.read(int(self.headers['Content-Length']))
+            body = b'SElSTUc6MjoyKzAwMTA6Ok9LJw=='
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:8])
+            self.wfile.flush()
+            time.sleep(0.2)
+            self.wfile.write(body[8:])
+            handled.append((start, time.monotonic()))
+
+        def log_message(self, *args):
+            pass
+
+    manager = ConnectionManager(max_concurrency=1)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        responses = []
+        threads = [
+            threading.Thread(target=lambda: responses.append(
+                FinTSHTTPSConnection(url, connection_manager=manager).send_bytes(b'HNHB')
+            ))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert responses == [b"HIRMG:2:2+0010::OK'"] * 2
+        (first_start, first_end), (second_start, second_end) = sorted(handled)
+        assert second_start >= first_end
+        assert manager.adapter_for(url)._active == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        manager.close()
+
+
+def test_response_streaming(fints_client):
+    import base64
+    import binascii
+    from conftest import TEST_MESSAGES
+    from fints.connection import Base64StreamDecoder, ResponseDecoder
+    from fints.message import FinTSInstituteMessage, MessageDirection
+    from fints.parser import FinTS3Parser
+
+    data = TEST_MESSAGES['basic_complicated']
+    encoded = base64.encodebytes(data)  # With line breaks
+    decoder = Base64StreamDecoder()
+    assert b''.join(decoder.decode(encoded[i:i+7]) for i in range(0, len(encoded), 7)) == data
+    decoder.close()
+    decoder.decode(b'SGV')
+    with pytest.raises(binascii.Error):
+        decoder.close()
+
+    decoder = ResponseDecoder()
+    for i in range(0, len(encoded), 5):
+        decoder.feed(encoded[i:i+5])
+    message = decoder.close()
+    assert isinstance(message, FinTSInstituteMessage) and message.render_bytes() == data
+    assert repr(message.segments) == repr(FinTS3Parser().parse_message(data).segments)
+    assert decoder.encoded_size == len(encoded) and decoder.size == len(data) and decoder.data is None
+
+    with fints_client:
+        fints_client.get_sepa_accounts()
+        dialog = fints_client._standing_dialog
+    connection = fints_client.connection
+    assert connection.bytes_sent > 0 and connection.bytes_received > 0
+    responses = dialog.messages[MessageDirection.FROM_INSTITUTE]
+    assert connection.last_response_size == len(responses[max(responses)].render_bytes())
+
+
+def test_transports(mock_bank, fints_server, tmp_path):
+    import json
+    from fints.connection import FinTSHTTPSConnection, InProcessConnection, RecordingConnection, ReplayConnection
+    from fints.exceptions import FinTSConnectionError
+
+    def fetch(client):
+        with client:
+            accounts = client.get_sepa_accounts()
+            return accounts, client.get_transactions(accounts[0])
+
+    # The mock bank, without a server
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', InProcessConnection(mock_bank.process_message), product_id="TEST-123")
+    accounts, transactions = fetch(client)
+    assert accounts[0].iban == 'DE111234567800000001' and len(transactions) == 3
+    assert client.connection.bytes_sent > 0 and client.connection.last_response_size > 0
+
+    # Recorded over HTTPS, and replayed by a new client, in the same state as the recording one
+    path = tmp_path / 'exchanges.jsonl'
+    connection = RecordingConnection(FinTSHTTPSConnection(fints_server), path)
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', connection, product_id="TEST-123")
+    recorded = fetch(client)
+    client.close()
+    assert connection.file.closed
+
+    exchanges = [json.loads(line) for line in path.read_text().splitlines()]
+    assert exchanges[0]['request'].startswith('HNHBK') and exchanges[0]['response'].startswith('HNHBK')
+    assert all("+***'" in e['request'] and "+1234'" not in e['request'] for e in exchanges)
+
+    connection = ReplayConnection(path)
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', connection, product_id="TEST-123")
+    replayed = fetch(client)
+    assert replayed[0] == recorded[0]
+    assert [t.data for t in replayed[1]] == [t.data for t in recorded[1]]
+    assert connection.position == len(exchanges)
+    with pytest.raises(FinTSConnectionError):
+        connection.send_bytes(b'')
+    connection.rewind()
+    assert fetch(FinTS3PinTanClient('12345678', 'test1', '1234', connection, product_id="TEST-123"))[0] == recorded[0]
+
+
+def test_timeouts_and_retries(fints_client, metrics_registry):
+    import http.server
+    import socket
+    import threading
+    import time
+    from types import SimpleNamespace
+    import requests
+    from fints import metrics
+    from fints.connection import ConnectionManager, FinTSHTTPSConnection, RetryPolicy, deadline
+    from fints.exceptions import FinTSCircuitOpenError, FinTSConnectionError, FinTSTimeoutError
+
+    # A passed deadline stops the dialog before the message number is used up
+    with fints_client:
+        fints_client.get_sepa_accounts()
+        deadline_timeouts = metrics.timeouts.value(url=fints_client.connection.url, kind='deadline')
+        with deadline(0):
+            with pytest.raises(FinTSTimeoutError):
+                fints_client.get_sepa_accounts()
+        with deadline(60):
+            assert fints_client.get_sepa_accounts()
+    assert metrics.timeouts.value(url=fints_client.connection.url, kind='deadline') == deadline_timeouts + 1
+
+    class Message:
+        def __init__(self, dialog_id):
+            self.segments = [SimpleNamespace(dialog_id=dialog_id)]
+
+        def render_bytes(self):
+            return b'HNHB'
+
+    statuses = []
+    requests_seen = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            requests_seen.append(self.path)
+            status = statuses.pop(0) if statuses else 200
+            body = b'SElSTUc6MjoyKzAwMTA6Ok9LJw==' if status == 200 else b''
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    manager = ConnectionManager(failure_threshold=2, reset_timeout=0.2)
+    connection = FinTSHTTPSConnection(url, connection_manager=manager, retry_policy=RetryPolicy(backoff=0.01))
+    try:
+        # Transient server errors are only repeated for a message that opens a dialog
+        retries = metrics.retries.value(url=url, reason='503')
+        request_bytes = metrics.request_bytes.value(url=url, segment='')
+        latency = metrics.latency.value(url=url, segment='')['count']
+        statuses[:] = [503]
+        assert connection.send(Message('0')).find_segment_first('HIRMG')
+        assert len(requests_seen) == 2
+        # Both attempts went over the wire, the latency is that of the successful one
+        assert metrics.request_bytes.value(url=url, segment='') == request_bytes + 2 * len(b'SE5IQg==')
+        assert metrics.latency.value(url=url, segment='')['count'] == latency + 1
+        statuses[:] = [503]
+        with pytest.raises(FinTSConnectionError):
+            connection.send(Message('abc'))
+        assert len(requests_seen) == 3
+        assert metrics.retries.value(url=url, reason='503') == retries + 1
+
+        # After failure_threshold failures in a row, nothing is sent until reset_timeout has passed
+        statuses[:] = [502]
+        with pytest.raises(FinTSConnectionError):
+            connection.send(Message('abc'))
+        assert manager.circuit_breaker(url).state == 'open'
+        with pytest.raises(FinTSCircuitOpenError):
+            connection.send(Message('0'))
+        assert len(requests_seen) == 4
+        assert metrics.circuit_breaker_rejections.value(url=url) >= 1
+        time.sleep(0.2)
+        statuses[:] = []
+        assert connection.send(Message('abc'))
+        assert manager.circuit_breaker(url).state == 'closed'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Requests that could not be sent are always repeated
+    refused = 'http://127.0.0.1:1/'
+    retries = sum(metrics.retries.value(url=refused, reason=reason) for reason in ('ConnectionError', 'ConnectTimeout'))
+    with pytest.raises(FinTSConnectionError) as exc_info:
+        FinTSHTTPSConnection(refused, retry_policy=RetryPolicy(backoff=0.01)).send(Message('abc'))
+    assert isinstance(exc_info.value.__cause__, requests.ConnectionError)
+    assert sum(metrics.retries.value(url=refused, reason=reason) for reason in ('ConnectionError', 'ConnectTimeout')) == retries + 2
+
+    # A server that does not answer
+    with socket.create_server(('127.0.0.1', 0)) as silent:
+        url = 'http://127.0.0.1:{}/'.format(silent.getsockname()[1])
+        start = time.monotonic()
+        with pytest.raises(FinTSTimeoutError):
+            FinTSHTTPSConnection(url, read_timeout=0.1, retry_policy=RetryPolicy(0)).send(Message('0'))
+        with deadline(0.1), pytest.raises(FinTSTimeoutError):
+            FinTSHTTPSConnection(url, retry_policy=RetryPolicy(0)).send(Message('0'))
+        assert time.monotonic() - start < 5
+        assert metrics.timeouts.value(url=url, kind='read') == 2
+
+
+def test_transport_metrics(fints_client, mock_bank, metrics_registry):
+    from fints import metrics
+    from fints.connection import InProcessConnection
+
+    url = fints_client.connection.url
+    before = metrics.requests.value(url=url, segment='HKSPA', outcome='ok')
+    latency_before = metrics.latency.value(url=url, segment='HKSPA')['count']
+    bytes_before = metrics.response_bytes.value(url=url, segment='HKSPA')
+    with fints_client:
+        received = fints_client.connection.bytes_received
+        fints_client.get_sepa_accounts()
+        received = fints_client.connection.bytes_received - received
+
+    # By the command segment of the request
+    assert metrics.requests.value(url=url, segment='HKSPA', outcome='ok') == before + 1
+    assert metrics.requests.value(url=url, segment='HKIDN', outcome='ok') > 0
+    assert metrics.requests.value(url=url, segment='HKEND', outcome='ok') > 0
+    assert metrics.response_bytes.value(url=url, segment='HKSPA') == bytes_before + received
+    assert metrics.latency.value(url=url, segment='HKSPA')['count'] == latency_before + 1
+    assert metrics.decode_time.value(url=url, segment='HKSPA')['count'] > 0
+    assert metrics.parse_time.value(url=url, segment='HKSPA')['sum'] > 0
+
+    snapshot = metrics.registry.snapshot()
+    assert any(entry['labels'] == {'url': url, 'segment': 'HKSPA'} for entry in snapshot['fints_latency_seconds'])
+    text = metrics.registry.prometheus_text()
+    assert '# TYPE fints_latency_seconds histogram' in text
+    assert 'fints_requests_total{{url="{}",segment="HKSPA",outcome="ok"}}'.format(url) in text
+
+    # Nothing is measured when disabled
+    client = FinTS3PinTanClient('12345678', 'test1', '1234', InProcessConnection(mock_bank.process_message), product_id="TEST-123")
+    before = metrics.requests.value(url='', segment='HKSPA', outcome='ok')
+    metrics.registry.enabled = False
+    try:
+        with client:
+            client.get_sepa_accounts()
+    finally:
+        metrics.registry.enabled = True
+    assert metrics.requests.value(url='', segment='HKSPA', outcome='ok') == before
+    with client:
+        client.get_sepa_accounts()
+    assert metrics.requests.value(url='', segment='HKSPA', outcome='ok') == before + 1
+    # No base64 in process
+    assert metrics.decode_time.value(url='', segment='HKSPA')['count'] == 0
@@ -0,0 +1,338 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from fints.client import AsyncFinTS3PinTanClient, FinTS3PinTanClient, NeedTANResponse, ResponseStatus, TransactionResponse
+from fints.connection import AsyncFinTSHTTPSConnection, ConnectionManager, InProcessConnection, RetryPolicy, deadline
+from fints.exceptions import FinTSCircuitOpenError, FinTSClientPINError, FinTSConnectionError, FinTSTimeoutError, FinTSUnsupportedOperation
+
+
+@pytest.fixture
+def fints_client(async_fints_server):
+    return AsyncFinTS3PinTanClient(
+        '12345678',
+        'test1',
+        '1234',
+        async_fints_server,
+        product_id="TEST-123", product_version="1.2.3",
+    )
+
+
+def test_get_sepa_accounts(fints_client):
+    async def main():
+        async with fints_client:
+            accounts = await fints_client.get_sepa_accounts()
+            balance = await fints_client.get_balance(accounts[0])
+            transactions = await fints_client.get_transactions(accounts[0])
+        return accounts, balance, transactions
+
+    accounts, balance, transactions = asyncio.run(main())
+
+    assert accounts[0].iban == 'DE111234567800000001'
+    assert balance.amount.amount == Decimal('1423.60')
+    # Fetched with a touchdown
+    assert len(transactions) == 3
+    assert transactions[0].data['amount'].amount == Decimal('182.34')
+    assert not fints_client._standing_dialog
+
+    with pytest.raises(TypeError):
+        with fints_client:
+            pass
+
+
+def test_pin_wrong(async_fints_server):
+    client = AsyncFinTS3PinTanClient('12345678', 'test1', '99999', async_fints_server, product_id="TEST-123")
+
+    async def main():
+        async with client:
+            pass
+
+    with pytest.raises(FinTSClientPINError):
+        asyncio.run(main())
+    assert client.pin.blocked
+
+
+def test_transfer_2step(fints_client):
+    async def main():
+        async with fints_client:
+            accounts = await fints_client.get_sepa_accounts()
+            a = await fints_client.simple_sepa_transfer(
+                accounts[0],
+                'DE111234567800000002',
+                'GENODE23X42',
+                'Test Receiver',
+                Decimal('2.34'),
+                'Test Sender',
+                'Test transfer 2step'
+            )
+            assert isinstance(a, NeedTANResponse)
+
+            return await fints_client.send_tan(a, '123456')
+
+    b = asyncio.run(main())
+    assert isinstance(b, TransactionResponse)
+    assert b.status == ResponseStatus.SUCCESS
+    assert b.responses[0].text == "Transfer 2.34 to DE111234567800000002 re 'Test transfer 2step'"
+
+
+def test_resume(fints_client, async_fints_server):
+    async def pause():
+        async with fints_client:
+            accounts = await fints_client.get_sepa_accounts()
+            a = await fints_client.simple_sepa_transfer(
+                accounts[0],
+                'DE111234567800000002',
+                'GENODE23X42',
+                'Test Receiver',
+                Decimal('3.42'),
+                'Test Sender',
+                'Test transfer 2step'
+            )
+            return a.get_data(), fints_client._standing_dialog.dialog_id, fints_client.pause_dialog()
+
+    a_data, dialog_id, d_data = asyncio.run(pause())
+    c_data = fints_client.deconstruct(including_private=True)
+
+    client = AsyncFinTS3PinTanClient(
+        '12345678', 'test1', '1234', async_fints_server, from_data=c_data, product_id="TEST-123",
+    )
+
+    async def resume():
+        async with client.resume_dialog(d_data):
+            assert client._standing_dialog.dialog_id == dialog_id
+            return await client.send_tan(NeedTANResponse.from_data(a_data), '123456')
+
+    b = asyncio.run(resume())
+    assert b.status == ResponseStatus.SUCCESS
+    assert b.responses[0].text == "Transfer 3.42 to DE111234567800000002 re 'Test transfer 2step'"
+
+
+def test_concurrent_dialogs(async_fints_server, fints_server):
+    clients = [
+        AsyncFinTS3PinTanClient('12345678', 'test1', '1234', async_fints_server, product_id="TEST-123")
+        for _ in range(10)
+    ]
+
+    async def fetch(client):
+        async with client:
+            accounts = await client.get_sepa_accounts()
+            return await client.get_transactions(accounts[0])
+
+    async def main():
+        try:
+            return await asyncio.gather(*[fetch(client) for client in clients])
+        finally:
+            for client in clients:
+                await client.close()
+
+    results = asyncio.run(main())
+    assert all(client.connection._streams is None for client in clients)
+
+    # Same results as the synchronous client
+    sync_client = FinTS3PinTanClient('12345678', 'test1', '1234', fints_server, product_id="TEST-123")
+    with sync_client:
+        expected = sync_client.get_transactions(sync_client.get_sepa_accounts()[0])
+    assert all([t.data for t in transactions] == [t.data for t in expected] for transactions in results)
+    assert len({client.system_id for client in clients}) == len(clients)
+
+
+def test_connection_reopened():
+    requests = []
+
+    async def handle(reader, writer):
+        # Answers one request per connection, then closes it without saying so
+        await reader.readuntil(b'\r\n\r\n')
+        await reader.readexactly(4)
+        requests.append(writer)
+        writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n10\r\nSElSTUc6MjoyKzAw\r\nc\r\nMTA6Ok9LJw==\r\n0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    class Message:
+        def render_bytes(self):
+            return b'HNHB'
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        async with server:
+            connection = AsyncFinTSHTTPSConnection('http://127.0.0.1:{}/'.format(server.sockets[0].getsockname()[1]))
+            first = await connection.send(Message())
+            await asyncio.sleep(0.01)
+            second = await connection.send(Message())
+            await asyncio.sleep(0.01)
+            third = await connection.send_bytes(b'HNHB')
+            await connection.close()
+        return first, second, third
+
+    first, second, third = asyncio.run(main())
+    assert first.find_segment_first('HIRMG').responses[0].code == second.find_segment_first('HIRMG').responses[0].code == '0010'
+    assert third == b"HIRMG:2:2+0010::OK'"
+    assert len(requests) == 3
+
+    async def refused():
+        await AsyncFinTSHTTPSConnection('http://127.0.0.1:1/').send(Message())
+
+    with pytest.raises(FinTSConnectionError):
+        asyncio.run(refused())
+
+
+def test_connection_closed_after_request():
+    from types import SimpleNamespace
+    requests = []
+
+    async def handle(reader, writer):
+        # Answers the first request of a connection, then reads the next one and closes the connection
+        while await reader.readuntil(b'\r\n\r\n'):
+            await reader.readexactly(4)
+            requests.append(writer)
+            if len(requests) % 2 == 0:
+                writer.close()
+                return
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 28\r\n\r\nSElSTUc6MjoyKzAwMTA6Ok9LJw==")
+            await writer.drain()
+
+    class Message:
+        def __init__(self, dialog_id):
+            self.segments = [SimpleNamespace(dialog_id=dialog_id)]
+
+        def render_bytes(self):
+            return b'HNHB'
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        async with server:
+            connection = AsyncFinTSHTTPSConnection(
+                'http://127.0.0.1:{}/'.format(server.sockets[0].getsockname()[1]), retry_policy=RetryPolicy(0),
+                connection_manager=ConnectionManager(failure_threshold=None),
+            )
+            assert await connection.send(Message('abc'))
+            # The bank may have received the message, it is not sent again
+            with pytest.raises(FinTSConnectionError):
+                await connection.send(Message('abc'))
+            assert len(requests) == 2
+
+            connection.retry_policy = RetryPolicy(1, backoff=0.01)
+            assert await connection.send(Message('abc'))
+            # A message that opens a dialog is repeated
+            assert await connection.send(Message('0'))
+            assert len(requests) == 5
+            await connection.close()
+
+    asyncio.run(main())
+
+
+def test_malformed_response():
+    from types import SimpleNamespace
+    requests = []
+
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        await reader.readexactly(4)
+        requests.append(writer)
+        writer.write(b"garbage\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    class Message:
+        def __init__(self, dialog_id):
+            self.segments = [SimpleNamespace(dialog_id=dialog_id)]
+
+        def render_bytes(self):
+            return b'HNHB'
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        async with server:
+            manager = ConnectionManager(failure_threshold=1)
+            connection = AsyncFinTSHTTPSConnection(
+                'http://127.0.0.1:{}/'.format(server.sockets[0].getsockname()[1]),
+                retry_policy=RetryPolicy(backoff=0.01), connection_manager=manager,
+            )
+            with pytest.raises(FinTSConnectionError, match='Malformed status line'):
+                await connection.send(Message('abc'))
+            # Counted as a failure, and not repeated since the bank may have received the message
+            assert manager.circuit_breaker(connection.url).state == 'open'
+            assert len(requests) == 1
+            with pytest.raises(FinTSCircuitOpenError):
+                await connection.send(Message('0'))
+            assert len(requests) == 1
+            await connection.close()
+
+    asyncio.run(main())
+
+
+def test_in_process_connection(mock_bank):
+    client = AsyncFinTS3PinTanClient(
+        '12345678', 'test1', '1234', InProcessConnection(mock_bank.process_message), product_id="TEST-123",
+    )
+
+    async def main():
+        async with client:
+            accounts = await client.get_sepa_accounts()
+            protocol = await client.get_status_protocol()
+            statement = await client.get_statement(accounts[0], 1, 2020)
+            debit = await client.sepa_debit(accounts[0], '<Document/>')
+            with pytest.raises(FinTSUnsupportedOperation):
+                await client.get_holdings(accounts[0])
+        # InProcessConnection.close() is not a coroutine
+        await client.close()
+        return accounts, protocol, statement, debit
+
+    accounts, protocol, statement, debit = asyncio.run(main())
+    assert accounts[0].iban == 'DE111234567800000001'
+    assert protocol == [] and statement is None
+    assert isinstance(debit, TransactionResponse)
+
+
+def test_timeouts_and_retries():
+    from types import SimpleNamespace
+    statuses = []
+    requests = []
+
+    async def handle(reader, writer):
+        while await reader.readuntil(b'\r\n\r\n'):
+            await reader.readexactly(4)
+            requests.append(writer)
+            status = statuses.pop(0) if statuses else 200
+            if status is None:
+                continue  # No answer
+            body = b'SElSTUc6MjoyKzAwMTA6Ok9LJw==' if status == 200 else b''
+            writer.write(b"HTTP/1.1 %d X\r\nContent-Length: %d\r\n\r\n%s" % (status, len(body), body))
+            await writer.drain()
+
+    class Message:
+        def __init__(self, dialog_id):
+            self.segments = [SimpleNamespace(dialog_id=dialog_id)]
+
+        def render_bytes(self):
+            return b'HNHB'
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        async with server:
+            connection = AsyncFinTSHTTPSConnection(
+                'http://127.0.0.1:{}/'.format(server.sockets[0].getsockname()[1]),
+                read_timeout=0.1, retry_policy=RetryPolicy(backoff=0.01),
+                connection_manager=ConnectionManager(failure_threshold=None),
+            )
+            # Only a message that opens a dialog is repeated after a server error or a timeout
+            statuses[:] = [503, None]
+            assert await connection.send(Message('0'))
+            assert len(requests) == 3
+            statuses[:] = [503]
+            with pytest.raises(FinTSConnectionError):
+                await connection.send(Message('abc'))
+            statuses[:] = [None]
+            with pytest.raises(FinTSTimeoutError):
+                await connection.send(Message('abc'))
+            assert len(requests) == 5
+
+            connection.read_timeout = None
+            statuses[:] = [None]
+            with deadline(0.1):
+                with pytest.raises(FinTSTimeoutError):
+                    await connection.send(Message('abc'))
+            await connection.close()
+
+    asyncio.run(main())
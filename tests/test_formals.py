@@ -307,6 +307,52 @@ def test_empty_list():
     assert len(i2.a) == 0
 
 
+def test_valuelist_length_tracking():
+    class A(Container):
+        a = NumericField()
+
+    class B(Container):
+        b = DataElementGroupField(type=A, max_count=5)
+
+    class C(Container):
+        c = DataElementGroupField(type=A)
+
+    class D(Container):
+        d = DataElementGroupField(type=C, max_count=5)
+
+    i1 = B(b=[A(a=1), A(a=2)])
+    assert len(i1.b) == 2
+
+    # Trailing empty items are not counted, until they are modified
+    item = i1.b[3]
+    assert len(i1.b) == 2
+    item.a = 4
+    assert len(i1.b) == 4
+    assert [x.a for x in i1.b] == [1, 2, None, 4]
+
+    i1.b[3].a = None
+    assert len(i1.b) == 2
+    i1.b[0].a = None
+    assert len(i1.b) == 2
+    i1.b[1].a = None
+    assert len(i1.b) == 0
+
+    # Modifications further down are tracked as well
+    i2 = D(d=[C(c=A(a=1)), C(c=A())])
+    inner = i2.d[1].c
+    assert len(i2.d) == 1
+    inner.a = 5
+    assert len(i2.d) == 2
+
+    i3 = B()
+    i3.b.extend([A(a=1), None, A(a=3)])
+    assert len(i3.b) == 3
+    assert isinstance(i3.b[1], A)
+    with pytest.raises(IndexError, match='beyound max_count 5'):
+        i3.b.extend([A(a=4), A(a=5), A(a=6)])
+    assert len(i3.b) == 3
+
+
 def test_segmentheader_short():
     h = SegmentHeader('HNHBS', 5, 1)
 
@@ -362,3 +408,47 @@ def test_find_by_class():
     assert list(m.find_segments(HNHBS1))[0].__class__ == HNHBS1
 
     assert m.find_segment_first(HNHBS1).header.type == 'HNHBS'
+
+
+def test_find_index():
+    import pickle
+    from conftest import TEST_MESSAGES
+    from fints.parser import FinTS3Parser
+    from fints.segments.dialog import HIRMS2, HKEND1
+    from fints.segments.message import HNHBS1, HNVSD1
+
+    m = FinTS3Parser().parse_message(TEST_MESSAGES['basic_complicated'])
+
+    def scan(query, recurse=True):
+        for s in m.segments:
+            if s.header.type in query:
+                yield s
+            if recurse and isinstance(s, HNVSD1):
+                yield from (n for n in s.data.segments if n.header.type in query)
+
+    # Message order, each segment only once
+    assert list(m.find_segments(['HIRMS', 'HNHBS', HIRMS2, 'HNHBK'])) == list(scan(('HIRMS', 'HNHBS', 'HNHBK')))
+    assert list(m.find_segments(['HNVSD', 'HNSHK'])) == list(scan(('HNVSD', 'HNSHK')))
+    assert list(m.find_segments(['HNVSD', 'HNSHK'], recurse=False)) == list(scan(('HNVSD', 'HNSHK'), recurse=False))
+
+    hirms = list(m.find_segments(HIRMS2))
+    assert [s.header.reference for s in hirms] == [5, 4]
+    assert list(m.find_segments(HIRMS2, reference=4)) == hirms[1:]
+    assert list(m.find_segments('HIRMS', reference=(4, 5))) == hirms
+    assert hirms[0] in list(m.find_segments(reference=5))
+
+    # Modifications of the segment list, of segment headers and of nested messages are seen
+    m.segments.append(HNHBS1(7))
+    assert len(list(m.find_segments(HNHBS1))) == 2
+    hirms[0].header.reference = 4
+    assert list(m.find_segments(HIRMS2, reference=4)) == hirms
+    nested = m.find_segment_first(HNVSD1).data
+    nested.segments.append(HKEND1('4711'))
+    assert m.find_segment_first('HKEND').dialog_id == '4711'
+    del nested.segments[-1]
+    assert m.find_segment_first('HKEND') is None
+    m.segments = m.segments[:1]
+    assert m.find_segment_first(HIRMS2) is None
+
+    b = pickle.loads(pickle.dumps(m))
+    assert repr(b.find_segment_first('HNHBK')) == repr(m.segments[0])
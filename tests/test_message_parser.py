@@ -1,7 +1,7 @@
 import pytest
 from conftest import TEST_MESSAGES
 from fints.formals import SegmentSequence
-from fints.parser import FinTS3Parser, FinTSParserError, FinTSParserWarning
+from fints.parser import FinTS3Parser, FinTS3StreamParser, FinTSParserError, FinTSParserWarning
 from fints.segments.base import FinTS3Segment
 
 
@@ -132,3 +132,229 @@ def test_robust_mode(mocker):
     with pytest.warns(FinTSParserWarning, match='^Ignoring parser error.*: Required field'):
         m = FinTS3Parser().parse_message(message1)
         assert m.segments[0].__class__ == FinTS3Segment
+
+
+def test_tokenizer_does_not_copy(monkeypatch):
+    import fints.parser
+    from fints.parser import ParserState, Token
+
+    data = b"HIRMS:3:2:4+0010::Nachricht entgegengenommen.+3040::Weitere Daten?: 1'HIKAZ:5:7:4+@12@:20:STARTUMS'" * 10
+    calls = []
+
+    class RecordingPattern:
+        def match(self, buffer, pos, end):
+            calls.append((buffer, pos))
+            return TOKEN_RE.match(buffer, pos, end)
+
+    TOKEN_RE = fints.parser.TOKEN_RE
+    monkeypatch.setattr(fints.parser, 'TOKEN_RE', RecordingPattern())
+    parser = ParserState(data)
+    while parser.peek() != Token.EOF:
+        parser.consume()
+
+    # Scanned by offset in the original buffer, slicing the rest of the buffer for every token
+    # would make tokenizing quadratic in the size of the message
+    assert calls and all(buffer is data for buffer, pos in calls)
+    assert [pos for buffer, pos in calls] == sorted({pos for buffer, pos in calls})
+
+
+def test_parse_zero_copy():
+    from fints.segments.message import HNVSD1
+
+    data = TEST_MESSAGES['basic_complicated']
+    m = FinTS3Parser(zero_copy=True).parse_message(data)
+    hnvsd = m.find_segment_first(HNVSD1, recurse=False)
+    assert isinstance(hnvsd._values[HNVSD1._fields['data']._index], SegmentSequence)
+
+    # Binary data elements reference the input buffer until they are read
+    seg = m.segments[1]
+    deg = seg.encryption_algorithm
+    raw = deg._values[deg._fields['algorithm_parameter_value']._index]
+    assert isinstance(raw, memoryview)
+    assert raw.obj is data
+    assert deg.algorithm_parameter_value == b'00000000'
+    assert isinstance(deg._values[deg._fields['algorithm_parameter_value']._index], bytes)
+
+    assert m.render_bytes() == FinTS3Parser().parse_message(data).render_bytes()
+    assert SegmentSequence(memoryview(data)).render_bytes() == m.render_bytes()
+
+
+def test_index_segments():
+    data = b"HIRMG:2:2:+3060::Teil?'weise?@'HIKAZ:3:7:2+@6@ab'c+d'TST:4:1'"
+    index = FinTS3Parser.index_segments(data)
+    assert [data[start:end] for start, end, header in index] == [
+        b"HIRMG:2:2:+3060::Teil?'weise?@'",
+        b"HIKAZ:3:7:2+@6@ab'c+d'",
+        b"TST:4:1'",
+    ]
+    assert [header for start, end, header in index] == [
+        ('HIRMG', 2, 2, None),
+        ('HIKAZ', 3, 7, 2),
+        ('TST', 4, 1, None),
+    ]
+
+    with pytest.raises(ValueError):
+        FinTS3Parser.index_segments(b"HIRMG:2:2+@12@ab'")
+
+
+@pytest.mark.parametrize("input_name", TEST_MESSAGES.keys())
+def test_parse_lazy(input_name):
+    from fints.segments.dialog import HIRMS2
+    from fints.types import LazySegmentList
+
+    data = TEST_MESSAGES[input_name]
+    m = FinTS3Parser(lazy=True).parse_message(data)
+    assert isinstance(m.segments, LazySegmentList)
+    assert not any(m.segments.is_parsed(i) for i in range(len(m.segments)))
+
+    responses = list(m.find_segments(HIRMS2))
+    inner = m.segments[2].data.segments
+    assert isinstance(inner, LazySegmentList)
+    parsed = [i for i in range(len(inner)) if inner.is_parsed(i)]
+    assert len(parsed) == len(responses)
+    assert all(inner[i].header.type == 'HIRMS' for i in parsed)
+
+    eager = FinTS3Parser().parse_message(data)
+    assert repr(m) == repr(eager)
+    assert m.render_bytes() == eager.render_bytes()
+    assert repr(SegmentSequence(data, lazy=True)) == repr(eager)
+
+
+def test_lazy_segment_list_mutation():
+    from fints.segments.dialog import HKEND1
+
+    m = FinTS3Parser(lazy=True).parse_message(TEST_MESSAGES['basic_simple'])
+    m.segments.insert(1, HKEND1('4711'))
+    del m.segments[2:4]
+    assert [s.header.type for s in m.segments] == ['HNHBK', 'HKEND', 'HNHBS']
+    assert m.find_segment_first('HKEND').dialog_id == '4711'
+
+
+def test_command_responses():
+    from fints.message import FinTSInstituteMessage
+    from fints.segments.dialog import HIRMS2, HKEND1
+
+    m = FinTSInstituteMessage(segments=TEST_MESSAGES['basic_complicated'])
+    command = HKEND1('4711')
+    command.header.number = 4
+
+    responses = m.command_responses(command)
+    assert [r.code for r in responses.responses()] == ['3050', '3050', '3920', '0020']
+    assert [r.code for r in m.responses(command, '3920')] == ['3920']
+    assert responses.has_code('0030', '0020') and not responses.has_code('0030')
+    assert all(s.header.reference == 4 for s in m.response_segments(command, HIRMS2))
+    assert [s.header.type for s in responses.segments()][:2] == ['HIRMS', 'HIBPA']
+
+    # The view follows modifications of the responses
+    response = m.find_segment_first(HIRMS2, reference=4).responses[0]
+    response.code = '0030'
+    assert responses.has_code('0030')
+    assert [r.code for r in m.responses(command, '0030')] == ['0030']
+
+
+@pytest.mark.parametrize("input_name", TEST_MESSAGES.keys())
+def test_parse_engines(input_name):
+    from fints.parser import PARSER_ENGINES
+
+    data = TEST_MESSAGES[input_name]
+    generic = FinTS3Parser(engine='generic').parse_message(data)
+    for engine in PARSER_ENGINES:
+        for trusted in (False, True):
+            m = FinTS3Parser(engine=engine, trusted=trusted).parse_message(data)
+            assert repr(m) == repr(generic)
+            assert m.render_bytes() == generic.render_bytes()
+
+
+def test_parse_trusted():
+    from fints.segments.saldo import HISAL5
+
+    # Values are not checked
+    data = b"HNHBS:5:1+02'"
+    with pytest.raises(FinTSParserError):
+        FinTS3Parser().parse_message(data)
+    for engine in ('plan', 'codegen'):
+        assert FinTS3Parser(engine=engine, trusted=True).parse_message(data).segments[0].message_number == 2
+
+    # Until the segment is serialized
+    data = b"HISAL:3:5:3+1234567890::280:12345678+" + b"Girokonto" * 4 + b"+EUR+C:1,5:EUR:20180101'"
+    with pytest.raises(FinTSParserError):
+        FinTS3Parser().parse_message(data)
+    for engine in ('plan', 'codegen'):
+        m = FinTS3Parser(engine=engine, trusted=True).parse_message(data)
+        assert isinstance(m.segments[0], HISAL5)
+        with pytest.raises(ValueError, match='max_length=30 exceeded'):
+            m.render_bytes()
+
+    with pytest.raises(FinTSParserError):
+        FinTS3Parser(trusted=True).parse_message(b"HISAL:3:5:3+1::280:12345678+Girokonto+EUR+C:x:EUR:20180101'")
+
+
+def test_parse_engine_invalid():
+    with pytest.raises(ValueError):
+        FinTS3Parser(engine='foo')
+
+
+@pytest.mark.parametrize("input_name", TEST_MESSAGES.keys())
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 100000])
+def test_stream_parser(input_name, chunk_size):
+    data = TEST_MESSAGES[input_name]
+    eager = FinTS3Parser().parse_message(data)
+
+    def feed_all(parser):
+        retval = []
+        for i in range(0, len(data), chunk_size):
+            retval.extend(parser.feed(data[i:i+chunk_size]))
+        parser.close()
+        return retval
+
+    assert repr(SegmentSequence(feed_all(FinTS3StreamParser()))) == repr(eager)
+
+    unwrapped = feed_all(FinTS3StreamParser(unwrap=True))
+    inner = eager.find_segment_first('HNVSD').data
+    assert [s.header.type for s in unwrapped] == ['HNHBK', 'HNVSK'] + [s.header.type for s in inner.segments] + ['HNHBS']
+    assert repr(unwrapped[2:-1]) == repr(inner.segments)
+
+    enveloped = SegmentSequence(feed_all(FinTS3StreamParser(unwrap=True, keep_envelope=True)))
+    assert repr(enveloped) == repr(eager)
+    assert enveloped.render_bytes() == data
+
+
+def test_stream_parser_boundaries():
+    p = FinTS3StreamParser()
+    assert p.feed(b"HNHBS:5:1+5+x?") == []
+    assert p.feed(b"'y+@1") == []
+    assert p.feed(b"2@abcdefghi'jk") == []
+    segment, = p.feed(b"'HNHBS:6:1+6")
+    assert segment.message_number == 5
+    assert segment._additional_data == ["x'y", b"abcdefghi'jk"]
+
+    with pytest.raises(FinTSParserError):
+        p.close()
+    assert p.feed(b"'")[0].message_number == 6
+    p.close()
+
+    with pytest.raises(FinTSParserError):
+        FinTS3StreamParser().feed(b"HNHBS:5:1+@1x@'")
+
+
+@pytest.mark.parametrize("input_name", TEST_MESSAGES.keys())
+@pytest.mark.parametrize("lazy", [False, True])
+def test_parse_skim(input_name, lazy):
+    import fints.formals  # noqa, for eval()
+    from fints.segments.base import SkimmedSegment
+    from fints.segments.dialog import HIRMG2
+
+    data = TEST_MESSAGES[input_name]
+    m = FinTS3Parser(skim={'HIRMG', 'HIRMS'}, lazy=lazy).parse_message(data)
+    eager = FinTS3Parser().parse_message(data)
+
+    assert m.render_bytes() == data
+    assert repr(list(m.find_segments(('HIRMG', 'HIRMS')))) == repr(list(eager.find_segments(('HIRMG', 'HIRMS'))))
+    assert isinstance(m.find_segment_first(HIRMG2), HIRMG2)
+
+    hnhbk = m.segments[0]
+    assert isinstance(hnhbk, SkimmedSegment)
+    assert hnhbk.header.type == 'HNHBK'
+    assert hnhbk._raw.startswith(b'0000000')
+    assert repr(eval(repr(hnhbk))) == repr(hnhbk)
+    assert not any(isinstance(s, SkimmedSegment) for s in m.find_segments('HNVSD'))
@@ -138,3 +138,192 @@ def test_serialize_roundtrips_complex_1():
     b3 = m3.render_bytes()
 
     assert b2 == b3
+
+
+
+@pytest.mark.parametrize("input_name", TEST_MESSAGES.keys())
+def test_serialize_engines(input_name):
+    import io
+    from fints.parser import SERIALIZER_ENGINES
+
+    message = FinTS3Parser().parse_message(TEST_MESSAGES[input_name])
+    expected = FinTS3Serializer(engine='generic').serialize_message(message)
+    for engine in SERIALIZER_ENGINES:
+        assert FinTS3Serializer(engine=engine).serialize_message(message) == expected
+
+        sink = io.BytesIO()
+        assert FinTS3Serializer(engine=engine).serialize_message(message, sink) is None
+        assert sink.getvalue() == expected
+
+        # A sink that keeps the objects it is given
+        chunks = []
+        sink = type('ListSink', (), {'write': lambda self, data: chunks.append(data)})()
+        FinTS3Serializer(engine=engine).serialize_message(message, sink)
+        assert len(chunks) == len(message.segments) and b''.join(chunks) == expected
+
+
+def test_serialize_trailing_empty():
+    from fints.formals import KTI1, BankIdentifier
+    from fints.segments.transfer import HKCCS1
+
+    s = HKCCS1(
+        account=KTI1('DE12', None, None, None, BankIdentifier('280', None)),
+        sepa_descriptor='x:y',
+        sepa_pain_message=b'abc',
+    )
+    s.header.number = 3
+    for engine in ('direct', 'generic'):
+        assert FinTS3Serializer(engine=engine).serialize_message(s) == b"HKCCS:3:1+DE12::::280+x?:y+@3@abc'"
+
+
+def _sample_value(field, variant):
+    from fints.fields import SegmentSequenceField
+    from fints.formals import SegmentSequence
+    from fints.segments.message import HNHBS1
+
+    if isinstance(field, SegmentSequenceField):
+        return SegmentSequence([HNHBS1(message_number=variant + 1)])
+
+    candidates = [e.value for e in getattr(field, '_enum', None) or []]
+    candidates += [str(variant + 1), 'J', '20180101', '120000', '1,5', 'EUR', 'x?+:\'@', b'x\'' * (variant + 1)]
+    if field.length:
+        candidates.append('1' * field.length)
+    for candidate in candidates:
+        try:
+            field._check_value(field._parse_value(candidate))
+            return candidate
+        except (ValueError, TypeError):
+            pass
+    return None
+
+
+def _populate(clazz, variant):
+    """Construct an instance of clazz with sample values in its fields, variant 0 fills all fields,
+    variant 1 only the required ones and variant 2 the required ones and every other optional field."""
+    from fints.fields import DataElementGroupField
+
+    retval = clazz()
+    for number, (name, field) in enumerate(clazz._fields.items()):
+        if name == 'header':
+            continue
+        if variant == 1 and not field.required:
+            continue
+        if variant == 2 and number % 2 and not field.required:
+            continue
+        for i in range(field.count or min(field.max_count or 2, 2)):
+            if isinstance(field, DataElementGroupField):
+                value = _populate(field.type, variant)
+            else:
+                value = _sample_value(field, variant)
+            if field.count == 1:
+                setattr(retval, name, value)
+            else:
+                getattr(retval, name)[i] = value
+    return retval
+
+
+def _segment_classes():
+    import fints.parser  # noqa, loads all segment classes
+
+    return sorted(
+        (clazz for clazz in FinTS3Segment._all_subclasses() if clazz.__module__.startswith('fints.segments.')),
+        key=lambda clazz: (clazz.__module__, clazz.__name__)
+    )
+
+
+@pytest.mark.parametrize("clazz", _segment_classes(), ids=lambda clazz: clazz.__name__)
+def test_engines_differential(clazz):
+    import warnings
+    from fints.parser import PARSER_ENGINES, SERIALIZER_ENGINES
+
+    def outcome(func, *args):
+        # Not every sample value survives a round trip, but all engines must behave the same
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                return func(*args)
+        except Exception as e:
+            return (e.__class__, str(e))
+
+    for variant in range(3):
+        segment = _populate(clazz, variant)
+        segment.header.number = variant + 1
+
+        data, = set(outcome(FinTS3Serializer(engine=engine).serialize_message, segment) for engine in SERIALIZER_ENGINES)
+        assert isinstance(data, bytes)
+
+        parsed = [outcome(FinTS3Parser(engine=engine).parse_message, data) for engine in PARSER_ENGINES]
+        assert len(set(repr(m) for m in parsed)) == 1
+        for m in parsed:
+            if isinstance(m, tuple):
+                continue
+            assert len(set(type(s) for s in m.segments)) == 1
+            for engine in SERIALIZER_ENGINES:
+                assert FinTS3Serializer(engine=engine).serialize_message(m) == data
+
+
+def test_serialize_render_cache():
+    from fints.formals import KTI1, BankIdentifier, Response
+    from fints.segments.dialog import HIRMS2
+    from fints.segments.saldo import HKSAL7
+
+    serializer = FinTS3Serializer()
+    uncached = FinTS3Serializer(cache=False)
+
+    s = HKSAL7(account=KTI1('DE12', None, None, None, BankIdentifier('280', '1234')), all_accounts=False)
+    s.header.number = 3
+    assert serializer.serialize_message(s) == b"HKSAL:3:7+DE12::::280:1234+N'"
+    assert s._render_cache
+
+    s.all_accounts = True
+    assert s._render_cache is None
+    assert serializer.serialize_message(s) == b"HKSAL:3:7+DE12::::280:1234+J'"
+
+    # Modifications of nested groups invalidate all containers that include them
+    s.account.bank_identifier.bank_code = '5678'
+    assert s._render_cache is None and s.account._render_cache is None
+    assert serializer.serialize_message(s) == b"HKSAL:3:7+DE12::::280:5678+J'"
+
+    # A group included in two segments invalidates both
+    s2 = HKSAL7(account=s.account, all_accounts=False)
+    s2.header.number = 4
+    assert serializer.serialize_message([s, s2]) == b"HKSAL:3:7+DE12::::280:5678+J'HKSAL:4:7+DE12::::280:5678+N'"
+    s.account.iban = 'DE34'
+    assert serializer.serialize_message([s, s2]) == b"HKSAL:3:7+DE34::::280:5678+J'HKSAL:4:7+DE34::::280:5678+N'"
+
+    r = HIRMS2(responses=[Response('0010', None, 'a'), Response('0020', None, 'b')])
+    r.header.number = 5
+    assert serializer.serialize_message(r) == b"HIRMS:5:2+0010::a+0020::b'"
+    r.responses[1] = Response('3050', None, 'c')
+    assert serializer.serialize_message(r) == b"HIRMS:5:2+0010::a+3050::c'"
+    r.responses[0].text = 'd'
+    assert serializer.serialize_message(r) == b"HIRMS:5:2+0010::d+3050::c'"
+
+    # The cache is not pickled
+    assert r._render_cache and r.responses[0]._render_parents
+    assert '_render_cache' not in r.__getstate__()
+    assert '_render_parents' not in r.responses[0].__getstate__()
+
+    for name, data in TEST_MESSAGES.items():
+        message = FinTS3Parser().parse_message(data)
+        expected = uncached.serialize_message(message)
+        assert serializer.serialize_message(message) == expected
+        assert serializer.serialize_message(message) == expected
+
+
+def test_serialize_render_cache_uncacheable():
+    from fints.formals import UserDefinedSignature
+    from fints.parser import is_render_cacheable
+    from fints.segments.message import HNSHA2, HNVSD1
+    from fints.utils import Password
+
+    assert not is_render_cacheable(HNSHA2)
+    assert not is_render_cacheable(HNVSD1)
+
+    pin = Password('1234')
+    s = HNSHA2(security_reference='1', user_defined_signature=UserDefinedSignature(pin=pin))
+    s.header.number = 3
+    serializer = FinTS3Serializer()
+    assert serializer.serialize_message(s) == b"HNSHA:3:2+1++1234'"
+    with pin.protect():
+        assert serializer.serialize_message(s) == b"HNSHA:3:2+1++***'"
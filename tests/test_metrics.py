@@ -0,0 +1,61 @@
+import math
+
+import pytest
+from fints.metrics import MetricsRegistry
+
+
+def test_counter():
+    assert not MetricsRegistry().enabled
+    registry = MetricsRegistry(enabled=True)
+    counter = registry.counter('test_total', "Things", ('url', 'kind'))
+    assert registry.counter('test_total', "Things", ('url', 'kind')) is counter
+    with pytest.raises(ValueError):
+        registry.histogram('test_total', "Things")
+
+    counter.inc(url='https://a/', kind='x')
+    counter.inc(2, url='https://a/', kind='x')
+    counter.inc(url='https://b/', kind='y')
+    assert counter.value(url='https://a/', kind='x') == 3
+    assert counter.value(url='https://a/', kind='y') == 0
+    assert registry.snapshot() == {'test_total': [
+        {'labels': {'url': 'https://a/', 'kind': 'x'}, 'value': 3},
+        {'labels': {'url': 'https://b/', 'kind': 'y'}, 'value': 1},
+    ]}
+
+    registry.enabled = False
+    counter.inc(url='https://a/', kind='x')
+    assert counter.value(url='https://a/', kind='x') == 3
+    registry.clear()
+    assert registry.snapshot() == {'test_total': []}
+
+
+def test_histogram():
+    registry = MetricsRegistry(enabled=True)
+    histogram = registry.histogram('test_seconds', "Time", ('url', ), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, url='https://a/')
+
+    value = histogram.value(url='https://a/')
+    assert value['count'] == 4 and value['sum'] == pytest.approx(3.65)
+    assert value['buckets'] == {0.1: 2, 1.0: 3, math.inf: 4}
+    assert registry.snapshot()['test_seconds'][0]['labels'] == {'url': 'https://a/'}
+    assert histogram.value(url='https://b/')['count'] == 0
+
+
+def test_prometheus_text():
+    registry = MetricsRegistry(enabled=True)
+    registry.counter('test_total', "Things\nthat happened", ('url', )).inc(url='https://a/"x"\\')
+    registry.histogram('test_seconds', "Time", ('url', ), buckets=(0.5, 1)).observe(0.25, url='https://a/')
+
+    assert registry.prometheus_text() == (
+        '# HELP test_total Things\\nthat happened\n'
+        '# TYPE test_total counter\n'
+        'test_total{url="https://a/\\"x\\"\\\\"} 1\n'
+        '# HELP test_seconds Time\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{url="https://a/",le="0.5"} 1\n'
+        'test_seconds_bucket{url="https://a/",le="1"} 1\n'
+        'test_seconds_bucket{url="https://a/",le="+Inf"} 1\n'
+        'test_seconds_sum{url="https://a/"} 0.25\n'
+        'test_seconds_count{url="https://a/"} 1\n'
+    )
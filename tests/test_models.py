@@ -130,6 +130,21 @@ def test_find_subclass():
     assert clazz is HNHBS1
 
 
+def test_find_subclass_registry():
+    from fints.fields import NumericField
+    from fints.segments.base import FinTS3SegmentMeta
+
+    assert FinTS3SegmentMeta.registry[('HNHBS', 1)] is HNHBS1
+    assert FinTS3Segment.lookup_subclass('HNHBS', 1) is HNHBS1
+    assert FinTS3Segment.lookup_subclass('HNHBS', 99) is FinTS3Segment
+
+    class IREG1(FinTS3Segment):
+        a = NumericField()
+
+    assert FinTS3Segment.find_subclass([['IREG', '1', '1'], '1']) is IREG1
+    assert HNHBS1.lookup_subclass('IREG', 1) is HNHBS1
+
+
 def test_nested_output_evalable():
     import fints.segments, fints.formals
 
@@ -224,3 +239,45 @@ def test_nested_output_evalable():
 
     for s1, s2 in zip(a.segments, b.segments):
         assert type(s1) == type(s2)
+
+
+def test_container_storage():
+    import pickle
+    from fints.formals import TransactionTanRequired
+    from fints.parser import FinTS3Parser
+    from fints.segments.auth import HIPINS1
+    from fints.segments.saldo import HKSAL7
+
+    # Values live in a list by field position, there is no instance __dict__
+    a = HNHBS1(message_number=3)
+    assert not hasattr(a, '__dict__')
+    assert a._values == [a.header, 3]
+    with pytest.raises(AttributeError):
+        a.foo = 1
+
+    # Unset fields are not stored, mutable defaults are stored on first access
+    s = HKSAL7()
+    account_index = HKSAL7._fields['account']._index
+    assert s._values[account_index] is None
+    assert s.max_number_responses is None
+    assert s._values == [s.header, None, None, None, None]
+    s.account.iban = 'DE12'
+    assert s._values[account_index] is s.account
+    assert s.account.iban == 'DE12'
+
+    # Trailing empty items of a list are not stored, but still there when accessed
+    m = FinTS3Parser().parse_message(b"HIPINS:3:1:4+1+1+1+5:20:6:Benutzer ID::HKSPA:N:HKKAZ:N'")
+    hipins = m.segments[0]
+    assert isinstance(hipins, HIPINS1)
+    transactions = hipins.parameter.transaction_tans_required
+    assert len(transactions._data) == 2
+    assert len(transactions) == 2
+    assert isinstance(transactions[5], TransactionTanRequired) and transactions[5].is_unset()
+    assert [t.transaction for t in transactions] == ['HKSPA', 'HKKAZ']
+
+    # Short codes are interned
+    m = FinTS3Parser().parse_message(b"HIPINS:3:1:4+1+1+1+5:20:6:Benutzer ID::HKSPA:N:HKKAZ:N'")
+    assert m.segments[0].parameter.transaction_tans_required[0].transaction is hipins.parameter.transaction_tans_required[0].transaction
+
+    b = pickle.loads(pickle.dumps(hipins))
+    assert repr(b) == repr(hipins)